@@ -0,0 +1,258 @@
+"""Batch normalization and validation of scraped addresses, phone numbers and websites.
+
+Works on whole pandas columns at a time. Each address is split into its
+street, city, state and zip code by one precompiled pattern with
+Series.str.extract, rather than a regex per part per address, so cities of
+any number of words parse. normalize_clinics() cleans a frame of clinics the
+way the scraper needs, and lists the values it had to drop as rejects, with
+why. normalize_clinic() does the same to one clinic dict with the same
+patterns, for the loaders, which stream rows instead of building frames.
+
+pandas is slow to import, so it's only imported by the functions that use
+it; the web app only needs the patterns.
+"""
+import csv
+import re
+
+US_STATES = frozenset({
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY', 'LA',
+    'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND', 'OH', 'OK',
+    'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY', 'DC', 'PR', 'GU', 'VI',
+    'AS', 'MP'})
+
+# "1 Main St, Suite 5, San Jose, CA 95110-1234, USA": the street is everything
+# before the last comma ahead of the city, which is words without digits.
+_STATE_ZIP = r"""
+    (?P<state>[A-Za-z]{2})\.?
+    (?:[\s,]+(?P<zip_code>\d{5})(?:-\d{4})?)?
+    (?:\s*,?\s*(?:USA|US|United\ States))?
+    \s*$"""
+ADDRESS_PATTERN = re.compile(r"""
+    ^\s*
+    (?:(?P<street_address>.*\S)\s*,\s*)?
+    (?P<city>[A-Za-z][A-Za-z.'\ -]*?)
+    (?:\s*,\s*|\s+)""" + _STATE_ZIP, re.VERBOSE)
+# The state and zip code of addresses whose street and city run together.
+STATE_ZIP_PATTERN = re.compile(r"(?:^|[\s,])" + _STATE_ZIP, re.VERBOSE)
+
+# A zip code as the scraper or pandas wrote it: 95110, 95110.0 or 95110-1234.
+ZIP_PATTERN = re.compile(r"(\d{1,5})(?:\.0*)?(?:-\d{4})?")
+PHONE_PATTERN = re.compile(r"""
+    ^\s*(?:\+?1[\s.-]*)?
+    \(?(\d{3})\)?[\s.-]*(\d{3})[\s.-]*(\d{4})
+    \s*(?:(?:x|ext\.?)\s*(\d+))?\s*$""", re.VERBOSE | re.IGNORECASE)
+WEBSITE_PATTERN = re.compile(r"""
+    ^\s*(?:(?P<scheme>https?)://)?
+    (?P<host>[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,})
+    (?P<rest>[/?\#]\S*)?\s*$""", re.VERBOSE | re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+ADDRESS_FIELDS = ('street_address', 'city', 'state', 'zip_code')
+REJECT_FIELDS = ('row', 'field', 'value', 'reason')
+
+
+def blank_to_na(values):
+    """values as a string Series, stripped, with blanks as NA."""
+
+    import pandas as pd
+    values = pd.Series(values, dtype='string').str.strip()
+    return values.mask(values == '')
+
+def to_python(values):
+    """A Series' values as Python objects, with None for NA, i.e. for to_dict()."""
+
+    return values.astype(object).where(values.notna(), None)
+
+def parse_addresses(addresses):
+    """DataFrame of the street_address, city, state and zip_code of each address, aligned with addresses.
+
+    Parts missing from an address are NA, every part when it isn't one.
+    """
+
+    addresses = blank_to_na(addresses)
+    parts = addresses.str.extract(ADDRESS_PATTERN)
+    missed = addresses.notna() & parts['state'].isna()
+    if missed.any():
+        parts.loc[missed, ['state', 'zip_code']] = addresses[missed].str.extract(STATE_ZIP_PATTERN).to_numpy()
+    parts['street_address'] = parts['street_address'].str.replace(WHITESPACE_PATTERN, ' ', regex=True)
+    parts['city'] = parts['city'].str.replace(WHITESPACE_PATTERN, ' ', regex=True).str.strip().str.title()
+    parts['state'] = parts['state'].str.upper()
+    return parts[list(ADDRESS_FIELDS)]
+
+def normalize_zip_codes(zip_codes):
+    """Five digit zip codes, i.e. '95110' for '95110.0' or 95110.0; NA where there isn't one."""
+
+    import pandas as pd
+    zip_codes = pd.Series(zip_codes)
+    if pd.api.types.is_float_dtype(zip_codes):
+        # As pandas reads a column of zip codes with blanks.
+        zip_codes = zip_codes.map(lambda z: f'{z:.0f}', na_action='ignore')
+    return blank_to_na(zip_codes).str.extract(f'^{ZIP_PATTERN.pattern}$', expand=False).str.zfill(5)
+
+def normalize_phones(phones):
+    """Phone numbers written as '(408) 555-0100', with ' x12' for an extension; NA where not one."""
+
+    parts = blank_to_na(phones).str.extract(PHONE_PATTERN)
+    formatted = '(' + parts[0] + ') ' + parts[1] + '-' + parts[2]
+    return formatted.mask(parts[3].notna(), formatted + ' x' + parts[3])
+
+def normalize_websites(websites):
+    """Website URLs with a scheme, http:// when they had none, and a lower-cased host; NA where not one."""
+
+    parts = blank_to_na(websites).str.extract(WEBSITE_PATTERN)
+    return parts['scheme'].str.lower().fillna('http') + '://' + parts['host'].str.lower() + parts['rest'].fillna('')
+
+def _rejected(rejects, values, cleaned, field, reason):
+    """Note the values present before cleaning but not after, as rejects of field."""
+
+    lost = values.notna() & cleaned.isna()
+    if lost.any():
+        import pandas as pd
+        rejects.append(pd.DataFrame({'row': values.index[lost], 'field': field,
+                                     'value': values[lost].to_numpy(), 'reason': reason}))
+
+def normalize_clinics(clinics):
+    """(clinics, rejects) of a DataFrame of clinics, or vets with their clinic's fields.
+
+    An address column is split into street_address, city, state and zip_code,
+    filling in those columns; the others are cleaned where present. Values
+    that aren't what their column should hold become None, and are listed in
+    rejects: a DataFrame of their row (index label), field, value and reason.
+    Blank values are just None.
+    """
+
+    import pandas as pd
+    clinics = clinics.copy()
+    rejects = []
+
+    if 'address' in clinics:
+        addresses = blank_to_na(clinics['address'])
+        parts = parse_addresses(addresses)
+        _rejected(rejects, addresses, parts['state'], 'address', "not a street, city, state and zip code")
+        _rejected(rejects, addresses.where(parts['state'].notna()), parts['city'], 'address',
+                  "street and city run together")
+        for field in ADDRESS_FIELDS:
+            clinics[field] = parts[field]
+    if 'street_address' in clinics:
+        clinics['street_address'] = blank_to_na(clinics['street_address']).str.replace(
+            WHITESPACE_PATTERN, ' ', regex=True)
+    if 'city' in clinics:
+        clinics['city'] = blank_to_na(clinics['city']).str.replace(WHITESPACE_PATTERN, ' ', regex=True).str.title()
+    if 'state' in clinics:
+        states = blank_to_na(clinics['state']).str.upper()
+        clinics['state'] = states.where(states.isin(US_STATES))
+        _rejected(rejects, states, clinics['state'], 'state', "not a US state")
+    for field, normalize, reason in [('zip_code', normalize_zip_codes, "not a zip code"),
+                                     ('phone', normalize_phones, "not a US phone number"),
+                                     ('website', normalize_websites, "not a website URL")]:
+        if field in clinics:
+            values = clinics[field]
+            clinics[field] = normalize(values)
+            _rejected(rejects, blank_to_na(values.astype('string')), clinics[field], field, reason)
+
+    rejects = pd.concat(rejects, ignore_index=True) if rejects else pd.DataFrame(columns=REJECT_FIELDS)
+    return clinics, rejects
+
+def clinic_records(clinics):
+    """Rows of a normalized DataFrame as dicts, with None for missing values."""
+
+    import pandas as pd
+    return pd.DataFrame({column: to_python(clinics[column]) for column in clinics}).to_dict('records')
+
+def write_rejects(rejects, path):
+    """Write a rejects report: one CSV row per rejected value, with whatever identifies its row."""
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rejects[0]) if rejects else list(REJECT_FIELDS))
+        writer.writeheader()
+        writer.writerows(rejects)
+
+
+##########################################################################
+# One clinic at a time
+
+def _blank_to_none(value):
+    value = str(value).strip() if value is not None else ''
+    return value or None
+
+def _collapse_whitespace(value):
+    return WHITESPACE_PATTERN.sub(' ', value) if value is not None else None
+
+def parse_address(address):
+    """{street_address, city, state, zip_code} of an address, as parse_addresses() splits it."""
+
+    address = _blank_to_none(address)
+    match = ADDRESS_PATTERN.search(address) if address is not None else None
+    if match:
+        parts = match.groupdict()
+    else:
+        parts = dict.fromkeys(ADDRESS_FIELDS)
+        state_zip = STATE_ZIP_PATTERN.search(address) if address is not None else None
+        if state_zip:
+            parts.update(state_zip.groupdict())
+    city = _collapse_whitespace(parts['city'])
+    return {'street_address': _collapse_whitespace(parts['street_address']),
+            'city': city.strip().title() if city is not None else None,
+            'state': parts['state'].upper() if parts['state'] is not None else None,
+            'zip_code': parts['zip_code']}
+
+def normalize_zip_code(zip_code):
+    """Five digit zip code, i.e. '95110' for '95110.0'; None when there isn't one."""
+
+    match = ZIP_PATTERN.fullmatch(_blank_to_none(zip_code) or '')
+    return match.group(1).zfill(5) if match else None
+
+def normalize_phone(phone):
+    """Phone number written as '(408) 555-0100', with ' x12' for an extension; None when not one."""
+
+    match = PHONE_PATTERN.search(phone)
+    if not match:
+        return None
+    formatted = f'({match[1]}) {match[2]}-{match[3]}'
+    return f'{formatted} x{match[4]}' if match[4] else formatted
+
+def normalize_website(website):
+    """Website URL with a scheme, http:// when it had none, and a lower-cased host; None when not one."""
+
+    match = WEBSITE_PATTERN.search(website)
+    if not match:
+        return None
+    return f"{(match['scheme'] or 'http').lower()}://{match['host'].lower()}{match['rest'] or ''}"
+
+def normalize_clinic(clinic):
+    """(clinic, rejects) of one clinic dict, normalized as normalize_clinics() does a row.
+
+    rejects lists the field, value and reason of each value dropped.
+    """
+
+    clinic = dict(clinic)
+    rejects = []
+
+    if 'address' in clinic:
+        address = _blank_to_none(clinic['address'])
+        parts = parse_address(address)
+        if address is not None and parts['state'] is None:
+            rejects.append({'field': 'address', 'value': address, 'reason': "not a street, city, state and zip code"})
+        elif address is not None and parts['city'] is None:
+            rejects.append({'field': 'address', 'value': address, 'reason': "street and city run together"})
+        clinic.update(parts)
+    if 'street_address' in clinic:
+        clinic['street_address'] = _collapse_whitespace(_blank_to_none(clinic['street_address']))
+    if 'city' in clinic:
+        city = _collapse_whitespace(_blank_to_none(clinic['city']))
+        clinic['city'] = city.title() if city is not None else None
+    if 'state' in clinic:
+        state = _blank_to_none(clinic['state'])
+        clinic['state'] = state.upper() if state is not None and state.upper() in US_STATES else None
+        if state is not None and clinic['state'] is None:
+            rejects.append({'field': 'state', 'value': state.upper(), 'reason': "not a US state"})
+    for field, normalize, reason in [('zip_code', normalize_zip_code, "not a zip code"),
+                                     ('phone', normalize_phone, "not a US phone number"),
+                                     ('website', normalize_website, "not a website URL")]:
+        if field in clinic:
+            value = _blank_to_none(clinic[field])
+            clinic[field] = normalize(value) if value is not None else None
+            if value is not None and clinic[field] is None:
+                rejects.append({'field': field, 'value': value, 'reason': reason})
+
+    return clinic, rejects
@@ -1,15 +1,41 @@
 import os
 import re
+from math import ceil
 
-from flask import Flask, render_template, flash, redirect, session, g, jsonify
+import click
+from flask import Flask, render_template, flash, redirect, session, g, jsonify, request
+from markupsafe import Markup
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
 
 from forms import UserAddForm, LoginForm, ReviewForm, VetSearchForm
-from models import db, connect_db, User, Review, Favorite, Vet, Clinic
+from models import (db, connect_db, User, Review, Favorite, Vet, Clinic, data_version_watch,
+                    recompute_rating_aggregates, upgrade_schema)
+from search import parse_search_area, parse_search_state, location_index, autocomplete_index, search_vets_page, SORT_OPTIONS
+from geo import spatial_index
+from fulltext import search_vets_fulltext, rebuild_search_table
+from search_cache import search_cache
+from principal_cache import principal_cache, CurrentUser
+from passwords import password_hasher, PasswordHasherBusy
+from throttle import throttle
+from metrics import metrics
+from synthetic import SyntheticData, load_synthetic
+from loader import (read_scraped, sync_scraped_data, ingest_scraped, backfill_clinics, print_report, CLINICS_CSV,
+                    VETS_CSV)
 
 CURR_USER_KEY = "curr_user"
 
+# Page size of the vet search API.
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Vets the favorites API checks at most at once.
+MAX_FAVORITE_IDS = 500
+# Stands in for each vet's favorite button style in cached vet cards, until a request fills in its user's favorites.
+FAVORITE_MARKER = Markup('<!--favorite-{}-->')
+FAVORITE_MARKER_PATTERN = re.compile(r'<!--favorite-(\d+)-->')
+
 app = Flask(__name__)
 
 # Get DB_URI from environ variable (useful for production/testing) or,
@@ -21,21 +47,125 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+# Cost of new password hashes; existing ones are rehashed at their next login.
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+# Password hashing processes per worker, and hashes that may wait for them before logins fail fast.
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 8))
+# File the login/signup throttle keeps its buckets in, shared by every worker, i.e. /dev/shm/baffv-throttle;
+# each worker keeps its own when unset.
+app.config['THROTTLE_SHARED_PATH'] = os.environ.get('THROTTLE_SHARED_PATH')
+# Reverse proxies in front of the app, whose X-Forwarded-For gives the client IP the throttle limits.
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+# Bearer token Prometheus must send to read /metrics; without one, /metrics is open to anyone who can reach it.
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
 toolbar = DebugToolbarExtension(app)
 
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+
 connect_db(app)
+metrics.init_app(app)
+password_hasher.init_app(app)
+throttle.init_app(app)
+
+##########################################################################
+# CLI commands
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Bring a database made by an earlier version of the app up to date, keeping its data."""
+
+    added = upgrade_schema()
+    print(f"Added columns: {', '.join(added)}" if added else "No columns to add.")
+    print(f"Keyed and geocoded {backfill_clinics()} clinics.")
+    recompute_rating_aggregates()
+    rebuild_search_table()
+    print("Recomputed rating aggregates and rebuilt the search table.")
+
+@app.cli.command('recompute-ratings')
+def recompute_ratings_command():
+    """Recompute the stored rating aggregates of all vets and clinics from their reviews."""
+
+    recompute_rating_aggregates()
+    print(f"Recomputed rating aggregates of {Vet.query.count()} vets and {Clinic.query.count()} clinics.")
+
+@app.cli.command('ingest-scraped')
+@click.option('--clinics', 'clinics_path', default=CLINICS_CSV, show_default=True)
+@click.option('--vets', 'vets_path', default=VETS_CSV, show_default=True)
+@click.option('--chunk-size', default=10000, show_default=True, help="Rows per COPY/insert.")
+@click.option('--rejects', 'rejects_path', help="Write the values normalizing dropped to this CSV.")
+def ingest_scraped_command(clinics_path, vets_path, chunk_size, rejects_path):
+    """Stream the scraped CSVs into empty clinics and vets tables."""
+
+    rejects = []
+    try:
+        ingest_scraped(clinics_path, vets_path, chunk_size=chunk_size, report=print_report, rejects=rejects)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    report_rejects(rejects, rejects_path)
+
+@app.cli.command('load-scraped')
+@click.option('--clinics', 'clinics_path', default=CLINICS_CSV, show_default=True)
+@click.option('--vets', 'vets_path', default=VETS_CSV, show_default=True)
+@click.option('--batch-size', default=1000, show_default=True, help="Rows per upsert.")
+@click.option('--rejects', 'rejects_path', help="Write the values normalizing dropped to this CSV.")
+def load_scraped_command(clinics_path, vets_path, batch_size, rejects_path):
+    """Update clinics and vets from the scraped CSVs, keeping users' reviews and favorites."""
+
+    rejects = []
+    stats = sync_scraped_data(*read_scraped(clinics_path, vets_path, rejects), batch_size=batch_size)
+    print(', '.join(f"{name.replace('_', ' ')}: {stats[name]}" for name in
+                    ('clinics_inserted', 'clinics_updated', 'clinics_reactivated', 'clinics_retired',
+                     'vets_inserted', 'vets_updated', 'vets_reactivated', 'vets_retired')))
+    report_rejects(rejects, rejects_path)
+
+def report_rejects(rejects, path):
+    """Print how many values the scraped data load dropped, and write them to path if given."""
+
+    print(f"{len(rejects)} values rejected" + (f", see {path}" if path and rejects else ""))
+    if path:
+        from addresses import write_rejects
+        write_rejects(rejects, path)
+
+@app.cli.command('seed-synthetic')
+@click.option('--vets', default=100000, show_default=True)
+@click.option('--clinics', type=int, help="Default: vets / 4.")
+@click.option('--users', type=int, help="Default: vets / 2.")
+@click.option('--reviews', type=int, help="Default: vets * 10.")
+@click.option('--favorites', type=int, help="Default: users * 5.")
+@click.option('--seed', default=0, show_default=True)
+@click.option('--chunk-size', default=10000, show_default=True, help="Rows per COPY/insert.")
+@click.confirmation_option(prompt="This replaces ALL data in the database. Continue?")
+def seed_synthetic_command(vets, clinics, users, reviews, favorites, seed, chunk_size):
+    """Replace the data with a generated, production-sized data set, i.e. for staging."""
+
+    data = SyntheticData(vets=vets, clinics=clinics, users=users, reviews=reviews, favorites=favorites, seed=seed)
+    print(f"Loading {data.counts()}, every user's password is {data.password!r}")
+    load_synthetic(data, chunk_size=chunk_size, report=print_report)
 
 ##########################################################################
 # User signup/login/logout
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get_or_404(session[CURR_USER_KEY])
+    g.user is a CurrentUser: its id, username and full name come from this
+    worker's principal cache, and the rest of the User row is only loaded if a
+    view or template uses it. Static files skip this altogether.
+    """
+
+    g.user = None
+    if request.endpoint == 'static' or CURR_USER_KEY not in session:
+        return
+
+    principal = principal_cache.get(session[CURR_USER_KEY])
+    if principal is None:
+        # The user was deleted.
+        do_logout()
     else:
-        g.user = None
+        g.user = CurrentUser(principal)
 
 def do_login(user):
     """Log in user."""
@@ -62,6 +192,11 @@ def signup():
 
     form = UserAddForm()
 
+    if request.method == 'POST':
+        wait = throttle.attempt('signup', request.remote_addr, request.form.get('username'))
+        if wait:
+            return too_many_attempts('users/signup.html', form, wait)
+
     if form.validate_on_submit():
         try:
             user = User.signup(first_name=form.first_name.data, last_name=form.last_name.data,
@@ -69,6 +204,9 @@ def signup():
                                password=form.password.data)
             db.session.commit()
 
+        except PasswordHasherBusy:
+            return too_busy('users/signup.html', form)
+
         except IntegrityError:
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
@@ -84,10 +222,20 @@ def login():
 
     form = LoginForm()
 
+    if request.method == 'POST':
+        wait = throttle.attempt('login', request.remote_addr, request.form.get('username'))
+        if wait:
+            return too_many_attempts('users/login.html', form, wait)
+
     if form.validate_on_submit():
-        user = User.authenticate(username=form.username.data, password=form.password.data)
+        try:
+            user = User.authenticate(username=form.username.data, password=form.password.data)
+        except PasswordHasherBusy:
+            return too_busy('users/login.html', form)
 
         if user:
+            # Saves the password's new hash if it was rehashed.
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.first_name}!", "success")
             return redirect("/")
@@ -96,6 +244,18 @@ def login():
 
     return render_template('users/login.html', form=form)
 
+def too_busy(template, form):
+    """Page of the form again, as a 503, when too many passwords are being hashed to take another."""
+
+    flash("We're getting a lot of logins right now. Please try again in a moment.", 'warning')
+    return render_template(template, form=form), 503, {'Retry-After': '1'}
+
+def too_many_attempts(template, form, wait):
+    """Page of the form again, as a 429, when there were too many attempts from the IP or at the username."""
+
+    flash(f"Too many attempts. Please try again in {ceil(wait)} seconds.", 'danger')
+    return render_template(template, form=form), 429, {'Retry-After': str(ceil(wait))}
+
 @app.route('/logout')
 def logout():
     """Handel logout of user."""
@@ -114,6 +274,7 @@ def search_page():
 
     if form.validate_on_submit():
         session['search_area'] = form.zipcode_or_city.data.strip()
+        session['search_radius'] = form.radius.data
         return redirect('/results')
 
     return render_template('home.html', form=form)
@@ -127,31 +288,119 @@ def found_vets():
 
     if form.validate_on_submit():
         session['search_area'] = form.zipcode_or_city.data.strip()
+        session['search_radius'] = form.radius.data
         return redirect('/results')
     
     search_area = session.get('search_area', None)
+    zipcode, city = parse_search_area(search_area)
 
-    zipcode = re.search(r"\b\d{5}\b", search_area)
-    city_name = re.search(r"\s*(\w+\s*\w*)\s*", search_area)
-
-    if zipcode:
-        # user typed in a zip code.
-        zipcode = zipcode.group()
-        vets = Vet.query.join(Clinic, Clinic.id==Vet.clinic_id).filter(Clinic.zip_code==zipcode).all()
-    elif city_name:
-        # user typed in a city name.
-        city = city_name.group(1).lower().title()
-        vets = Vet.query.join(Clinic, Clinic.id==Vet.clinic_id).filter(Clinic.city==city).all()
-    else:
+    if not zipcode and not city:
         # error handling if user didn't type in the correct search format
         flash("Incorrect input format. Please type in either the zip code or name of your city. i.e. 95510 or San Jose", "danger")
         return redirect('/')
 
-    if not vets:
+    radius = session.get('search_radius', 0)
+    # Only radius searches place the city on the map.
+    state = parse_search_state(search_area) if radius else None
+
+    # Identical searches share the rendered result cards until vets, clinics or reviews change, in any worker.
+    data_version_watch.check()
+    vet_ids, vet_cards = search_cache.get_or_compute((zipcode, city, state, radius),
+                                                     lambda: render_vet_cards(zipcode, city, radius, state))
+
+    if not vet_ids:
         flash("Did NOT find any matches. Please try typing in another zip code or city name.", "info")
         return redirect('/')
     
-    return render_template('vets/found_vets.html', vets=vets, form=form)
+    return render_template('vets/found_vets.html', vet_cards=mark_favorites(vet_cards, favorites_among(vet_ids)),
+                           form=form)
+
+def find_vets(zipcode, city, radius=0, state=None):
+    """Return (vets, {vet id: distance in miles}) for a search parsed by parse_search_area and parse_search_state."""
+
+    distances = {}
+
+    if radius:
+        # Vets at clinics within the radius of the zip code or city center, closest first.
+        if city:
+            cities = location_index.match_cities(city)
+            city = cities[0] if cities else city
+        distances = dict(spatial_index.vets_near(radius, zipcode=zipcode, city=city, state=state))
+        vet_ids = list(distances)
+    else:
+        # The location index resolves the zip code or (partial/misspelled) city name without a DB query.
+        vet_ids = location_index.lookup(zipcode=zipcode, city=city)
+
+    vets = Vet.query.filter(Vet.id.in_(vet_ids)).options(joinedload(Vet.clinic)).all() if vet_ids else []
+    vets.sort(key=lambda vet: (distances.get(vet.id, 0), vet.id))
+
+    return vets, distances
+
+def render_vet_cards(zipcode, city, radius=0, state=None):
+    """Return (ids of the vets found, rendered vet cards) for a search, with favorite markers for mark_favorites."""
+
+    vets, distances = find_vets(zipcode, city, radius, state)
+
+    return [vet.id for vet in vets], Markup(render_template('vets/vet_cards.html', vets=vets, distances=distances,
+                                                            favorite_marker=FAVORITE_MARKER))
+
+def mark_favorites(vet_cards, favorite_vet_ids):
+    """Fill in the favorite markers of vet cards from render_vet_cards, marking the vets in favorite_vet_ids."""
+
+    return Markup(FAVORITE_MARKER_PATTERN.sub(
+        lambda match: 'btn-primary' if int(match[1]) in favorite_vet_ids else 'btn-secondary', vet_cards))
+
+def favorites_among(vet_ids):
+    """The logged-in user's favorites among vet_ids, for the vet cards to show; none if no one is logged in."""
+
+    if not g.user or not vet_ids:
+        return frozenset()
+    return frozenset(Favorite.vet_ids_of(g.user.id, vet_ids))
+
+@app.route('/api/search-cache/stats')
+def search_cache_stats():
+    """Return the hit/miss counters of this worker's search result cache."""
+
+    return jsonify(search_cache=search_cache.stats())
+
+def search_cache_metrics():
+    """Search cache counters for /metrics."""
+
+    stats = search_cache.stats()
+    return [('search_cache_entries', 'gauge', "Cached search results.", stats['size'])] + [
+        (f'search_cache_{name}_total', 'counter', f"Search cache {name}.", stats[name])
+        for name in ('hits', 'misses', 'coalesced', 'evictions', 'invalidations')]
+
+metrics.add_collector(search_cache_metrics)
+
+def principal_cache_metrics():
+    """Principal cache counters for /metrics."""
+
+    stats = principal_cache.stats()
+    return [('principal_cache_entries', 'gauge', "Cached principals of logged-in users.", stats['size'])] + [
+        (f'principal_cache_{name}_total', 'counter', f"Principal cache {name}.", stats[name])
+        for name in ('hits', 'misses')]
+
+metrics.add_collector(principal_cache_metrics)
+
+def password_hasher_metrics():
+    """Password hashing counters for /metrics."""
+
+    stats = password_hasher.stats()
+    return [(f'password_hashes_{name}_total', 'counter', f"Passwords {name}.", stats[name])
+            for name in ('hashed', 'checked', 'rejected')]
+
+metrics.add_collector(password_hasher_metrics)
+
+def throttle_metrics():
+    """Login/signup throttle counters for /metrics."""
+
+    stats = throttle.stats()
+    return [('throttle_allowed_total', 'counter', "Logins and signups allowed.", stats['allowed']),
+            ('throttle_rejected_total', 'counter', "Logins and signups turned away.", stats['rejected']),
+            ('throttle_evictions_total', 'counter', "Token buckets evicted.", stats['evictions'])]
+
+metrics.add_collector(throttle_metrics)
 
 
 ##########################################################################
@@ -169,9 +418,14 @@ def user_profile(user_id):
         flash("You are not authorized to see this page!", "danger")
         return redirect('/')
     
-    reviews = Review.query.filter(Review.user_id==user_id).order_by(Review.timestamp.desc()).limit(5).all()
+    reviews = (Review.query.filter(Review.user_id==user_id).options(joinedload(Review.vet))
+               .order_by(Review.timestamp.desc()).limit(5).all())
+    vets = (Vet.query.join(Favorite, Favorite.vet_id==Vet.id).filter(Favorite.user_id==user_id)
+            .options(joinedload(Vet.clinic)).order_by(Favorite.id).all())
 
-    return render_template('users/user_profile.html', vets=g.user.favorites, reviews=reviews)
+    # These are all favorites.
+    return render_template('users/user_profile.html', vets=vets, reviews=reviews,
+                           favorite_vet_ids={vet.id for vet in vets})
 
 # Edit User route??
 
@@ -181,9 +435,12 @@ def user_profile(user_id):
 def clinic_profile(clinic_id):
     """Show info about a clinics and the vets who work there."""
 
-    clinic = Clinic.query.get_or_404(clinic_id)
+    clinic = Clinic.query.options(selectinload(Clinic.vets)).get_or_404(clinic_id)
 
-    return render_template('clinics/clinic_profile.html', clinic=clinic, vets=clinic.vets)
+    vets = [vet for vet in clinic.vets if vet.active]
+
+    return render_template('clinics/clinic_profile.html', clinic=clinic, vets=vets,
+                           favorite_vet_ids=favorites_among([vet.id for vet in vets]))
 
 ##########################################################################
 # Vet route:
@@ -191,9 +448,11 @@ def clinic_profile(clinic_id):
 def vet_profile(vet_id):
     """Show detailed info about a vet."""
 
-    vet = Vet.query.get_or_404(vet_id)
+    vet = (Vet.query.options(joinedload(Vet.clinic), selectinload(Vet.reviews).joinedload(Review.user))
+           .get_or_404(vet_id))
 
-    return render_template('vets/vet_profile.html', vet=vet, reviews=vet.reviews)
+    return render_template('vets/vet_profile.html', vet=vet, reviews=vet.reviews,
+                           favorite_vet_ids=favorites_among([vet.id]))
 
 ##########################################################################
 # Review route:
@@ -212,7 +471,7 @@ def add_review(vet_id):
 
     if form.validate_on_submit():
         review = Review(user_id=g.user.id, vet_id=vet_id, rating=form.rating.data, comment=form.comment.data)
-        g.user.reviews.append(review)
+        db.session.add(review)
         db.session.commit()
 
         return redirect(f'/vets/{vet_id}')
@@ -227,7 +486,8 @@ def all_reviews():
         flash("Please sign up or log in first!", "danger")
         return redirect('/login')
     
-    reviews = Review.query.filter(Review.user_id==g.user.id).order_by(Review.timestamp.desc()).all()
+    reviews = (Review.query.filter(Review.user_id==g.user.id).options(joinedload(Review.vet))
+               .order_by(Review.timestamp.desc()).all())
 
     return render_template('reviews/all_reviews.html', reviews=reviews)
 
@@ -248,45 +508,94 @@ def unauthorized(e):
 #####################################################################################
 # Favorite routes:
 
-@app.route('/api/users/favorite/<int:vet_id>', methods=['POST'])
-def change_favorite(vet_id):
+@app.route('/api/users/favorite/<int:vet_id>', methods=['PUT', 'DELETE'])
+def set_favorite(vet_id):
     """
-    Add/remove a favorite vet for the currently-logged-in user.
-    A JS script on the client side will call this route to change the favorite status of a vet.
+    Make a vet a favorite of the currently-logged-in user (PUT), or not (DELETE).
+    A JS script on the client side will call this route with the state the user asked for, so
+    repeating it, i.e. on a double click, changes nothing.
     """
 
     if not g.user:
         flash("Please login to add a vet to your favorite!", "danger")
         return redirect('/login')
-    
-    vet = Vet.query.get_or_404(vet_id)
-
-    favorite = Favorite.query.filter(Favorite.user_id==g.user.id, Favorite.vet_id==vet_id).one_or_none()
 
-    if favorite:
-        db.session.delete(favorite)
+    favorite = request.method == 'PUT'
+    try:
+        added, removed = Favorite.change(g.user.id, add=[vet_id] if favorite else [],
+                                         remove=[] if favorite else [vet_id])
         db.session.commit()
-        return jsonify(message=f"{vet.name} removed from favorite!")
-    else:
-        new_fave = Favorite(user_id=g.user.id, vet_id=vet_id)
-        db.session.add(new_fave)
+    except IntegrityError:
+        db.session.rollback()
+        return (jsonify(error=f"No vet #{vet_id}"), 404)
+    return (jsonify(favorite={'vet_id': vet_id, 'favorite': favorite}), 201 if added else 200)
+
+@app.route('/api/users/favorites', methods=['PATCH'])
+def set_favorites():
+    """Make the vets in the JSON body's `add` list favorites of the user, and the ones in `remove` not.
+
+    Returns the vets that changed; the others already were in the state asked
+    for. Nothing changes if a vet to add doesn't exist.
+    """
+
+    if not g.user:
+        flash("Please login to add a vet to your favorite!", "danger")
+        return redirect('/login')
+
+    data = request.get_json(silent=True)
+    try:
+        add, remove = ([int(vet_id) for vet_id in data.get(key, [])] for key in ('add', 'remove'))
+    except (AttributeError, TypeError, ValueError):
+        return (jsonify(error="Send {\"add\": [vet ids], \"remove\": [vet ids]}"), 400)
+    if len(add) + len(remove) > MAX_FAVORITE_IDS:
+        return (jsonify(error=f"At most {MAX_FAVORITE_IDS} vets at a time"), 400)
+    if set(add) & set(remove):
+        return (jsonify(error="A vet can't be both added and removed"), 400)
+
+    try:
+        added, removed = Favorite.change(g.user.id, add=add, remove=remove)
         db.session.commit()
-        serialized = new_fave.serialize()
-        return (jsonify(favorite=serialized), 201)
-    
+    except IntegrityError:
+        db.session.rollback()
+        return (jsonify(error="No such vet among the ones to add"), 404)
+    return jsonify(added=added, removed=removed)
+
 # Get the ids of all favorite vets if the user is logged in.
 @app.route('/api/users/favorites')
 def get_favorites():
-    """Get the ids of all favorite vets if the user is logged in."""
+    """Get the ids of all favorite vets if the user is logged in.
+
+    With vet_ids (comma-separated), only the ones among those vets, i.e. the
+    cards on screen. The ETag is the version of the user's favorites, which
+    changes with every favorite added or removed, so an If-None-Match with it
+    gets a 304 after a single primary key lookup.
+    """
 
     if not g.user:
         flash("Access denied. Please login first!", "danger")
         return redirect('/login')
-    
-    favorites = [vet.id for vet in g.user.favorites]
-    serialized = {'ids': favorites}
 
-    return jsonify(favorite_vets=serialized)
+    vet_ids = request.args.get('vet_ids')
+    if vet_ids is not None:
+        try:
+            vet_ids = [int(vet_id) for vet_id in vet_ids.split(',') if vet_id.strip()]
+        except ValueError:
+            return (jsonify(error="vet_ids must be comma-separated vet ids"), 400)
+        if len(vet_ids) > MAX_FAVORITE_IDS:
+            return (jsonify(error=f"At most {MAX_FAVORITE_IDS} vet_ids at a time"), 400)
+
+    version = db.session.query(User.favorites_version).filter(User.id==g.user.id).scalar()
+    etag = f'favorites-{g.user.id}-{version}'
+    if request.if_none_match.contains_weak(etag):
+        resp = app.response_class(status=304)
+    else:
+        serialized = {'ids': Favorite.vet_ids_of(g.user.id, vet_ids)}
+        resp = jsonify(favorite_vets=serialized, version=version)
+
+    resp.set_etag(etag, weak=True)
+    # Browsers keep the response, but check it's still current before using it.
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
 
 #####################################################################################
 # Review routes:
@@ -298,3 +607,65 @@ def get_review(review_id):
     serialized = review.serialize()
 
     return jsonify(review=serialized)
+
+#####################################################################################
+# Vet search routes:
+@app.route('/api/vets/search')
+def search_vets():
+    """Return a page of vets in the zip code or city in `q`, as JSON.
+
+    Query parameters: q, cursor (next_cursor of the previous page), limit,
+    sort ('name' or 'rating'), min_rating, has_website and has_phone.
+    """
+
+    zipcode, city = parse_search_area(request.args.get('q', ''))
+    if not zipcode and not city:
+        return (jsonify(error="Please provide a zip code or city name in q, i.e. q=95110 or q=San Jose"), 400)
+
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    sort = request.args.get('sort', 'name')
+    min_rating = request.args.get('min_rating', None, type=float)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return (jsonify(error=f"limit must be between 1 and {MAX_PAGE_SIZE}"), 400)
+    if sort not in SORT_OPTIONS:
+        return (jsonify(error=f"sort must be one of {', '.join(SORT_OPTIONS)}"), 400)
+
+    try:
+        rows, next_cursor = search_vets_page(zipcode=zipcode, city=city, sort=sort, limit=limit,
+                                             cursor=request.args.get('cursor'), min_rating=min_rating,
+                                             has_website=request.args.get('has_website') in ('1', 'true'),
+                                             has_phone=request.args.get('has_phone') in ('1', 'true'))
+    except ValueError as e:
+        return (jsonify(error=str(e)), 400)
+
+    vets = [dict(vet.serialize(), clinic=clinic.serialize(), average_rating=float(rating))
+            for vet, clinic, rating in rows]
+
+    return jsonify(vets=vets, next_cursor=next_cursor)
+
+@app.route('/api/vets/fulltext')
+def fulltext_search_vets():
+    """Return the vets whose name, clinic name or reviews best match the words in `q`, as JSON.
+
+    Each vet comes with its rank and an HTML snippet with the matches wrapped in <mark>.
+    """
+
+    q = request.args.get('q', '').strip()
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    if not q:
+        return (jsonify(error="Please provide the words to search for in q, i.e. q=anxious dog"), 400)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return (jsonify(error=f"limit must be between 1 and {MAX_PAGE_SIZE}"), 400)
+
+    vets = [dict(vet.serialize(), clinic=clinic.serialize() if clinic else None, rank=rank, snippet=snippet)
+            for vet, clinic, rank, snippet in search_vets_fulltext(q, limit=limit)]
+
+    return jsonify(vets=vets)
+
+@app.route('/api/autocomplete')
+def autocomplete():
+    """Return city and zip code suggestions for what was typed in the search bar, as JSON."""
+
+    suggestions = autocomplete_index.complete(request.args.get('prefix', ''))
+
+    return jsonify(suggestions=suggestions)
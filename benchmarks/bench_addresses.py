@@ -0,0 +1,69 @@
+"""Address parsing throughput: the scraper's old per-address regexes against addresses.py.
+
+Parses random addresses in the directory's format, with cities of one to
+three words, and a few that aren't addresses at all:
+    python -m benchmarks.bench_addresses --addresses 300000
+"""
+import argparse
+import random
+import re
+import time
+
+import pandas as pd
+
+from addresses import normalize_clinics, parse_addresses
+from synthetic import LAST_NAMES
+
+CITIES = ('Davis', 'San Jose', 'Santa Clara', 'South San Francisco', 'El Dorado Hills', 'St. Helena', 'Los Gatos')
+
+
+def random_address(rng):
+    if rng.random() < 0.02:
+        return 'Call for directions'
+    street = f'{rng.randint(1, 9999)} {rng.choice(LAST_NAMES)} {rng.choice(("St", "Ave", "Blvd"))}'
+    if rng.random() < 0.2:
+        street += f', Suite {rng.randint(1, 300)}'
+    return f'{street}, {rng.choice(CITIES)}, CA {rng.randint(94000, 96199)}'
+
+def old_parse(address):
+    """What the scraper's get_street_info, get_city, get_state and get_zip_code did."""
+
+    match = re.search(r"\b\d{5}\b", address)
+    zip_code = match.group().strip() if match else None
+    match = re.search(r"(\d+\s+[a-zA-z\s]+\s*),\s*\w+\s*\w*\s*,*\s*([A-Z]{2})\s*", address)
+    street = match.group(1).strip() if match else None
+    match = re.search(r",*\s*(\w+\s*\w*)\s*,*\s*([A-Z]{2})\s*", address)
+    city = match.group(1).strip().lower().title() if match else None
+    match = re.search(r",*\s*([A-Z]{2})\s*", address)
+    state = match.group(1).strip().upper() if match else None
+    return street, city, state, zip_code
+
+def timed(label, parse, count):
+    start = time.perf_counter()
+    result = parse()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<26} {elapsed:>7.2f} s   {count / elapsed:>12,.0f} addresses/s")
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--addresses', type=int, default=300000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    addresses = [random_address(rng) for _ in range(args.addresses)]
+
+    old = timed('old per-address regexes', lambda: [old_parse(address) for address in addresses], len(addresses))
+    parts = timed('parse_addresses', lambda: parse_addresses(pd.Series(addresses)), len(addresses))
+    clinics, rejects = timed('normalize_clinics', lambda: normalize_clinics(pd.DataFrame({'address': addresses})),
+                             len(addresses))
+
+    cities = parts['city']
+    multi_word = cities.str.contains(' ', na=False).sum()
+    old_multi_word = sum(1 for street, city, state, zip_code in old if city and ' ' in city)
+    print(f"multi-word cities: {old_multi_word:,} parsed before, {multi_word:,} now; {len(rejects):,} rejects")
+
+
+if __name__ == '__main__':
+    main()
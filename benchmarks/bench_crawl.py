@@ -0,0 +1,90 @@
+"""Crawl throughput against the local fixture server, as concurrency grows.
+
+Saves synthetic directory pages to a temporary directory and serves them with
+a latency like the real site's, then compares fetching them one at a time
+with a bare requests.get (as the scraper used to) against Crawler. Then
+crawls and parses the pages three times through a PageCache: cold, again with
+conditional requests, and as a replay. Last, runs the whole scrape pipeline
+and reports its peak Python memory, which shouldn't grow with --pages:
+    python -m benchmarks.bench_crawl --pages 200 --latency 0.1
+"""
+import argparse
+import contextlib
+import io
+import time
+import tracemalloc
+from tempfile import TemporaryDirectory
+
+import requests
+
+from crawler import Crawler, HEADERS
+from fixture_server import FixtureServer, save_directory_pages
+from page_cache import PageCache
+from scraped_data.webscrape_bs4 import page_url, parse_page, get_95110_data
+
+PER_PAGE = 20
+
+
+def listings(count):
+    for i in range(1, count + 1):
+        yield {'fear_free_id': i, 'name': f'Vet {i}', 'clinic': f'Clinic {i // 3}',
+               'address': f'{i} Main St, San Jose, CA 95110', 'phone': '(408) 555-0100',
+               'website': f'https://clinic{i // 3}.example.com'}
+
+def timed(label, server, crawl):
+    requests_before, connections_before = server.requests, server.connections
+    start = time.perf_counter()
+    pages = sum(1 for response in crawl())
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {elapsed:>7.2f} s   {pages / elapsed:>8.1f} pages/s   "
+          f"{server.requests - requests_before:>5} requests   "
+          f"{server.connections - connections_before:>5} connections")
+
+def timed_cached(label, server, crawler, urls):
+    sent_before = server.bytes_sent
+    start = time.perf_counter()
+    vets = sum(len(parse_page(page, crawler.cache)[-1]) for page in crawler.crawl(urls))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {elapsed:>7.2f} s   {vets:>8,} vets   {crawler.requests:>5} requests   "
+          f"{crawler.not_modified:>5} not modified   {(server.bytes_sent - sent_before) / 2**20:>7.2f} MiB sent")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.1, help="Seconds each page takes to serve.")
+    parser.add_argument('--flaky', type=int, default=0, help="503s served before each page.")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16])
+    args = parser.parse_args(argv)
+
+    with TemporaryDirectory() as directory:
+        save_directory_pages(directory, listings(args.pages * PER_PAGE), per_page=PER_PAGE)
+        with FixtureServer(directory, latency=args.latency, flaky=args.flaky) as server:
+            urls = [page_url(page, server.url) for page in range(1, args.pages + 1)]
+            if not args.flaky:
+                timed('requests.get', server, lambda: (requests.get(url, headers=HEADERS) for url in urls))
+            for concurrency in args.concurrency:
+                server.reset_failures()
+                with Crawler(concurrency=concurrency, rate=None, backoff=0.01) as crawler:
+                    timed(f'Crawler concurrency {concurrency}', server, lambda: crawler.crawl(urls))
+
+            with TemporaryDirectory() as cache_dir:
+                for label, replay in [('cold cache', False), ('warm cache', False), ('replay', True)]:
+                    server.reset_failures()
+                    with Crawler(concurrency=max(args.concurrency), rate=None, backoff=0.01,
+                                 cache=PageCache(cache_dir), replay=replay) as crawler:
+                        timed_cached(label, server, crawler, urls)
+
+            with TemporaryDirectory() as output_dir, Crawler(concurrency=max(args.concurrency), rate=None) as crawler:
+                server.reset_failures()
+                tracemalloc.start()
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    get_95110_data(args.pages, server.url, crawler, output_dir)
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            print(f"{'scrape pipeline':<24} {elapsed:>7.2f} s   peak Python memory {peak / 2**20:>7.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
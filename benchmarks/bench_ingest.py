@@ -0,0 +1,97 @@
+"""Compare loading scraped CSVs the way seed.py used to (pandas -> JSON -> dicts ->
+insert) against loader.ingest_scraped, which streams rows straight from the files.
+
+Writes synthetic CSVs in the scraped format, then loads them into
+DATABASE_URL (default: the baffv-bench database, all its tables are replaced):
+    python -m benchmarks.bench_ingest --clinics 50000 --vets 200000
+
+With the defaults, on a local Postgres 16: 14.9 s for pandas, 2.5 s for
+ingest_scraped (6.0x), of which about 1.1 s is building the search table and
+0.6 s normalizing and geocoding the clinics. On SQLite: 7.5 s and 2.8 s (2.7x).
+"""
+import argparse
+import csv
+import json
+import os
+import time
+import tracemalloc
+from tempfile import TemporaryDirectory
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///baffv-bench')
+
+import pandas as pd
+from sqlalchemy import insert
+
+from app import app
+from models import db, Clinic, Vet
+from loader import ingest_scraped, CLINIC_FIELDS
+from synthetic import SyntheticData
+
+
+def write_csvs(directory, clinics, vets):
+    """Write clinics.csv and vets.csv like the scraper does, zip codes as floats included."""
+
+    data = SyntheticData(vets=vets, clinics=clinics)
+    clinics_path = os.path.join(directory, 'clinics.csv')
+    vets_path = os.path.join(directory, 'vets.csv')
+    with open(clinics_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CLINIC_FIELDS)
+        for clinic in data.clinics_rows():
+            if clinic['id'] % 2:
+                clinic['zip_code'] += '.0'
+            writer.writerow([clinic[field] for field in CLINIC_FIELDS])
+    with open(vets_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('name', 'fear_free_id', 'clinic_id'))
+        writer.writerows((vet['name'], vet['fear_free_id'], vet['clinic_id']) for vet in data.vets_rows())
+    return clinics_path, vets_path
+
+def pandas_load(clinics_path, vets_path):
+    """The load seed.py used to do."""
+
+    df_vets = pd.read_csv(vets_path)
+    df_clinics = pd.read_csv(clinics_path)
+    df_clinics['zip_code'] = df_clinics['zip_code'].apply(lambda z: f'{z:.0f}' if not pd.isna(z) else z)
+    clinics = json.loads(df_clinics.to_json(orient='records'))
+    vets = json.loads(df_vets.to_json(orient="records"))
+    db.session.execute(insert(Clinic), clinics)
+    db.session.execute(insert(Vet), vets)
+    db.session.commit()
+
+def timed(label, load):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        start = time.perf_counter()
+        load()
+        elapsed = time.perf_counter() - start
+        rows = Clinic.query.count() + Vet.query.count()
+        # The counts' transaction would hold locks drop_all() waits on.
+        db.session.remove()
+
+        # Measured in a second run, tracing slows everything down.
+        db.drop_all()
+        db.create_all()
+        tracemalloc.start()
+        load()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    print(f"{label:<16} {elapsed:>8.2f} s   {rows / elapsed:>10,.0f} rows/s   peak Python memory {peak / 2**20:>7.1f} MiB")
+    return elapsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clinics', type=int, default=20000)
+    parser.add_argument('--vets', type=int, default=80000)
+    args = parser.parse_args(argv)
+
+    with TemporaryDirectory() as directory:
+        clinics_path, vets_path = write_csvs(directory, args.clinics, args.vets)
+        before = timed('pandas -> JSON', lambda: pandas_load(clinics_path, vets_path))
+        after = timed('ingest_scraped', lambda: ingest_scraped(clinics_path, vets_path))
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Compare location index lookups against the Vet/Clinic join used before it,
+and time autocomplete suggestions per keystroke.
+
+Run from the project root against a seeded database:
+    python -m benchmarks.bench_location_index
+"""
+import time
+from statistics import median, quantiles
+
+from app import app
+from models import db, Vet, Clinic
+from search import location_index, autocomplete_index, normalize_city
+
+
+def time_calls(fn, terms, repeat):
+    """Latency of every call in microseconds."""
+
+    timings = []
+    for _ in range(repeat):
+        for term in terms:
+            start = time.perf_counter()
+            fn(term)
+            timings.append((time.perf_counter() - start) * 1e6)
+    return timings
+
+def report(label, timings):
+    p95 = quantiles(timings, n=20)[-1]
+    print(f"{label:<24} median {median(timings):>9.1f} us   p95 {p95:>9.1f} us   ({len(timings)} calls)")
+
+def main(repeat=20):
+    with app.app_context():
+        zips = [z for (z,) in db.session.query(Clinic.zip_code).distinct() if z]
+        cities = [c for (c,) in db.session.query(Clinic.city).distinct() if c]
+
+        start = time.perf_counter()
+        location_index.build()
+        print(f"index build: {(time.perf_counter() - start) * 1e3:.1f} ms for {len(zips)} zips, {len(cities)} cities")
+
+        join = Vet.query.join(Clinic, Clinic.id == Vet.clinic_id)
+        report('join by zip', time_calls(lambda z: join.filter(Clinic.zip_code == z).all(), zips, repeat))
+        report('index by zip', time_calls(location_index.vets_for_zip, zips, repeat))
+        report('join by city', time_calls(lambda c: join.filter(Clinic.city == c).all(), cities, repeat))
+        report('index by city', time_calls(lambda c: location_index.vets_for_city(normalize_city(c)),
+                                           cities, repeat))
+        prefixes = [normalize_city(c)[:-2] for c in cities if len(c) > 4]
+        report('index by city prefix', time_calls(location_index.vets_for_city, prefixes, repeat))
+
+        autocomplete_index.build()
+        keystrokes = [c[:n] for c in cities + zips for n in range(1, len(c) + 1)]
+        report('autocomplete keystroke', time_calls(autocomplete_index.complete, keystrokes, repeat))
+
+
+if __name__ == '__main__':
+    main()
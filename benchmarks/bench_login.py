@@ -0,0 +1,127 @@
+"""Login throughput with bcrypt inline in the request, against PasswordHasher's process pool.
+
+Adds --users users to DATABASE_URL (a separate baffv-bench database by
+default) and logs them in from --clients threads at once through the Flask
+test client, first hashing inline as the app used to, then in the pool.
+Meanwhile another thread keeps requesting the home page, to show how a
+login burst slows everyone else down. Logins the pool turns away come back
+as 503s at once, and are retried after --retry-ms; their latency counts
+from the first attempt:
+    python -m benchmarks.bench_login --clients 16 --logins 64 --workers 2 --max-pending 4
+"""
+import argparse
+import os
+import threading
+import time
+from statistics import median, quantiles
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///baffv-bench')
+
+from app import app
+from models import db, User
+from passwords import password_hasher
+
+USERNAME_PREFIX = 'bench_login_'
+PASSWORD = 'bench-password'
+
+
+def p95(timings):
+    return quantiles(timings, n=20, method='inclusive')[-1] if len(timings) > 1 else sum(timings)
+
+def add_users(count):
+    with app.app_context():
+        db.create_all()
+        User.query.filter(User.username.startswith(USERNAME_PREFIX)).delete(synchronize_session=False)
+        pw_hash = password_hasher.hash(PASSWORD)
+        db.session.add_all([User(first_name='Bench', last_name=str(i), username=f'{USERNAME_PREFIX}{i}',
+                                 email=f'{USERNAME_PREFIX}{i}@example.com', password=pw_hash)
+                            for i in range(count)])
+        db.session.commit()
+
+def remove_users():
+    with app.app_context():
+        User.query.filter(User.username.startswith(USERNAME_PREFIX)).delete(synchronize_session=False)
+        db.session.commit()
+
+def burst(clients, logins, users, retry_ms):
+    """Log in `logins` times from `clients` threads; return (seconds, [latency], 503s, [home page latency])."""
+
+    latencies = []
+    rejected = 0
+    home_timings = []
+    lock = threading.Lock()
+    next_login = iter(range(logins))
+    done = threading.Event()
+
+    def client():
+        nonlocal rejected
+        with app.test_client() as c:
+            while True:
+                with lock:
+                    i = next(next_login, None)
+                if i is None:
+                    return
+                start = time.perf_counter()
+                while c.post('/login', data={'username': f'{USERNAME_PREFIX}{i % users}',
+                                             'password': PASSWORD}).status_code == 503:
+                    with lock:
+                        rejected += 1
+                    time.sleep(retry_ms / 1000)
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+    def bystander():
+        with app.test_client() as c:
+            while not done.is_set():
+                start = time.perf_counter()
+                c.get('/')
+                home_timings.append(time.perf_counter() - start)
+                time.sleep(0.01)
+
+    watcher = threading.Thread(target=bystander)
+    watcher.start()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    watcher.join()
+    return elapsed, latencies, rejected, home_timings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--logins', type=int, default=64)
+    parser.add_argument('--users', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=app.config['BCRYPT_LOG_ROUNDS'])
+    parser.add_argument('--workers', type=int, default=app.config['PASSWORD_HASH_WORKERS'])
+    parser.add_argument('--max-pending', type=int, default=app.config['PASSWORD_HASH_MAX_PENDING'])
+    parser.add_argument('--retry-ms', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    password_hasher.configure(rounds=args.rounds, workers=0)
+    add_users(args.users)
+    print(f"{args.logins} logins from {args.clients} clients, bcrypt cost {args.rounds}, {os.cpu_count()} CPUs")
+    print(f"{'':<28} {'logins/s':>9} {'503s':>5} {'login p50':>10} {'login p95':>10} "
+          f"{'home p50':>9} {'home p95':>9}")
+    try:
+        for label, workers in [('inline', 0), (f'pool ({args.workers} + {args.max_pending} pending)', args.workers)]:
+            password_hasher.shutdown()
+            password_hasher.configure(rounds=args.rounds, workers=workers, max_pending=args.max_pending)
+            if workers:
+                password_hasher.hash('start the pool')
+            elapsed, latencies, rejected, home = burst(args.clients, args.logins, args.users, args.retry_ms)
+            print(f"{label:<28} {len(latencies) / elapsed:>9.1f} {rejected:>5} "
+                  f"{median(latencies) * 1000:>8.0f}ms {p95(latencies) * 1000:>8.0f}ms "
+                  f"{median(home) * 1000:>7.0f}ms {p95(home) * 1000:>7.0f}ms")
+    finally:
+        password_hasher.shutdown()
+        remove_users()
+
+
+if __name__ == '__main__':
+    main()
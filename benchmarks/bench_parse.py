@@ -0,0 +1,81 @@
+"""Parse throughput of directory pages, per parser backend.
+
+Saves synthetic directory pages as HTML fixtures, reads them back, then
+parses them with the scraper's old parser (html5lib, one pass over the cards
+per field) and with directory_parser.parse_cards on each installed backend:
+    python -m benchmarks.bench_parse --pages 50 --per-page 20
+"""
+import argparse
+import re
+import time
+from tempfile import TemporaryDirectory
+
+from bs4 import BeautifulSoup
+
+from directory_parser import available_backends, parse_cards
+from fixture_server import page_file, save_directory_pages
+
+
+def listings(count):
+    for i in range(1, count + 1):
+        yield {'fear_free_id': i, 'name': f'Vet {i}', 'clinic': f'Clinic {i // 3}' if i % 5 else '',
+               'address': f'{i} Main St, San Jose, CA 95110', 'phone': '(408) 555-0100' if i % 2 else '',
+               'website': f'https://clinic{i // 3}.example.com' if i % 3 else ''}
+
+def old_parse(content):
+    """The fields get_page_data used to find, the way it found them."""
+
+    soup = BeautifulSoup(content, 'html5lib')
+    vets = soup.find_all("div", id=re.compile("sabai-entity-content-"))
+    ids = [int(vet['id'].replace("sabai-entity-content-", '')) for vet in vets]
+    clinics = [
+        vet.find("div", class_="sabai-directory-custom-fields-practice-individual-summary").get_text(strip=True)
+        if vet.find("div", class_="sabai-directory-custom-fields-practice-individual-summary") is not None
+        else vet.find('a').get_text(strip=True).replace('Dr. ', '').replace('&', 'and') for vet in vets]
+    names = [vet.find('a').get_text(strip=True).replace('Dr. ', '').replace('&', 'and') for vet in vets]
+    locations = [
+        vet.find('span', class_='sabai-googlemaps-address sabai-googlemaps-address-0').get_text(strip=True)
+        for vet in vets]
+    phones = [vet.find('span', itemprop='telephone').get_text(strip=True)
+              if vet.find('span', itemprop='telephone') is not None else '' for vet in vets]
+    websites = [
+        vet.find('div', class_='sabai-directory-contact-website').find('a')['href']
+        if vet.find('div', class_='sabai-directory-contact-website') is not None else ''
+        for vet in vets]
+    return [{'fear_free_id': ffid, 'name': name, 'clinic': clinic, 'address': address, 'phone': phone,
+             'website': website}
+            for ffid, name, clinic, address, phone, website in zip(ids, names, clinics, locations, phones, websites)]
+
+def timed(label, parse, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        cards = sum(len(parse(page)) for page in pages)
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{label:<20} {elapsed * 1000:>9.1f} ms   {len(pages) / elapsed:>9.1f} pages/s   {cards / elapsed:>10,.0f} cards/s")
+    return elapsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    with TemporaryDirectory() as directory:
+        count = save_directory_pages(directory, listings(args.pages * args.per_page), per_page=args.per_page)
+        pages = []
+        for page in range(1, count + 1):
+            with open(page_file(directory, page), 'rb') as f:
+                pages.append(f.read())
+
+    expected = [old_parse(page) for page in pages]
+    before = timed('old get_page_data', old_parse, pages, args.repeat)
+    for backend in available_backends():
+        if [parse_cards(page, backend) for page in pages] != expected:
+            print(f"{backend}: records differ from the old parser's!")
+        after = timed(backend, lambda page: parse_cards(page, backend), pages, args.repeat)
+        print(f"{'':<20} {before / after:>9.1f}x the old parser")
+
+
+if __name__ == '__main__':
+    main()
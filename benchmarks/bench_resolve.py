@@ -0,0 +1,117 @@
+"""Entity resolution of clinic listings: its accuracy, and how its time grows with the number of listings.
+
+Lists random clinics, spread over zip codes like a nationwide crawl, one to
+four times each under variants of their name ("VCA San Jose", "VCA Animal
+Hospital San Jose", "Vca San Jose, Inc."). Resolves them by exact name, city
+and zip code, as the scraper used to, and with entities.ListingResolver,
+then times the resolver as the listings double, and comparing every pair:
+    python -m benchmarks.bench_resolve --listings 200000
+"""
+import argparse
+import random
+import time
+
+from entities import ListingResolver, clinic_weights, similarity
+from synthetic import LAST_NAMES
+
+PREFIXES = ('VCA', 'Banfield', 'Blue Cross', 'Almaden', 'Evergreen', 'Willow Glen', 'Cupertino', 'Bay Area',
+            'Mission', 'Saratoga', 'Valley', 'Coast', 'Oak', 'Cedar', 'Sunrise', 'Harbor')
+GENERIC = ('Animal Hospital', 'Pet Clinic', 'Veterinary Hospital', 'Veterinary Clinic', 'Animal Care Center')
+CITIES = ('San Jose', 'Santa Clara', 'Fremont', 'Oakland', 'Davis', 'Reno', 'Austin', 'Denver', 'Boston')
+
+
+def random_clinics(rng, count):
+    """[(name, street address, city, zip code)] of count distinct clinics, ~20 per zip code."""
+
+    zip_codes = [f'{rng.randint(1000, 99999):05}' for _ in range(max(count // 20, 1))]
+    return [(f'{rng.choice(PREFIXES)} {rng.choice(LAST_NAMES)} {rng.choice(GENERIC)}',
+             f'{rng.randint(1, 9999)} Main St', rng.choice(CITIES), rng.choice(zip_codes))
+            for _ in range(count)]
+
+def variant(rng, name):
+    """name as the directory might list it another time."""
+
+    change = rng.randrange(4)
+    if change == 0:
+        return name.upper()
+    if change == 1:
+        for generic in GENERIC:
+            name = name.replace(f' {generic}', '')
+        return name
+    if change == 2:
+        return f'{name}, Inc.'
+    return name
+
+def random_listings(rng, count):
+    """(listings, the index of each one's clinic) of count listings."""
+
+    clinics = random_clinics(rng, count * 2 // 5)
+    listings, truth = [], []
+    while len(listings) < count:
+        index = rng.randrange(len(clinics))
+        name, street_address, city, zip_code = clinics[index]
+        listings.append({'fear_free_id': len(listings), 'name': 'Vet', 'clinic': variant(rng, name),
+                         'street_address': street_address, 'city': city, 'zip_code': zip_code})
+        truth.append(index)
+    return listings, truth
+
+def score(ids, truth):
+    """(clinics found, listings of a clinic not merged with its first, listings merged with another clinic)."""
+
+    first_ids = {}
+    missed = wrong = 0
+    owners = {}
+    for clinic_id, index in zip(ids, truth):
+        missed += first_ids.setdefault(index, clinic_id) != clinic_id
+        wrong += owners.setdefault(clinic_id, index) != index
+    return len(set(ids)), missed, wrong
+
+def exact_ids(listings):
+    keys = {}
+    return [keys.setdefault((listing['clinic'].upper(), listing['city'].upper(), listing['zip_code']), len(keys) + 1)
+            for listing in listings]
+
+def resolved_ids(listings):
+    resolver = ListingResolver()
+    return [resolver.clinic(listing)[0] for listing in listings]
+
+def pairwise(listings):
+    """Score every pair of listings, as resolution without blocking would."""
+
+    weights = [clinic_weights(listing['clinic']) for listing in listings]
+    return sum(similarity(a, b) >= 0.75 for i, a in enumerate(weights) for b in weights[:i])
+
+def timed(parse, listings):
+    start = time.perf_counter()
+    parse(listings)
+    return time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listings', type=int, default=200000)
+    parser.add_argument('--pairwise-listings', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    listings, truth = random_listings(rng, args.listings)
+    print(f"{args.listings:,} listings of {len(set(truth)):,} clinics")
+    for label, resolve in [('exact name/city/zip', exact_ids), ('ListingResolver', resolved_ids)]:
+        found, missed, wrong = score(resolve(listings), truth)
+        print(f"{label:<20} {found:>9,} clinics   {missed:>8,} duplicate listings kept   "
+              f"{wrong:>6,} listings merged into another clinic")
+
+    print("\nlistings    ListingResolver")
+    count = max(args.listings // 8, 1)
+    while count <= args.listings:
+        elapsed = timed(resolved_ids, listings[:count])
+        print(f"{count:>8,}  {elapsed:>7.2f} s {elapsed / count * 1e6:>6.1f} us/listing")
+        count *= 2
+
+    count = args.pairwise_listings
+    print(f"\nevery pair of {count // 2:,} and {count:,} listings: "
+          f"{timed(pairwise, listings[:count // 2]):.2f} s, {timed(pairwise, listings[:count]):.2f} s")
+
+
+if __name__ == '__main__':
+    main()
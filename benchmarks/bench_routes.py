@@ -0,0 +1,240 @@
+"""Latency percentiles and SQL statement counts of every route on synthetic data.
+
+Loads a synthetic data set (see synthetic.py) into DATABASE_URL, which
+defaults to a separate baffv-bench database since all its tables are
+replaced, then requests each route through the Flask test client:
+    python -m benchmarks.bench_routes run --vets 100000 --reviews 10000000 --output bench.json
+
+--no-load reuses the data of the previous run. Results can be checked
+against a saved baseline, either right after a run or later:
+    python -m benchmarks.bench_routes run --no-load --output new.json --compare bench.json
+    python -m benchmarks.bench_routes compare bench.json new.json
+
+A route regresses when its p95 latency grows by more than --threshold (and
+more than --min-ms, to ignore noise on fast routes), or when it runs more
+SQL statements. compare exits with status 1 on regressions.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from statistics import mean, median, quantiles
+
+os.environ.setdefault('DATABASE_URL', 'postgresql:///baffv-bench')
+
+from sqlalchemy import event, func
+
+from app import app, CURR_USER_KEY
+from models import db, Clinic, Vet, User, Review
+from search_cache import search_cache
+from synthetic import SyntheticData, WORDS, load_synthetic
+from loader import print_report
+
+
+class Route:
+    """A route to benchmark.
+
+    url(rng, data) returns the url of the next request, picked from the ids
+    and zip codes in data. Logged in routes are requested as a random user,
+    and session values are set before each request.
+    """
+
+    def __init__(self, name, url, logged_in=False, session=None, uncached=False):
+        self.name = name
+        self.url = url
+        self.logged_in = logged_in
+        self.session = session or {}
+        self.uncached = uncached
+
+
+ROUTES = [
+    Route('home', lambda rng, data: '/'),
+    Route('found_vets', lambda rng, data: '/results',
+          session={'search_area': lambda rng, data: rng.choice(data['zip_codes'])}),
+    Route('found_vets_uncached', lambda rng, data: '/results', uncached=True,
+          session={'search_area': lambda rng, data: rng.choice(data['zip_codes'])}),
+    Route('found_vets_radius', lambda rng, data: '/results', uncached=True,
+          session={'search_area': lambda rng, data: rng.choice(data['zip_codes']),
+                   'search_radius': lambda rng, data: 25}),
+    Route('vet_profile', lambda rng, data: f"/vets/{rng.randint(1, data['vets'])}"),
+    Route('clinic_profile', lambda rng, data: f"/clinics/{rng.randint(1, data['clinics'])}"),
+    Route('user_profile', lambda rng, data: f"/users/{data['user_id']}", logged_in=True),
+    Route('all_reviews', lambda rng, data: '/reviews', logged_in=True),
+    Route('add_review_form', lambda rng, data: f"/reviews/{rng.randint(1, data['vets'])}/add", logged_in=True),
+    Route('get_favorites', lambda rng, data: '/api/users/favorites', logged_in=True),
+    Route('get_review', lambda rng, data: f"/api/reviews/{rng.randint(1, data['reviews'])}"),
+    Route('search_vets', lambda rng, data: f"/api/vets/search?q={rng.choice(data['zip_codes'])}&sort=rating"),
+    Route('fulltext_search_vets', lambda rng, data: f"/api/vets/fulltext?q={'+'.join(rng.sample(WORDS, 2))}"),
+    Route('autocomplete', lambda rng, data: f"/api/autocomplete?prefix={rng.choice(data['zip_codes'])[:3]}"),
+]
+
+
+def percentile(timings, p):
+    return quantiles(timings, n=100, method='inclusive')[p - 1]
+
+def data_ranges():
+    """Ids, and zip codes with vets, to build request urls from, as loaded in the database."""
+
+    return {
+        'vets': db.session.query(func.max(Vet.id)).scalar() or 1,
+        'clinics': db.session.query(func.max(Clinic.id)).scalar() or 1,
+        'users': db.session.query(func.max(User.id)).scalar() or 1,
+        'reviews': db.session.query(func.max(Review.id)).scalar() or 1,
+        'zip_codes': sorted(z for (z,) in db.session.query(Clinic.zip_code).join(Vet).distinct() if z),
+    }
+
+def bench_route(client, engine, route, data, rng, requests, warmup):
+    """Time requests to one route; return its latency percentiles, statement counts and statuses."""
+
+    statements = [0]
+
+    def count_statement(*args):
+        statements[0] += 1
+
+    timings, counts, statuses = [], [], Counter()
+    event.listen(engine, 'before_cursor_execute', count_statement)
+    try:
+        for i in range(warmup + requests):
+            data['user_id'] = rng.randint(1, data['users'])
+            with client.session_transaction() as sess:
+                sess.clear()
+                if route.logged_in:
+                    sess[CURR_USER_KEY] = data['user_id']
+                for key, value in route.session.items():
+                    sess[key] = value(rng, data)
+            if route.uncached:
+                search_cache.invalidate()
+            url = route.url(rng, data)
+
+            statements[0] = 0
+            start = time.perf_counter()
+            resp = client.get(url)
+            elapsed = (time.perf_counter() - start) * 1e3
+
+            if i >= warmup:
+                timings.append(elapsed)
+                counts.append(statements[0])
+                statuses[resp.status_code] += 1
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statement)
+
+    return {
+        'requests': requests,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(mean(timings), 3),
+        'queries': median(counts),
+        'max_queries': max(counts),
+        'statuses': {str(status): n for status, n in sorted(statuses.items())},
+    }
+
+def run(requests=200, warmup=5, names=None, seed=0):
+    """Benchmark the routes (all of them, or those in names) against the loaded data."""
+
+    routes = [route for route in ROUTES if not names or route.name in names]
+    with app.app_context():
+        data = data_ranges()
+        engine = db.engine
+        results = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'database': engine.dialect.name,
+            'data': {table: data[table] for table in ('clinics', 'vets', 'users', 'reviews')},
+            'routes': {},
+        }
+
+    with app.test_client() as client:
+        for route in routes:
+            rng = random.Random(f'{seed}-{route.name}')
+            result = bench_route(client, engine, route, data, rng, requests, warmup)
+            results['routes'][route.name] = result
+            print(f"{route.name:<22} p50 {result['p50_ms']:>8.2f} ms   p95 {result['p95_ms']:>8.2f} ms   "
+                  f"p99 {result['p99_ms']:>8.2f} ms   queries {result['queries']:>4}   "
+                  f"statuses {result['statuses']}")
+
+    return results
+
+def compare(baseline, current, threshold=0.2, min_ms=1.0):
+    """[(route, message)] of the routes that got slower or run more statements than in baseline."""
+
+    regressions = []
+    for name, now in current['routes'].items():
+        before = baseline['routes'].get(name)
+        if before is None:
+            continue
+        if now['p95_ms'] > before['p95_ms'] * (1 + threshold) and now['p95_ms'] - before['p95_ms'] > min_ms:
+            regressions.append((name, f"p95 {before['p95_ms']:.2f} ms -> {now['p95_ms']:.2f} ms"))
+        if now['max_queries'] > before['max_queries']:
+            regressions.append((name, f"queries {before['max_queries']} -> {now['max_queries']}"))
+    return regressions
+
+def report_comparison(baseline, current, threshold, min_ms):
+    """Print the regressions; return the exit status."""
+
+    regressions = compare(baseline, current, threshold, min_ms)
+    for name, message in regressions:
+        print(f"REGRESSION {name:<22} {message}")
+    if not regressions:
+        print(f"No regressions against the baseline of {baseline['created']}.")
+    return 1 if regressions else 0
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="load synthetic data and benchmark the routes")
+    run_parser.add_argument('--vets', type=int, default=1000)
+    run_parser.add_argument('--clinics', type=int, help="default: vets / 4")
+    run_parser.add_argument('--users', type=int, help="default: vets / 2")
+    run_parser.add_argument('--reviews', type=int, help="default: vets * 10")
+    run_parser.add_argument('--favorites', type=int, help="default: users * 5")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--no-load', action='store_true', help="reuse the data already in the database")
+    run_parser.add_argument('--requests', type=int, default=200, help="timed requests per route")
+    run_parser.add_argument('--warmup', type=int, default=5, help="untimed requests per route")
+    run_parser.add_argument('--route', action='append', dest='routes', help="only benchmark these routes")
+    run_parser.add_argument('--output', help="write the results to this JSON file")
+    run_parser.add_argument('--compare', metavar='BASELINE', help="check the results against a saved run")
+
+    compare_parser = commands.add_parser('compare', help="check saved results against a saved baseline")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+
+    for p in (run_parser, compare_parser):
+        p.add_argument('--threshold', type=float, default=0.2, help="allowed p95 growth, 0.2 = 20%%")
+        p.add_argument('--min-ms', type=float, default=1.0, help="ignore p95 growth below this")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        return report_comparison(load_json(args.baseline), load_json(args.current), args.threshold, args.min_ms)
+
+    if not args.no_load:
+        data = SyntheticData(vets=args.vets, clinics=args.clinics, users=args.users, reviews=args.reviews,
+                             favorites=args.favorites, seed=args.seed)
+        print(f"Loading {data.counts()} into {app.config['SQLALCHEMY_DATABASE_URI']}")
+        start = time.perf_counter()
+        with app.app_context():
+            load_synthetic(data, report=print_report)
+        print(f"Loaded in {time.perf_counter() - start:.1f} s")
+
+    results = run(requests=args.requests, warmup=args.warmup, names=args.routes, seed=args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        return report_comparison(load_json(args.compare), results, args.threshold, args.min_ms)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
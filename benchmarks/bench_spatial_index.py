@@ -0,0 +1,42 @@
+"""Radius query latency of the spatial grid as the number of clinics grows.
+
+Uses random clinic locations spread over the continental US, so it doesn't
+need a database:
+    python -m benchmarks.bench_spatial_index
+"""
+import random
+import time
+from statistics import median, quantiles
+
+from geo import SpatialGrid
+
+# Roughly the continental US.
+LAT_RANGE = (25.0, 49.0)
+LON_RANGE = (-124.5, -67.0)
+
+
+def random_point(rng):
+    return rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE)
+
+def main(sizes=(200, 2000, 20000, 100000), radii=(5, 25, 50), queries=2000, seed=0):
+    rng = random.Random(seed)
+    for size in sizes:
+        grid = SpatialGrid()
+        for key in range(size):
+            grid.insert(key, *random_point(rng))
+
+        for radius in radii:
+            timings = []
+            found = 0
+            for _ in range(queries):
+                lat, lon = random_point(rng)
+                start = time.perf_counter()
+                found += len(grid.within(lat, lon, radius))
+                timings.append((time.perf_counter() - start) * 1e6)
+            p95 = quantiles(timings, n=20)[-1]
+            print(f"{size:>7} clinics  radius {radius:>3} mi   median {median(timings):>8.1f} us   "
+                  f"p95 {p95:>8.1f} us   avg hits {found / queries:.1f}")
+
+
+if __name__ == '__main__':
+    main()
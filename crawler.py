@@ -0,0 +1,195 @@
+"""Concurrent crawling of the Fear Free directory.
+
+Crawler fetches pages on a thread pool through one keep-alive requests
+session, so connections are reused across pages. Failed requests (connection
+errors, 429s and 5xx responses) are retried with exponential backoff, and
+requests to the same host are spaced out by a per-host rate limit.
+
+With a PageCache, pages are re-fetched conditionally on their ETag and
+Last-Modified, so unchanged pages cost a 304 instead of a download, and a
+replay crawl reads every page from the cache without touching the network.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from page_cache import digest
+
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'}
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CrawlError(Exception):
+    """A page couldn't be fetched, even after retrying."""
+
+    def __init__(self, url, reason):
+        super().__init__(f"Couldn't fetch {url}: {reason}")
+        self.url = url
+        self.reason = reason
+
+
+class Page:
+    """A crawled page; changed is False when its body is the same as the cached one."""
+
+    __slots__ = ('url', 'content', 'digest', 'changed', 'from_cache')
+
+    def __init__(self, url, content, digest, changed=True, from_cache=False):
+        self.url = url
+        self.content = content
+        self.digest = digest
+        self.changed = changed
+        self.from_cache = from_cache
+
+    def __repr__(self):
+        return f'<Page {self.url} {self.digest[:12]}{" (cached)" if self.from_cache else ""}>'
+
+
+class HostRateLimiter:
+    """Spaces requests to each host at least 1 / rate seconds apart, across threads."""
+
+    def __init__(self, rate=None, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1 / rate if rate else 0
+        self.clock = clock
+        self.sleep = sleep
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        """Block until a request to host is allowed."""
+
+        if not self.interval:
+            return
+        with self._lock:
+            now = self.clock()
+            slot = max(self._next_slot.get(host, now), now)
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            self.sleep(slot - now)
+
+
+class Crawler:
+    """Fetches pages with bounded concurrency, retries and a per-host rate limit.
+
+    concurrency is the number of pages fetched at once, and the size of the
+    session's connection pool. A failed request is retried up to `retries`
+    times, waiting backoff, 2 * backoff, 4 * backoff... seconds in between, or
+    as long as a 429/503 response's Retry-After asks for. rate is the most
+    requests per second sent to any one host (None for no limit). cache is a
+    PageCache to re-fetch pages conditionally from; with replay, pages only
+    come from the cache.
+    """
+
+    def __init__(self, concurrency=4, retries=3, backoff=0.5, max_backoff=30, rate=2, timeout=30,
+                 headers=HEADERS, cache=None, replay=False, sleep=time.sleep):
+        if replay and cache is None:
+            raise ValueError("Replaying a crawl needs a cache.")
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.sleep = sleep
+        self.cache = cache
+        self.replay = replay
+        self.rate_limiter = HostRateLimiter(rate, sleep=sleep)
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.requests = 0
+        self.retried = 0
+        self.not_modified = 0
+        self.bytes_downloaded = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None and not self.replay:
+            self.cache.save()
+
+    def retry_delay(self, attempt, response=None):
+        """Seconds to wait before retry number attempt (1, 2...) of a request."""
+
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return min(int(response.headers['Retry-After']), self.max_backoff)
+        return min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+
+    def fetch(self, url):
+        """GET url, retrying failures, or read it from the cache; return a Page or raise CrawlError."""
+
+        if self.replay:
+            entry = self.cache.lookup(url)
+            if entry is None:
+                raise CrawlError(url, "not in the cache")
+            return Page(url, self.cache.read(entry), entry['digest'], changed=False, from_cache=True)
+
+        headers = self.cache.validators(url) if self.cache is not None else {}
+        host = urlsplit(url).netloc
+        for attempt in range(self.retries + 1):
+            if attempt:
+                with self._lock:
+                    self.retried += 1
+                self.sleep(self.retry_delay(attempt, response))
+            self.rate_limiter.wait(host)
+            with self._lock:
+                self.requests += 1
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, reason = None, e
+                continue
+            if response.status_code not in RETRY_STATUSES:
+                break
+            reason = f"HTTP {response.status_code}"
+        else:
+            raise CrawlError(url, reason)
+
+        if response.status_code == 304 and headers:
+            with self._lock:
+                self.not_modified += 1
+            entry = self.cache.lookup(url)
+            return Page(url, self.cache.read(entry), entry['digest'], changed=False, from_cache=True)
+        if response.status_code >= 400 or response.status_code == 304:
+            raise CrawlError(url, f"HTTP {response.status_code}")
+
+        content = response.content
+        with self._lock:
+            self.bytes_downloaded += len(content)
+        if self.cache is None:
+            return Page(url, content, digest(content))
+        body_digest, changed = self.cache.store(url, content, response.headers)
+        return Page(url, content, body_digest, changed)
+
+    def crawl(self, urls):
+        """Fetch urls concurrently; yield their Pages in the order of urls.
+
+        Only 2 * concurrency pages are fetched ahead of the one being yielded,
+        so memory doesn't grow with the number of urls, however slowly the
+        pages are consumed.
+        """
+
+        urls = iter(urls)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            window = deque(executor.submit(self.fetch, url) for url in islice(urls, 2 * self.concurrency))
+            try:
+                while window:
+                    page = window.popleft().result()
+                    window.extend(executor.submit(self.fetch, url) for url in islice(urls, 1))
+                    yield page
+            finally:
+                for future in window:
+                    future.cancel()
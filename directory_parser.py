@@ -0,0 +1,123 @@
+"""Parsing the vet cards of Fear Free directory pages.
+
+parse_cards() reads every field of each sabai-entity-content-* card in one
+pass, into a record per vet:
+    {'fear_free_id', 'name', 'clinic', 'address', 'phone', 'website'}
+
+It can parse with BeautifulSoup and html5lib, as the scraper always did, or
+with lxml or selectolax, which are many times faster. Those two are optional;
+pip install lxml or selectolax to use them. Every backend gives the same
+records.
+"""
+import re
+from functools import lru_cache
+
+CARD_ID_PREFIX = 'sabai-entity-content-'
+SUMMARY_CLASS = 'sabai-directory-custom-fields-practice-individual-summary'
+ADDRESS_CLASS = 'sabai-googlemaps-address sabai-googlemaps-address-0'
+WEBSITE_CLASS = 'sabai-directory-contact-website'
+
+# Fastest first, for the default backend.
+BACKEND_PREFERENCE = ('selectolax', 'lxml', 'html5lib')
+
+
+def clean_name(name):
+    return name.replace('Dr. ', '').replace('&', 'and')
+
+def card_record(card_id, name, summary, address, phone, website):
+    """Record of a card from the text of its fields; a vet without a clinic summary is their own clinic."""
+
+    return {'fear_free_id': int(card_id.replace(CARD_ID_PREFIX, '')), 'name': clean_name(name),
+            'clinic': summary if summary is not None else clean_name(name),
+            'address': address or '', 'phone': phone or '', 'website': website or ''}
+
+def decode(content):
+    return content.decode('utf-8', errors='replace') if isinstance(content, bytes) else content
+
+
+def parse_html5lib(content):
+    from bs4 import BeautifulSoup
+
+    records = []
+    for card in BeautifulSoup(content, 'html5lib').find_all('div', id=re.compile(CARD_ID_PREFIX)):
+        summary = card.find('div', class_=SUMMARY_CLASS)
+        address = card.find('span', class_=ADDRESS_CLASS)
+        phone = card.find('span', itemprop='telephone')
+        website = card.find('div', class_=WEBSITE_CLASS)
+        link = website.find('a') if website is not None else None
+        records.append(card_record(
+            card['id'], card.find('a').get_text(strip=True),
+            summary.get_text(strip=True) if summary is not None else None,
+            address.get_text(strip=True) if address is not None else None,
+            phone.get_text(strip=True) if phone is not None else None,
+            link.get('href') if link is not None else None))
+    return records
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+def parse_lxml(content):
+    import lxml.html
+
+    def text(elements):
+        return ''.join(s.strip() for s in elements[0].itertext()) if elements else None
+
+    records = []
+    root = lxml.html.document_fromstring(decode(content))
+    for card in root.xpath(f"//div[contains(@id, '{CARD_ID_PREFIX}')]"):
+        website = card.xpath(f"(.//div[{_has_class(WEBSITE_CLASS)}])[1]")
+        href = website[0].xpath('(.//a)[1]/@href') if website else None
+        records.append(card_record(
+            card.get('id'), text(card.xpath('(.//a)[1]')),
+            text(card.xpath(f"(.//div[{_has_class(SUMMARY_CLASS)}])[1]")),
+            text(card.xpath(f"(.//span[@class='{ADDRESS_CLASS}'])[1]")),
+            text(card.xpath("(.//span[@itemprop='telephone'])[1]")),
+            href[0] if href else None))
+    return records
+
+def parse_selectolax(content):
+    from selectolax.lexbor import LexborHTMLParser
+
+    def text(node):
+        return node.text(deep=True, separator='', strip=True) if node is not None else None
+
+    records = []
+    for card in LexborHTMLParser(decode(content)).css(f'div[id*="{CARD_ID_PREFIX}"]'):
+        website = card.css_first(f'div.{WEBSITE_CLASS}')
+        link = website.css_first('a') if website is not None else None
+        records.append(card_record(
+            card.attributes['id'], text(card.css_first('a')),
+            text(card.css_first(f'div.{SUMMARY_CLASS}')),
+            text(card.css_first(f'span[class="{ADDRESS_CLASS}"]')),
+            text(card.css_first('span[itemprop="telephone"]')),
+            link.attributes.get('href') if link is not None else None))
+    return records
+
+
+# Each backend is named after the package it needs.
+BACKENDS = {'html5lib': parse_html5lib, 'lxml': parse_lxml, 'selectolax': parse_selectolax}
+
+
+@lru_cache(maxsize=None)
+def backend_available(backend):
+    try:
+        __import__(backend)
+    except ImportError:
+        return False
+    return True
+
+def available_backends():
+    return [backend for backend in BACKEND_PREFERENCE if backend_available(backend)]
+
+def default_backend():
+    return available_backends()[0]
+
+def parse_cards(content, backend=None):
+    """Records of the vet cards of a directory page, parsed with backend (the fastest installed by default)."""
+
+    backend = backend or default_backend()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown parser backend {backend!r}; use one of {', '.join(BACKENDS)}.")
+    if not backend_available(backend):
+        raise ValueError(f"The {backend} parser backend isn't installed; pip install {backend}.")
+    return BACKENDS[backend](content)
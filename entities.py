@@ -0,0 +1,154 @@
+"""Entity resolution of scraped clinic and vet listings.
+
+The directory lists a clinic once per vet, not always under the same name:
+"VCA San Jose" and "VCA Animal Hospital San Jose" are one clinic. Listings
+are resolved as they stream by, without comparing every pair. Each one is
+only scored against the entities in its block, i.e. the clinics in its zip
+code that share a distinctive word of their name, so the work grows with the
+number of listings rather than its square. Names are scored by their
+weighted token overlap, where words every clinic's name has, like "animal"
+or "hospital", count for little.
+"""
+import re
+from collections import defaultdict
+
+from search import normalize_city
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Dropped from names altogether.
+STOP_WORDS = frozenset({'a', 'an', 'and', 'the', 'of', 'at', 'in', 'inc', 'llc', 'pc', 'dba', 'co'})
+# Words in the names of many unrelated clinics, weighted GENERIC_WEIGHT rather than 1.
+CLINIC_WORDS = frozenset({'animal', 'animals', 'pet', 'pets', 'vet', 'vets', 'veterinary', 'veterinarian',
+                          'veterinarians', 'hospital', 'clinic', 'center', 'centre', 'care', 'medical',
+                          'health', 'services', 'practice', 'group'})
+# Titles and degrees around vets' names.
+VET_TITLES = frozenset({'dr', 'dvm', 'vmd', 'bvsc', 'bvms', 'mrcvs', 'phd', 'ms', 'msc', 'mph', 'dabvp', 'dacvb',
+                        'dacvim', 'dacvs', 'cvpm', 'cva', 'cvt', 'rvt', 'jr', 'sr', 'ii', 'iii'})
+GENERIC_WEIGHT = 0.25
+
+# Minimum similarity of two listings of the same entity.
+CLINIC_THRESHOLD = 0.75
+VET_THRESHOLD = 0.8
+
+STREET_NUMBER_PATTERN = re.compile(r"\d+")
+
+
+def tokens(text):
+    """The words of a name, lower-cased, without punctuation or stop words."""
+
+    text = (text or '').lower().replace('&', ' and ').replace("'", '')
+    return [token for token in TOKEN_PATTERN.findall(text) if token not in STOP_WORDS]
+
+def clinic_weights(name):
+    """{token: weight} of a clinic's name; generic words like 'hospital' weigh GENERIC_WEIGHT."""
+
+    return {token: GENERIC_WEIGHT if token in CLINIC_WORDS else 1.0 for token in tokens(name)}
+
+def vet_weights(name):
+    """{token: weight} of a vet's name, without titles, degrees or initials."""
+
+    return {token: 1.0 for token in tokens(name)
+            if token not in VET_TITLES and not (len(token) == 1 and token.isalpha())}
+
+def similarity(weights, other):
+    """Weighted Jaccard similarity of two {token: weight}: 1 for the same tokens, 0 for none in common."""
+
+    shared = sum(weight for token, weight in weights.items() if token in other)
+    total = sum(weights.values()) + sum(other.values()) - shared
+    return shared / total if total else 0.0
+
+def street_number(street_address):
+    """The number a street address starts with, or None."""
+
+    match = STREET_NUMBER_PATTERN.match((street_address or '').strip())
+    return match.group() if match else None
+
+
+class Resolver:
+    """Assigns listings to entities, numbered from 1 as they're first seen.
+
+    A listing is the same entity as the most similar earlier one in its block
+    sharing a blocking token with it, if similar enough; listings are never
+    compared across blocks. Listings with different tags, i.e. street numbers,
+    are never the same entity. Only the first listing of each entity is kept.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.listings = 0
+        # (weights, tag) of each entity's first listing, by entity id - 1.
+        self._entities = []
+        self._postings = defaultdict(list)
+
+    def __len__(self):
+        return len(self._entities)
+
+    @staticmethod
+    def blocking_tokens(weights):
+        """The tokens a listing is indexed under: its distinctive ones, or all of them when it has none."""
+
+        distinctive = [token for token, weight in weights.items() if weight == 1.0]
+        return distinctive or list(weights)
+
+    def candidates(self, block, weights):
+        return sorted({entity_id for token in self.blocking_tokens(weights)
+                       for entity_id in self._postings.get((block, token), ())})
+
+    def resolve(self, block, weights, tag=None):
+        """(entity id, whether the listing is a new entity) of a listing."""
+
+        self.listings += 1
+        best_id, best_score = None, self.threshold
+        for entity_id in self.candidates(block, weights):
+            other, other_tag = self._entities[entity_id - 1]
+            if tag is not None and other_tag is not None and tag != other_tag:
+                continue
+            score = similarity(weights, other)
+            if score >= best_score:
+                best_id, best_score = entity_id, score
+                if score == 1.0:
+                    break
+        if best_id is not None:
+            return best_id, False
+
+        self._entities.append((weights, tag))
+        entity_id = len(self._entities)
+        for token in self.blocking_tokens(weights):
+            self._postings[block, token].append(entity_id)
+        return entity_id, True
+
+
+class ListingResolver:
+    """Clinic and vet ids of scraped vet records, merging listings of the same clinic or vet.
+
+    Clinics are blocked on their zip code, or their city when they have none,
+    then on the words of their name. Vets are the same vet when they have the
+    same Fear Free id, or similar names at the same clinic.
+    """
+
+    def __init__(self, clinic_threshold=CLINIC_THRESHOLD, vet_threshold=VET_THRESHOLD):
+        self.clinics = Resolver(clinic_threshold)
+        self.vets = Resolver(vet_threshold)
+        self._vet_ids = {}
+
+    def clinic(self, record):
+        """(clinic id, whether it's a new clinic) of a record."""
+
+        weights = clinic_weights(record['clinic'])
+        block = record['zip_code'] or normalize_city(record['city'])
+        if not block:
+            # Nothing to narrow them down by: only the same names are the same clinic.
+            block = frozenset(weights)
+        return self.clinics.resolve(block, weights, street_number(record['street_address']))
+
+    def vet(self, record, clinic_id):
+        """(vet id, whether it's a new vet) of a record at the clinic with clinic_id."""
+
+        vet_id = self._vet_ids.get(record['fear_free_id'])
+        if vet_id is not None:
+            self.vets.listings += 1
+            return vet_id, False
+        weights = vet_weights(record['name']) or {str(record['fear_free_id']): 1.0}
+        vet_id, new = self.vets.resolve(clinic_id, weights)
+        self._vet_ids[record['fear_free_id']] = vet_id
+        return vet_id, new
@@ -0,0 +1,181 @@
+"""Local stand-in for the Fear Free directory, to test and benchmark crawls offline.
+
+FixtureServer serves saved directory pages (page-1.html, page-2.html... in a
+directory) as /fear-free-directory?p=1, ?p=2... over keep-alive HTTP/1.1, from
+a background thread. It can add latency, like the real site, and fail the
+first requests of each page, to exercise retries. Pages carry an ETag and
+Last-Modified and answer conditional requests with 304 Not Modified, like a
+well-behaved server would. save_directory_pages()
+writes pages in the directory's markup, i.e. from synthetic listings.
+"""
+import hashlib
+import os
+import threading
+import time
+from email.utils import formatdate
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+DIRECTORY_PATH = '/fear-free-directory'
+
+
+def page_file(directory, page):
+    return os.path.join(directory, f'page-{page}.html')
+
+def render_listing(listing):
+    """Markup of one vet in a directory page; listing has the fields of a scraped vet."""
+
+    summary = (f'<div class="sabai-directory-custom-fields-practice-individual-summary">{escape(listing["clinic"])}</div>'
+               if listing.get('clinic') else '')
+    phone = (f'<span itemprop="telephone">{escape(listing["phone"])}</span>' if listing.get('phone') else '')
+    website = (f'<div class="sabai-directory-contact-website"><a href="{escape(listing["website"])}">Website</a></div>'
+               if listing.get('website') else '')
+    return f"""
+<div id="sabai-entity-content-{listing['fear_free_id']}" class="sabai-entity sabai-entity-type-content">
+  <div class="sabai-directory-title"><a href="/directory/listing/{listing['fear_free_id']}">Dr. {escape(listing['name'])}</a></div>
+  {summary}
+  <div class="sabai-directory-location">
+    <span class="sabai-googlemaps-address sabai-googlemaps-address-0">{escape(listing['address'])}</span>
+  </div>
+  <div class="sabai-directory-contact">{phone}{website}</div>
+</div>"""
+
+def render_page(listings):
+    body = ''.join(render_listing(listing) for listing in listings)
+    return f'<!DOCTYPE html>\n<html><head><title>Fear Free Directory</title></head><body>{body}\n</body></html>\n'
+
+def save_directory_pages(directory, listings, per_page=20):
+    """Write listings as page-N.html files of per_page vets each; return the number of pages."""
+
+    listings = list(listings)
+    pages = 0
+    for pages, start in enumerate(range(0, len(listings), per_page), 1):
+        with open(page_file(directory, pages), 'w') as f:
+            f.write(render_page(listings[start:start + per_page]))
+    return pages
+
+
+class FixtureServer:
+    """Serves the saved pages of a directory on localhost until stopped.
+
+    latency is the seconds each response takes; flaky is the number of times
+    each page answers 503 before it's served. requests, not_modified,
+    bytes_sent, connections and peak_concurrency count what crawls did, to
+    check conditional requests, connection reuse and concurrency bounds.
+    """
+
+    def __init__(self, directory, latency=0, flaky=0, port=0):
+        self.directory = directory
+        self.latency = latency
+        self.flaky = flaky
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self.connections = 0
+        self.peak_concurrency = 0
+        self._active = 0
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}{DIRECTORY_PATH}'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def reset_failures(self):
+        """Have every page fail flaky times again."""
+
+        with self._lock:
+            self._failures.clear()
+
+    def respond(self, path, request_headers):
+        """(status, headers, body) of a GET of path."""
+
+        url = urlsplit(path)
+        page = parse_qs(url.query).get('p', ['1'])[0]
+        if url.path != DIRECTORY_PATH or not page.isdigit():
+            return 404, {}, b'Not found'
+        with self._lock:
+            failures = self._failures.get(page, 0)
+            if failures < self.flaky:
+                self._failures[page] = failures + 1
+                return 503, {}, b'Try again'
+        try:
+            with open(page_file(self.directory, int(page)), 'rb') as f:
+                body = f.read()
+                modified = formatdate(os.fstat(f.fileno()).st_mtime, usegmt=True)
+        except FileNotFoundError:
+            return 404, {}, b'Not found'
+
+        headers = {'ETag': f'"{hashlib.sha256(body).hexdigest()[:32]}"', 'Last-Modified': modified}
+        if 'If-None-Match' in request_headers:
+            fresh = request_headers['If-None-Match'] == headers['ETag']
+        else:
+            fresh = request_headers.get('If-Modified-Since') == modified
+        if fresh:
+            with self._lock:
+                self.not_modified += 1
+            return 304, headers, b''
+        return 200, headers, body
+
+    def _handler_class(self):
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body in one packet, or keep-alive requests stall on delayed ACKs.
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with fixture._lock:
+                    fixture.connections += 1
+
+            def do_GET(self):
+                with fixture._lock:
+                    fixture.requests += 1
+                    fixture._active += 1
+                    fixture.peak_concurrency = max(fixture.peak_concurrency, fixture._active)
+                try:
+                    if fixture.latency:
+                        time.sleep(fixture.latency)
+                    status, headers, body = fixture.respond(self.path, self.headers)
+                finally:
+                    with fixture._lock:
+                        fixture._active -= 1
+                with fixture._lock:
+                    fixture.bytes_sent += len(body)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if status != 304:
+                    self.send_header('Content-Type', 'text/html; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
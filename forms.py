@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, TextAreaField, RadioField
+from wtforms import StringField, PasswordField, TextAreaField, RadioField, SelectField
 from wtforms.validators import DataRequired, Email, Length
 
 
@@ -31,3 +31,6 @@ class LoginForm(FlaskForm):
 class VetSearchForm(FlaskForm):
     """Form for searching vets in a particular zip code."""
     zipcode_or_city = StringField('Zip Code or City', validators=[DataRequired()])
+    radius = SelectField('Radius', choices=[(0, 'Exact match'), (5, 'Within 5 miles'), (10, 'Within 10 miles'),
+                                            (25, 'Within 25 miles'), (50, 'Within 50 miles')],
+                         coerce=int, default=0)
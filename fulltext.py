@@ -0,0 +1,318 @@
+"""Full-text search over vet names, clinic names and review comments.
+
+Every vet has a row in the vet_search table holding the text to search:
+its name, its clinic's name and its review comments, newest first and cut
+off at COMMENTS_MAX_LENGTH characters. Database triggers keep the rows
+current when vets, clinics or reviews change, so bulk loads that bypass the
+ORM are covered too. The cutoff bounds the text a new review re-indexes,
+and keeps a popular vet's tsvector well under Postgres's 1 MB limit.
+
+On Postgres vet_search has a weighted tsvector column with a GIN index. On
+SQLite (local runs and tests) vet_search is an FTS5 virtual table.
+"""
+import re
+from contextlib import contextmanager
+
+from markupsafe import escape, Markup
+from sqlalchemy import event, text, Float, Integer, String
+
+from models import db, Vet, Clinic
+
+# Markers put around matches by ts_headline/snippet, replaced with <mark> after escaping.
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+# Characters of review comments indexed per vet, from its newest review back.
+COMMENTS_MAX_LENGTH = 20000
+
+POSTGRES_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS vet_search (
+        vet_id integer PRIMARY KEY REFERENCES vets (id) ON DELETE CASCADE,
+        name text NOT NULL DEFAULT '',
+        clinic text NOT NULL DEFAULT '',
+        comments text NOT NULL DEFAULT '',
+        document tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', name), 'A') ||
+            setweight(to_tsvector('english', clinic), 'B') ||
+            setweight(to_tsvector('english', comments), 'C')) STORED
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_vet_search_document ON vet_search USING gin (document)",
+    f"""
+    CREATE OR REPLACE FUNCTION vet_search_refresh(target_vet integer) RETURNS void AS $$
+    BEGIN
+        INSERT INTO vet_search (vet_id, name, clinic, comments)
+        SELECT v.id, v.name, coalesce(c.name, ''),
+               left(coalesce((SELECT string_agg(r.comment, ' ' ORDER BY r.id DESC)
+                              FROM reviews r WHERE r.vet_id = v.id), ''), {COMMENTS_MAX_LENGTH})
+        FROM vets v LEFT JOIN clinics c ON c.id = v.clinic_id
+        WHERE v.id = target_vet
+        ON CONFLICT (vet_id) DO UPDATE
+        SET name = EXCLUDED.name, clinic = EXCLUDED.clinic, comments = EXCLUDED.comments;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION vet_search_on_vet() RETURNS trigger AS $$
+    BEGIN
+        PERFORM vet_search_refresh(NEW.id);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION vet_search_on_clinic() RETURNS trigger AS $$
+    BEGIN
+        UPDATE vet_search SET clinic = NEW.name
+        WHERE vet_id IN (SELECT id FROM vets WHERE clinic_id = NEW.id);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION vet_search_on_review() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            -- New reviews are prepended instead of re-aggregating all of the vet's comments.
+            UPDATE vet_search
+            SET comments = left(concat_ws(' ', NEW.comment, nullif(comments, '')), {COMMENTS_MAX_LENGTH})
+            WHERE vet_id = NEW.vet_id;
+        ELSE
+            PERFORM vet_search_refresh(OLD.vet_id);
+            IF TG_OP = 'UPDATE' AND NEW.vet_id IS DISTINCT FROM OLD.vet_id THEN
+                PERFORM vet_search_refresh(NEW.vet_id);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS vet_search_vet ON vets",
+    """
+    CREATE TRIGGER vet_search_vet AFTER INSERT OR UPDATE OF name, clinic_id ON vets
+    FOR EACH ROW EXECUTE FUNCTION vet_search_on_vet()
+    """,
+    "DROP TRIGGER IF EXISTS vet_search_clinic ON clinics",
+    """
+    CREATE TRIGGER vet_search_clinic AFTER UPDATE OF name ON clinics
+    FOR EACH ROW EXECUTE FUNCTION vet_search_on_clinic()
+    """,
+    "DROP TRIGGER IF EXISTS vet_search_review ON reviews",
+    """
+    CREATE TRIGGER vet_search_review AFTER INSERT OR UPDATE OF comment, vet_id OR DELETE ON reviews
+    FOR EACH ROW EXECUTE FUNCTION vet_search_on_review()
+    """,
+]
+
+POSTGRES_TRIGGERS = {'vets': 'vet_search_vet', 'clinics': 'vet_search_clinic', 'reviews': 'vet_search_review'}
+
+# Comments of a vet, as stored in vet_search, in SQLite.
+SQLITE_COMMENTS = ("substr(coalesce((SELECT group_concat(comment, ' ') FROM "
+                   "(SELECT comment FROM reviews WHERE vet_id = {vet_id} ORDER BY id DESC)), ''), "
+                   f"1, {COMMENTS_MAX_LENGTH})")
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS vet_search USING fts5(name, clinic, comments)",
+    """
+    CREATE TRIGGER IF NOT EXISTS vet_search_vet_insert AFTER INSERT ON vets BEGIN
+        INSERT INTO vet_search (rowid, name, clinic, comments)
+        VALUES (NEW.id, NEW.name, coalesce((SELECT name FROM clinics WHERE id = NEW.clinic_id), ''), '');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS vet_search_vet_update AFTER UPDATE OF name, clinic_id ON vets BEGIN
+        UPDATE vet_search
+        SET name = NEW.name, clinic = coalesce((SELECT name FROM clinics WHERE id = NEW.clinic_id), '')
+        WHERE rowid = NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS vet_search_vet_delete AFTER DELETE ON vets BEGIN
+        DELETE FROM vet_search WHERE rowid = OLD.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS vet_search_clinic_update AFTER UPDATE OF name ON clinics BEGIN
+        UPDATE vet_search SET clinic = NEW.name
+        WHERE rowid IN (SELECT id FROM vets WHERE clinic_id = NEW.id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS vet_search_review_insert AFTER INSERT ON reviews BEGIN
+        UPDATE vet_search
+        SET comments = substr(CASE WHEN comments = '' THEN coalesce(NEW.comment, '')
+                                   ELSE coalesce(NEW.comment || ' ', '') || comments END, 1, {COMMENTS_MAX_LENGTH})
+        WHERE rowid = NEW.vet_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS vet_search_review_update AFTER UPDATE OF comment, vet_id ON reviews BEGIN
+        UPDATE vet_search SET comments = {SQLITE_COMMENTS.format(vet_id='OLD.vet_id')} WHERE rowid = OLD.vet_id;
+        UPDATE vet_search SET comments = {SQLITE_COMMENTS.format(vet_id='NEW.vet_id')} WHERE rowid = NEW.vet_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS vet_search_review_delete AFTER DELETE ON reviews BEGIN
+        UPDATE vet_search SET comments = {SQLITE_COMMENTS.format(vet_id='OLD.vet_id')} WHERE rowid = OLD.vet_id;
+    END
+    """,
+]
+
+SQLITE_TRIGGERS = ('vet_search_vet_insert', 'vet_search_vet_update', 'vet_search_vet_delete',
+                   'vet_search_clinic_update', 'vet_search_review_insert', 'vet_search_review_update',
+                   'vet_search_review_delete')
+
+# The index and foreign key are built again in one pass after the rows are in, rather than row by row.
+POSTGRES_REBUILD = [
+    "TRUNCATE vet_search",
+    "DROP INDEX IF EXISTS ix_vet_search_document",
+    "ALTER TABLE vet_search DROP CONSTRAINT IF EXISTS vet_search_vet_id_fkey",
+    f"""
+    INSERT INTO vet_search (vet_id, name, clinic, comments)
+    SELECT v.id, v.name, coalesce(c.name, ''), left(coalesce(r.comments, ''), {COMMENTS_MAX_LENGTH})
+    FROM vets v
+    LEFT JOIN clinics c ON c.id = v.clinic_id
+    LEFT JOIN (SELECT vet_id, string_agg(comment, ' ' ORDER BY id DESC) AS comments
+               FROM reviews GROUP BY vet_id) r ON r.vet_id = v.id
+    """,
+    "ALTER TABLE vet_search ADD CONSTRAINT vet_search_vet_id_fkey "
+    "FOREIGN KEY (vet_id) REFERENCES vets (id) ON DELETE CASCADE",
+    "CREATE INDEX ix_vet_search_document ON vet_search USING gin (document)",
+]
+
+SQLITE_REBUILD = [
+    "DELETE FROM vet_search",
+    f"""
+    INSERT INTO vet_search (rowid, name, clinic, comments)
+    SELECT v.id, v.name, coalesce(c.name, ''), substr(coalesce(r.comments, ''), 1, {COMMENTS_MAX_LENGTH})
+    FROM vets v
+    LEFT JOIN clinics c ON c.id = v.clinic_id
+    LEFT JOIN (SELECT vet_id, group_concat(comment, ' ') AS comments
+               FROM (SELECT vet_id, comment FROM reviews ORDER BY vet_id, id DESC) GROUP BY vet_id) r ON r.vet_id = v.id
+    """,
+]
+
+# Ranks the top matches first, then builds headlines for those rows only.
+POSTGRES_SEARCH = """
+    SELECT ranked.vet_id, ranked.rank,
+           ts_headline('english', ranked.body, ranked.query, :headline_options) AS snippet
+    FROM (SELECT s.vet_id, ts_rank(s.document, q) AS rank,
+                 concat_ws(' ... ', s.name, s.clinic, nullif(s.comments, '')) AS body, q AS query
+          FROM vet_search s JOIN vets v ON v.id = s.vet_id AND v.active,
+               websearch_to_tsquery('english', :q) q
+          WHERE s.document @@ q
+          ORDER BY rank DESC, s.vet_id
+          LIMIT :limit) ranked
+"""
+
+SQLITE_SEARCH = """
+    SELECT rowid AS vet_id,
+           -bm25(vet_search, 10.0, 5.0, 1.0) AS rank,
+           snippet(vet_search, -1, :start, :stop, '...', 16) AS snippet
+    FROM vet_search
+    WHERE vet_search MATCH :q AND rowid IN (SELECT id FROM vets WHERE active)
+    ORDER BY rank DESC, rowid
+    LIMIT :limit
+"""
+
+HEADLINE_OPTIONS = (f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, "
+                    "MaxFragments=2, MaxWords=20, MinWords=8, FragmentDelimiter=\" ... \"")
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def _run(connection, statements):
+    for statement in statements:
+        connection.execute(text(statement))
+
+@event.listens_for(db.metadata, 'after_create')
+def create_search_table(target, connection, **kw):
+    """Create vet_search and its triggers along with the other tables."""
+
+    if connection.dialect.name == 'postgresql':
+        _run(connection, POSTGRES_DDL)
+    elif connection.dialect.name == 'sqlite':
+        _run(connection, SQLITE_DDL)
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_search_table(target, connection, **kw):
+    """Drop vet_search before the tables it depends on."""
+
+    if connection.dialect.name in ('postgresql', 'sqlite'):
+        connection.execute(text("DROP TABLE IF EXISTS vet_search"))
+
+@contextmanager
+def search_triggers_disabled():
+    """Turn off the vet_search triggers for a bulk load, to be followed by rebuild_search_table().
+
+    Adding every review of a popular vet one by one re-parses up to
+    COMMENTS_MAX_LENGTH characters of its comments each time. SQLite can't disable triggers, so they're
+    dropped and created again.
+    """
+
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        _run(db.session.connection(), [f"ALTER TABLE {table} DISABLE TRIGGER {trigger}"
+                                       for table, trigger in POSTGRES_TRIGGERS.items()])
+    elif dialect == 'sqlite':
+        _run(db.session.connection(), [f"DROP TRIGGER IF EXISTS {trigger}" for trigger in SQLITE_TRIGGERS])
+    try:
+        yield
+    except BaseException:
+        db.session.rollback()
+        raise
+    finally:
+        if dialect == 'postgresql':
+            _run(db.session.connection(), [f"ALTER TABLE {table} ENABLE TRIGGER {trigger}"
+                                           for table, trigger in POSTGRES_TRIGGERS.items()])
+        elif dialect == 'sqlite':
+            _run(db.session.connection(), SQLITE_DDL)
+        db.session.commit()
+
+def rebuild_search_table():
+    """Recompute every vet_search row in one pass, i.e. after a bulk load with triggers disabled."""
+
+    statements = POSTGRES_REBUILD if db.engine.dialect.name == 'postgresql' else SQLITE_REBUILD
+    _run(db.session.connection(), statements)
+    db.session.commit()
+
+def fts5_query(q):
+    """Turn free text into an FTS5 query matching all of its words.
+
+    Quoting every word keeps FTS5 operators and punctuation, i.e. the dash in
+    "cat-only", from being parsed as query syntax.
+    """
+
+    return ' '.join(f'"{word}"' for word in WORD_PATTERN.findall(q))
+
+def highlight(snippet):
+    """Escape a snippet and turn the match markers into <mark> tags."""
+
+    escaped = str(escape(snippet or ''))
+    return Markup(escaped.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>'))
+
+def search_vets_fulltext(q, limit=20):
+    """Vets best matching the words in q, best match first.
+
+    Returns [(vet, clinic, rank, snippet)] from one query on the full-text
+    index. snippet is HTML with the matched words wrapped in <mark>.
+    """
+
+    if db.engine.dialect.name == 'postgresql':
+        statement = text(POSTGRES_SEARCH).bindparams(q=q, limit=limit, headline_options=HEADLINE_OPTIONS)
+    else:
+        match = fts5_query(q)
+        if not match:
+            return []
+        statement = text(SQLITE_SEARCH).bindparams(q=match, limit=limit, start=HIGHLIGHT_START,
+                                                   stop=HIGHLIGHT_STOP)
+
+    matches = statement.columns(vet_id=Integer, rank=Float, snippet=String).subquery()
+    rows = (db.session.query(Vet, Clinic, matches.c.rank, matches.c.snippet)
+            .join(matches, matches.c.vet_id == Vet.id)
+            .outerjoin(Clinic, Clinic.id == Vet.clinic_id)
+            .order_by(matches.c.rank.desc(), Vet.id)
+            .all())
+
+    return [(vet, clinic, rank, highlight(snippet)) for vet, clinic, rank, snippet in rows]
@@ -0,0 +1,205 @@
+"""Offline geocoding of clinics and the spatial index behind radius searches.
+
+Zip code centroids come from scraped_data/zip_centroids.csv.gz, which was
+extracted from the MIT licensed `zipcodes` package (US zip codes with their
+city, state, latitude and longitude).
+"""
+import csv
+import gzip
+import math
+import os
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+from sqlalchemy import event, inspect
+
+from models import db, Vet, Clinic
+from search import LazyIndex, normalize_city
+
+ZIP_CENTROIDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'scraped_data', 'zip_centroids.csv.gz')
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LAT = 69.0
+
+
+def read_centroids(path=ZIP_CENTROIDS_PATH):
+    """(zip, city, state, lat, lon) rows of the zip centroids file."""
+
+    with gzip.open(path, 'rt', newline='') as f:
+        rows = csv.reader(f)
+        header = next(rows)
+        columns = [header.index(column) for column in ('zip_code', 'city', 'state', 'latitude', 'longitude')]
+        for row in rows:
+            zip_code, city, state, lat, lon = (row[i] for i in columns)
+            yield zip_code, city, state, float(lat), float(lon)
+
+@lru_cache(maxsize=None)
+def load_zip_centroids(path=ZIP_CENTROIDS_PATH):
+    """Return {zip: (lat, lon)}."""
+
+    return {zip_code: (lat, lon) for zip_code, city, state, lat, lon in read_centroids(path)}
+
+@lru_cache(maxsize=None)
+def load_city_centroids(path=ZIP_CENTROIDS_PATH):
+    """Return ({(normalized city, state): (lat, lon)}, {normalized city: [state]}).
+
+    City centroids are the mean of the centroids of the city's zip codes and
+    are used for clinics that were scraped without a zip code. The states of
+    each city name come with the one with the most zip codes first. They're
+    loaded separately from the zip codes, the first time a zip code is missing.
+    """
+
+    # {(normalized city, state): [zip count, latitude sum, longitude sum]}
+    city_sums = defaultdict(lambda: [0, 0.0, 0.0])
+    for zip_code, city, state, lat, lon in read_centroids(path):
+        sums = city_sums[(normalize_city(city), state)]
+        sums[0] += 1
+        sums[1] += lat
+        sums[2] += lon
+
+    cities = {key: (lat / count, lon / count) for key, (count, lat, lon) in city_sums.items()}
+    city_states = defaultdict(list)
+    for (city, state), (count, lat, lon) in sorted(city_sums.items(), key=lambda item: -item[1][0]):
+        city_states[city].append(state)
+    return cities, dict(city_states)
+
+def geocode(zip_code=None, city=None, state=None):
+    """(lat, lon) of a zip code, falling back on the city; (None, None) if unknown.
+
+    Without a state, a city is taken to be the largest one of that name, i.e.
+    Portland, OR rather than Portland, ME.
+    """
+
+    zips = load_zip_centroids()
+    if zip_code and zip_code in zips:
+        return zips[zip_code]
+    if city:
+        cities, city_states = load_city_centroids()
+        city = normalize_city(city)
+        state = state.upper() if state else next(iter(city_states.get(city, ())), None)
+        return cities.get((city, state), (None, None))
+    return None, None
+
+@event.listens_for(Clinic, 'before_insert')
+@event.listens_for(Clinic, 'before_update')
+def _geocode_clinic(mapper, connection, clinic):
+    """Geocode clinics added or moved through the ORM."""
+
+    moved = any(inspect(clinic).attrs[attr].history.has_changes() for attr in ('zip_code', 'city', 'state'))
+    if clinic.latitude is None or moved:
+        clinic.latitude, clinic.longitude = geocode(clinic.zip_code, clinic.city, clinic.state)
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in miles."""
+
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+class SpatialGrid:
+    """Points bucketed into a fixed grid of cell_size x cell_size degree cells.
+
+    A radius query only scans the cells overlapping the radius' bounding box,
+    so its cost depends on how many points are nearby rather than on the total
+    number of points.
+    """
+
+    def __init__(self, cell_size=0.1):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+
+    def __len__(self):
+        return sum(len(points) for points in self.cells.values())
+
+    def cell(self, lat, lon):
+        return (math.floor(lat / self.cell_size), math.floor(lon / self.cell_size))
+
+    def insert(self, key, lat, lon):
+        self.cells[self.cell(lat, lon)].append((lat, lon, key))
+
+    def within(self, lat, lon, radius_miles):
+        """[(distance, key)] of the points within radius_miles, closest first."""
+
+        dlat = radius_miles / MILES_PER_DEGREE_LAT
+        # Longitude degrees shrink towards the poles; clamp so the box stays finite.
+        dlon = radius_miles / (MILES_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+        lat_min, lon_min = self.cell(lat - dlat, lon - dlon)
+        lat_max, lon_max = self.cell(lat + dlat, lon + dlon)
+
+        found = []
+        cells = self.cells
+        for i in range(lat_min, lat_max + 1):
+            for j in range(lon_min, lon_max + 1):
+                for p_lat, p_lon, key in cells.get((i, j), ()):
+                    distance = haversine_miles(lat, lon, p_lat, p_lon)
+                    if distance <= radius_miles:
+                        found.append((distance, key))
+        found.sort()
+        return found
+
+
+class VetSpatialIndex(LazyIndex):
+    """Spatial grid of geocoded clinics for "vets within N miles" searches."""
+
+    tables = frozenset({'vets', 'clinics'})
+
+    def __init__(self, max_age=300, cell_size=0.1):
+        super().__init__(max_age)
+        self.cell_size = cell_size
+        self.grid = SpatialGrid(cell_size)
+        self.clinic_vets = {}
+        # {normalized city: Counter of the states of its clinics}
+        self.city_states = {}
+
+    def build(self):
+        """Load (vet id, clinic id, lat, lon, city, state) rows into a new grid."""
+
+        rows = (db.session.query(Vet.id, Clinic.id, Clinic.latitude, Clinic.longitude, Clinic.city, Clinic.state)
+                .join(Clinic, Clinic.id == Vet.clinic_id)
+                .filter(Vet.active, Clinic.latitude.isnot(None), Clinic.longitude.isnot(None))
+                .order_by(Vet.id)
+                .all())
+
+        grid = SpatialGrid(self.cell_size)
+        clinic_vets = defaultdict(list)
+        city_states = defaultdict(Counter)
+        for vet_id, clinic_id, lat, lon, city, state in rows:
+            if clinic_id not in clinic_vets:
+                grid.insert(clinic_id, lat, lon)
+                if city and state:
+                    city_states[normalize_city(city)][state.upper()] += 1
+            clinic_vets[clinic_id].append(vet_id)
+
+        self.grid, self.clinic_vets, self.city_states = grid, dict(clinic_vets), dict(city_states)
+
+    def vets_within(self, lat, lon, radius_miles):
+        """[(vet id, distance in miles)] of vets within the radius, closest first."""
+
+        self.ensure_built()
+        clinic_vets = self.clinic_vets
+        return [(vet_id, distance)
+                for distance, clinic_id in self.grid.within(lat, lon, radius_miles)
+                for vet_id in clinic_vets.get(clinic_id, ())]
+
+    def vets_near(self, radius_miles, zipcode=None, city=None, state=None):
+        """vets_within around a zip code or city from parse_search_area.
+
+        Without a state, a city is taken to be in the state with the most
+        clinics in a city of that name, or failing that, the largest city of
+        that name.
+        """
+
+        if city and not state:
+            self.ensure_built()
+            states = self.city_states.get(normalize_city(city))
+            state = states.most_common(1)[0][0] if states else None
+        lat, lon = geocode(zipcode, city, state)
+        if lat is None:
+            return []
+        return self.vets_within(lat, lon, radius_miles)
+
+
+spatial_index = VetSpatialIndex()
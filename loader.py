@@ -0,0 +1,451 @@
+"""Loading the scraped clinics and vets, and bulk loading in general.
+
+ingest_scraped() streams the scraped CSVs into empty tables, as seed.py
+does, with COPY on Postgres and chunked executemany elsewhere.
+
+sync_scraped_data() refreshes loaded data without losing users' reviews and
+favorites: it diffs the scraped rows against the database, matching clinics
+on a normalized name/city/zip key and vets on their Fear Free id. Only new
+and changed rows are written, in batched upserts, and clinics and vets
+missing from the scrape are retired rather than deleted.
+"""
+import csv
+import io
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from itertools import islice
+
+from sqlalchemy import bindparam, event, inspect, or_, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.schema import AddConstraint, CreateIndex, DropIndex
+
+from addresses import normalize_clinic, normalize_zip_code
+from models import db, mark_changed, Clinic, Vet
+from search import normalize_city
+from geo import geocode
+from fulltext import rebuild_search_table, search_triggers_disabled
+
+SCRAPED_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scraped_data')
+CLINICS_CSV = os.path.join(SCRAPED_DATA_DIR, 'clinics.csv')
+VETS_CSV = os.path.join(SCRAPED_DATA_DIR, 'vets.csv')
+
+CLINIC_FIELDS = ('name', 'street_address', 'city', 'state', 'zip_code', 'phone', 'website')
+VET_FIELDS = ('name', 'fear_free_id', 'clinic_id')
+
+NON_WORD_PATTERN = re.compile(r"[^a-z0-9]+")
+
+
+##########################################################################
+# Bulk loading
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+def load_columns(table, row):
+    """[(column name, value when missing from a row)] of the columns to load rows like row into.
+
+    Bulk loads skip the Python side defaults of the models, i.e. the zeroed
+    rating aggregates, so they're filled in here. Columns without one are left to
+    the database, i.e. serial ids, unless row has them.
+    """
+
+    return [(column.name, column.default.arg if column.default is not None and column.default.is_scalar else None)
+            for column in db.metadata.tables[table].columns
+            if column.name in row or (column.default is not None and column.default.is_scalar)]
+
+def copy_rows(table, rows, chunk_size):
+    """Stream rows into a Postgres table with COPY, one CSV chunk at a time; return the row count."""
+
+    cursor = db.session.connection().connection.cursor()
+    count = 0
+    for chunk in chunked(rows, chunk_size):
+        if not count:
+            columns = load_columns(table, chunk[0])
+            names = ', '.join(name for name, default in columns)
+            statement = f"COPY {table} ({names}) FROM STDIN WITH (FORMAT csv)"
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows([row.get(name, default) for name, default in columns] for row in chunk)
+        buffer.seek(0)
+        cursor.copy_expert(statement, buffer)
+        count += len(chunk)
+    return count
+
+def insert_rows(table, rows, chunk_size):
+    """Insert rows with one executemany per chunk, for databases without COPY; return the row count.
+
+    Rows go to the driver as tuples, converted by the column types, skipping
+    SQLAlchemy's per-row statement handling.
+    """
+
+    dialect = db.engine.dialect
+    placeholder = '?' if dialect.paramstyle == 'qmark' else '%s'
+    cursor = db.session.connection().connection.cursor()
+    count = 0
+    for chunk in chunked(rows, chunk_size):
+        if not count:
+            columns = load_columns(table, chunk[0])
+            processors = [(i, process) for i, process in
+                          enumerate(db.metadata.tables[table].c[name].type.bind_processor(dialect)
+                                    for name, default in columns) if process]
+            statement = (f"INSERT INTO {table} ({', '.join(name for name, default in columns)}) "
+                         f"VALUES ({', '.join([placeholder] * len(columns))})")
+        values = [[row.get(name, default) for name, default in columns] for row in chunk]
+        for row_values in values:
+            for i, process in processors:
+                if row_values[i] is not None:
+                    row_values[i] = process(row_values[i])
+        cursor.executemany(statement, values)
+        count += len(chunk)
+    return count
+
+def stream_rows(table, rows, chunk_size=10000):
+    """Load rows (dicts, from any iterable) into a table in chunks; return the row count."""
+
+    load_rows = copy_rows if db.engine.dialect.name == 'postgresql' else insert_rows
+    return load_rows(table, rows, chunk_size)
+
+def _foreign_keys(connection, table):
+    """{constrained column names: constraint name} of a table's foreign keys in the database."""
+
+    return {tuple(foreign_key['constrained_columns']): foreign_key['name']
+            for foreign_key in inspect(connection).get_foreign_keys(table)}
+
+@contextmanager
+def indexes_dropped(tables):
+    """Drop the tables' non-unique indexes, and their foreign keys on Postgres, for a bulk load into them.
+
+    They're created again afterwards, in one pass over each table rather than
+    an index update and key lookup per row. Unique indexes stay, to reject
+    duplicates. SQLite can't drop foreign keys, so it still checks them row by row.
+    """
+
+    connection = db.session.connection()
+    indexes = [index for table in tables for index in db.metadata.tables[table].indexes if not index.unique]
+    constraints = ([constraint for table in tables for constraint in db.metadata.tables[table].foreign_key_constraints]
+                   if connection.dialect.name == 'postgresql' else [])
+    for index in indexes:
+        connection.execute(DropIndex(index, if_exists=True))
+    for constraint in constraints:
+        name = _foreign_keys(connection, constraint.table.name).get(tuple(constraint.column_keys))
+        if name:
+            connection.execute(text(f"ALTER TABLE {constraint.table.name} DROP CONSTRAINT {name}"))
+    try:
+        yield
+    except BaseException:
+        db.session.rollback()
+        raise
+    finally:
+        # The load may have committed, or rolled the drops back.
+        connection = db.session.connection()
+        for index in indexes:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+        for constraint in constraints:
+            if tuple(constraint.column_keys) not in _foreign_keys(connection, constraint.table.name):
+                connection.execute(AddConstraint(constraint))
+        db.session.commit()
+
+def reset_sequences(tables):
+    """Move the id sequences past rows loaded with explicit ids (Postgres only)."""
+
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for table in tables:
+        db.session.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                f"coalesce((SELECT max(id) FROM {table}), 0) + 1, false)"))
+    db.session.commit()
+
+def print_report(step, rows, seconds):
+    """report function of the bulk loads, printing the load rate of each table."""
+
+    if rows is None:
+        print(f"{step:<18} {'':>12}   {seconds:>7.1f} s")
+    else:
+        print(f"{step:<18} {rows:>12,} rows {seconds:>7.1f} s   {rows / max(seconds, 1e-6):>10,.0f} rows/s")
+
+##########################################################################
+# Scraped data
+
+def clinic_key(name, city, zip_code):
+    """Key identifying a clinic across scrapes, ignoring case, punctuation and city abbreviations.
+
+    The scraper merges listings of the same clinic on these fields, and
+    near-duplicate names too (see entities.py).
+    """
+
+    name = NON_WORD_PATTERN.sub(' ', (name or '').lower().replace('&', 'and')).strip()
+    return f"{name}|{normalize_city(city)}|{normalize_zip_code(zip_code) or ''}"
+
+@event.listens_for(Clinic, 'before_insert')
+@event.listens_for(Clinic, 'before_update')
+def _set_clinic_key(mapper, connection, clinic):
+    """Key clinics added or renamed through the ORM, so later loads match them."""
+
+    clinic.source_key = clinic_key(clinic.name, clinic.city, clinic.zip_code)
+
+def clean_clinics(rows, rejects=None):
+    """Clinic rows from clinics.csv, normalized one at a time as they're read, with their source_key.
+
+    Blanks become None, and states, zip codes, phone numbers and websites are
+    normalized by addresses.normalize_clinic(). Values it drops are appended
+    to the rejects list, if given, with their clinic's 1-based row number and
+    name.
+    """
+
+    for row_number, row in enumerate(rows, 1):
+        clinic, dropped = normalize_clinic({field: row.get(field) for field in CLINIC_FIELDS})
+        clinic['name'] = (clinic['name'] or '').strip() or None
+        clinic['source_key'] = clinic_key(clinic['name'], clinic['city'], clinic['zip_code'])
+        if rejects is not None:
+            rejects.extend({'row': row_number, 'name': clinic['name'], **reject} for reject in dropped)
+        yield clinic
+
+def read_scraped(clinics_path=CLINICS_CSV, vets_path=VETS_CSV, rejects=None):
+    """(clinics, vets) from the scraped CSVs.
+
+    vets.csv refers to clinics by their 1-based row in clinics.csv; the vets
+    returned refer to them by source_key instead. Clinic values normalizing
+    drops are appended to rejects, if given.
+    """
+
+    with open(clinics_path, newline='') as f:
+        clinics = list(clean_clinics(csv.DictReader(f), rejects))
+    with open(vets_path, newline='') as f:
+        vets = [{'name': row['name'].strip(), 'fear_free_id': int(row['fear_free_id']),
+                 'clinic_key': clinics[int(row['clinic_id']) - 1]['source_key'] if row['clinic_id'] else None}
+                for row in csv.DictReader(f)]
+    return clinics, vets
+
+def stream_clinics(path=CLINICS_CSV, rejects=None):
+    """Clinic rows of clinics.csv as they're read, with their row number as id and geocoded.
+
+    A clinic scraped twice under the same key, written differently, only keys its first row.
+    """
+
+    keys = set()
+    with open(path, newline='') as f:
+        for clinic_id, clinic in enumerate(clean_clinics(csv.DictReader(f), rejects), 1):
+            if clinic['source_key'] in keys:
+                clinic['source_key'] = None
+            else:
+                keys.add(clinic['source_key'])
+            clinic['id'] = clinic_id
+            clinic['latitude'], clinic['longitude'] = geocode(clinic['zip_code'], clinic['city'], clinic['state'])
+            yield clinic
+
+def stream_vets(path=VETS_CSV):
+    """Vet rows of vets.csv as they're read; clinic_id is the clinic's row number in clinics.csv."""
+
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            yield {'name': row['name'].strip(), 'fear_free_id': int(row['fear_free_id']),
+                   'clinic_id': int(row['clinic_id']) if row['clinic_id'] else None}
+
+def load_vets(path=VETS_CSV, chunk_size=10000):
+    """Load vets.csv into the empty vets table; return the row count.
+
+    On Postgres the file is COPY'd as is into a temporary table, without
+    parsing it in Python, and its rows are inserted from there with their
+    names trimmed, as stream_vets() does. Elsewhere stream_vets() rows are
+    inserted a chunk at a time.
+    """
+
+    if db.engine.dialect.name != 'postgresql':
+        return stream_rows('vets', stream_vets(path), chunk_size)
+
+    columns = load_columns('vets', VET_FIELDS)
+    db.session.execute(text("CREATE TEMPORARY TABLE vets_csv (name text, fear_free_id integer, clinic_id integer) "
+                            "ON COMMIT DROP"))
+    with open(path, newline='') as f:
+        header = next(csv.reader([f.readline()]), [])
+        if tuple(header) != VET_FIELDS:
+            raise ValueError(f"{path} has columns {header}, expected {list(VET_FIELDS)}.")
+        db.session.connection().connection.cursor().copy_expert("COPY vets_csv FROM STDIN WITH (FORMAT csv)", f)
+    values = ', '.join('btrim(name)' if name == 'name' else name if name in VET_FIELDS else f':{name}'
+                       for name, default in columns)
+    result = db.session.execute(text(f"INSERT INTO vets ({', '.join(name for name, default in columns)}) "
+                                     f"SELECT {values} FROM vets_csv"),
+                                {name: default for name, default in columns if name not in VET_FIELDS})
+    return result.rowcount
+
+def ingest_scraped(clinics_path=CLINICS_CSV, vets_path=VETS_CSV, chunk_size=10000, report=None, rejects=None):
+    """Stream the scraped CSVs into empty clinics and vets tables.
+
+    Rows go from the files to the database a chunk at a time, so memory stays
+    flat, with the search triggers, indexes and foreign keys off until the
+    end. report(step, rows, seconds) is called as each table and the search
+    table finish. Clinic values normalizing drops are appended to rejects, if
+    given. Use sync_scraped_data() to refresh tables that already have data.
+    """
+
+    if db.session.query(Clinic.id).first() or db.session.query(Vet.id).first():
+        raise ValueError("The clinics and vets tables aren't empty; refresh them with `flask load-scraped` instead.")
+
+    with search_triggers_disabled(), indexes_dropped(['clinics', 'vets']):
+        loads = [('clinics', lambda: stream_rows('clinics', stream_clinics(clinics_path, rejects), chunk_size)),
+                 ('vets', lambda: load_vets(vets_path, chunk_size))]
+        for table, load in loads:
+            start = time.perf_counter()
+            count = load()
+            db.session.commit()
+            if report:
+                report(table, count, time.perf_counter() - start)
+
+    reset_sequences(['clinics', 'vets'])
+    start = time.perf_counter()
+    rebuild_search_table()
+    if report:
+        report('search table', None, time.perf_counter() - start)
+    # COPY bypasses the ORM events that track changes.
+    mark_changed(db.session, {'clinics', 'vets'})
+    db.session.commit()
+
+def upsert(model, rows, key, fields, returning=()):
+    """INSERT ... ON CONFLICT (key) DO UPDATE of rows, setting fields; return the `returning` rows."""
+
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(model).values(rows)
+    statement = statement.on_conflict_do_update(index_elements=[key],
+                                                set_={field: statement.excluded[field] for field in fields})
+    if returning:
+        return db.session.execute(statement.returning(*returning)).all()
+    db.session.execute(statement)
+    return []
+
+def sync_clinics(clinics, stats, batch_size):
+    """Upsert new, changed and returning clinics and retire the ones that are gone; return {source_key: clinic id}
+    of all scraped clinics.
+
+    A clinic whose name or address changed has a new key, so it's inserted
+    and the row under its old key retired; sync_vets() moves its vets over.
+    """
+
+    existing = {row.source_key: row for row in
+                db.session.execute(select(Clinic.id, Clinic.source_key, Clinic.active,
+                                          *[getattr(Clinic, f) for f in CLINIC_FIELDS])
+                                   .where(Clinic.source_key.isnot(None)))}
+    clinic_ids = {key: row.id for key, row in existing.items()}
+
+    # Clinics scraped twice under the same key are written differently; the first one is kept.
+    scraped = {}
+    for clinic in clinics:
+        scraped.setdefault(clinic['source_key'], clinic)
+
+    changed = []
+    for key, clinic in scraped.items():
+        current = existing.get(key)
+        if current is None:
+            stats['clinics_inserted'] += 1
+        elif not current.active:
+            stats['clinics_reactivated'] += 1
+        elif any(getattr(current, field) != clinic[field] for field in CLINIC_FIELDS):
+            stats['clinics_updated'] += 1
+        else:
+            continue
+        latitude, longitude = geocode(clinic['zip_code'], clinic['city'], clinic['state'])
+        changed.append(dict(clinic, latitude=latitude, longitude=longitude, active=True))
+
+    for batch in chunked(changed, batch_size):
+        rows = upsert(Clinic, batch, Clinic.source_key, CLINIC_FIELDS + ('latitude', 'longitude', 'active'),
+                      returning=(Clinic.id, Clinic.source_key))
+        clinic_ids.update({key: clinic_id for clinic_id, key in rows})
+
+    retired = [row.id for key, row in existing.items() if row.active and key not in scraped]
+    stats['clinics_retired'] += len(retired)
+    for batch in chunked(retired, batch_size):
+        db.session.execute(update(Clinic).where(Clinic.id.in_(batch)).values(active=False))
+    return clinic_ids
+
+def sync_vets(vets, clinic_ids, stats, batch_size):
+    """Upsert new, changed and returning vets and retire the ones that are gone."""
+
+    existing = {row.fear_free_id: row for row in
+                db.session.execute(select(Vet.id, Vet.fear_free_id, Vet.name, Vet.clinic_id, Vet.active,
+                                          Vet.review_count, Vet.rating_sum))}
+
+    changed = []
+    # (review count, rating sum) to move between clinics' rollups, for vets that changed clinics.
+    moved = defaultdict(lambda: [0, 0])
+    scraped = {vet['fear_free_id']: vet for vet in vets}
+    for fear_free_id, vet in scraped.items():
+        row = {'name': vet['name'], 'fear_free_id': fear_free_id,
+               'clinic_id': clinic_ids.get(vet['clinic_key']), 'active': True}
+        current = existing.get(fear_free_id)
+        if current is None:
+            stats['vets_inserted'] += 1
+        elif (current.name, current.clinic_id, current.active) != (row['name'], row['clinic_id'], True):
+            stats['vets_updated' if current.active else 'vets_reactivated'] += 1
+            if current.clinic_id != row['clinic_id'] and current.review_count:
+                for clinic_id, sign in ((current.clinic_id, -1), (row['clinic_id'], 1)):
+                    moved[clinic_id][0] += sign * current.review_count
+                    moved[clinic_id][1] += sign * current.rating_sum
+        else:
+            continue
+        changed.append(row)
+
+    for batch in chunked(changed, batch_size):
+        upsert(Vet, batch, Vet.fear_free_id, ('name', 'clinic_id', 'active'))
+
+    retired = [row.id for fear_free_id, row in existing.items() if row.active and fear_free_id not in scraped]
+    stats['vets_retired'] += len(retired)
+    for batch in chunked(retired, batch_size):
+        db.session.execute(update(Vet).where(Vet.id.in_(batch)).values(active=False))
+
+    deltas = [{'clinic': clinic_id, 'count': count, 'total': total}
+              for clinic_id, (count, total) in moved.items() if clinic_id is not None]
+    if deltas:
+        db.session.connection().execute(
+            update(Clinic.__table__).where(Clinic.__table__.c.id == bindparam('clinic'))
+            .values(review_count=Clinic.__table__.c.review_count + bindparam('count'),
+                    rating_sum=Clinic.__table__.c.rating_sum + bindparam('total')),
+            deltas)
+
+def sync_scraped_data(clinics, vets, batch_size=1000):
+    """Bring the clinics and vets in the database in line with scraped ones, writing only the differences.
+
+    Takes rows as returned by read_scraped(). Returns a Counter of clinics
+    and vets inserted, updated, retired and reactivated.
+    """
+
+    stats = Counter()
+    clinic_ids = sync_clinics(clinics, stats, batch_size)
+    sync_vets(vets, clinic_ids, stats, batch_size)
+    db.session.commit()
+    return stats
+
+def backfill_clinics(batch_size=1000):
+    """Key and geocode the clinics of a database from before clinics had a source_key and a location; return
+    how many were filled in.
+
+    A clinic written the same way as one already keyed is left without a key, as in ingest_scraped().
+    """
+
+    keys = set(db.session.execute(select(Clinic.source_key).where(Clinic.source_key.isnot(None))).scalars())
+    rows = []
+    for clinic in db.session.execute(select(Clinic.id, Clinic.name, Clinic.city, Clinic.state, Clinic.zip_code,
+                                            Clinic.source_key)
+                                     .where(or_(Clinic.source_key.is_(None), Clinic.latitude.is_(None)))
+                                     .order_by(Clinic.id)):
+        key = clinic.source_key
+        if key is None:
+            key = clinic_key(clinic.name, clinic.city, clinic.zip_code)
+            if key in keys:
+                key = None
+            else:
+                keys.add(key)
+        latitude, longitude = geocode(clinic.zip_code, clinic.city, clinic.state)
+        rows.append({'clinic': clinic.id, 'key': key, 'lat': latitude, 'lon': longitude})
+
+    table = Clinic.__table__
+    statement = (update(table).where(table.c.id == bindparam('clinic'))
+                 .values(source_key=bindparam('key'), latitude=bindparam('lat'), longitude=bindparam('lon')))
+    for batch in chunked(rows, batch_size):
+        db.session.connection().execute(statement, batch)
+    mark_changed(db.session, {'clinics'})
+    db.session.commit()
+    return len(rows)
@@ -0,0 +1,252 @@
+"""Per-route request metrics, served in the Prometheus text format at /metrics.
+
+Collected per worker process, for every request:
+- request count by endpoint, method and status
+- request latency histogram
+- number and total time of SQL statements (SQLAlchemy engine events)
+- template render time (Flask template signals)
+- response size
+
+plus the state of the database connection pool and any collectors added with
+add_collector(), i.e. the search cache counters.
+Recording a request takes a few dict updates under one lock, cheap enough
+to leave on in production.
+
+Every series is labeled with the pid of the worker that served the scrape,
+so that Prometheus keeps one series per worker instead of seeing counters
+jump between workers' values; sum them without pid to get the app's.
+
+/metrics requires `Authorization: Bearer <METRICS_TOKEN>` when the app sets
+METRICS_TOKEN. Without it, anyone who can reach the app can read it, so
+keep /metrics firewalled off from the internet.
+"""
+import hmac
+import os
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, has_request_context, request, before_render_template, template_rendered, Response
+from sqlalchemy import event
+
+from models import db
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the response size histogram buckets, in bytes.
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Endpoint label of requests that didn't match any route (i.e. 404s).
+UNMATCHED = 'unmatched'
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as Prometheus expects it."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """(le, cumulative count) of every bucket, ending with +Inf."""
+
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield format_value(bound), total
+        yield '+Inf', self.count
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def format_labels(labels):
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels) + '}'
+
+
+class Metrics:
+    """Collects request metrics of a Flask app and renders them for Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.response_size = defaultdict(lambda: Histogram(SIZE_BUCKETS))
+        self.sql_statements = defaultdict(int)
+        self.sql_seconds = defaultdict(float)
+        self.template_seconds = defaultdict(float)
+        self.engine = None
+        self.token = None
+        self.collectors = [self.pool_metrics]
+
+    def init_app(self, app):
+        """Hook into the app's requests, templates and database engine, and add /metrics, behind METRICS_TOKEN
+        if set."""
+
+        self.token = app.config.get('METRICS_TOKEN')
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        before_render_template.connect(self._start_template, app, weak=False)
+        template_rendered.connect(self._end_template, app, weak=False)
+
+        with app.app_context():
+            self.engine = db.engine
+        event.listen(self.engine, 'before_cursor_execute', self._start_statement)
+        event.listen(self.engine, 'after_cursor_execute', self._end_statement)
+        event.listen(self.engine, 'handle_error', self._statement_failed)
+
+        app.add_url_rule('/metrics', 'metrics', self.serve)
+
+    def add_collector(self, collect):
+        """Register a function returning [(name, type, help, value)] to report on every scrape."""
+
+        self.collectors.append(collect)
+
+    ##########################################################################
+    # Hooks
+
+    def _start_request(self):
+        g.metrics = {'start': time.perf_counter(), 'sql_statements': 0, 'sql_seconds': 0.0,
+                     'template_seconds': 0.0, 'template_starts': []}
+
+    def _end_request(self, response):
+        recorded = g.pop('metrics', None)
+        if recorded is None:
+            return response
+
+        elapsed = time.perf_counter() - recorded['start']
+        endpoint = request.endpoint or UNMATCHED
+        size = response.calculate_content_length() or 0
+
+        with self._lock:
+            self.requests[(endpoint, request.method, response.status_code)] += 1
+            self.latency[endpoint].observe(elapsed)
+            self.response_size[endpoint].observe(size)
+            self.sql_statements[endpoint] += recorded['sql_statements']
+            self.sql_seconds[endpoint] += recorded['sql_seconds']
+            self.template_seconds[endpoint] += recorded['template_seconds']
+
+        return response
+
+    def _start_statement(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_statement_starts', []).append(time.perf_counter())
+
+    def _end_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self._record_statement(conn)
+
+    def _statement_failed(self, context):
+        # after_cursor_execute isn't called for a statement that raised; errors before
+        # before_cursor_execute, i.e. on connecting, have no start to clear.
+        conn = context.connection
+        if conn is not None and conn.info.get('metrics_statement_starts'):
+            self._record_statement(conn)
+
+    def _record_statement(self, conn):
+        elapsed = time.perf_counter() - conn.info['metrics_statement_starts'].pop()
+        recorded = g.get('metrics') if has_request_context() else None
+        if recorded is not None:
+            recorded['sql_statements'] += 1
+            recorded['sql_seconds'] += elapsed
+
+    def _start_template(self, sender, template, context, **kwargs):
+        recorded = g.get('metrics')
+        if recorded is not None:
+            recorded['template_starts'].append(time.perf_counter())
+
+    def _end_template(self, sender, template, context, **kwargs):
+        recorded = g.get('metrics')
+        if recorded is not None and recorded['template_starts']:
+            elapsed = time.perf_counter() - recorded['template_starts'].pop()
+            # Only count the outermost template, nested renders are part of its time.
+            if not recorded['template_starts']:
+                recorded['template_seconds'] += elapsed
+
+    ##########################################################################
+    # Exposition
+
+    def pool_metrics(self):
+        """[(name, type, help, value)] of the connection pool, for pools that keep the counts."""
+
+        pool = self.engine.pool if self.engine is not None else None
+        gauges = []
+        for name, method, help_text in [('db_pool_size', 'size', "Configured size of the connection pool."),
+                                        ('db_pool_checked_out', 'checkedout', "Connections in use."),
+                                        ('db_pool_checked_in', 'checkedin', "Idle connections in the pool."),
+                                        ('db_pool_overflow', 'overflow', "Connections open beyond the pool size.")]:
+            if hasattr(pool, method):
+                gauges.append((name, 'gauge', help_text, getattr(pool, method)()))
+        return gauges
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+
+        lines = []
+        pid = ('pid', os.getpid())
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def histogram(name, histograms):
+            for endpoint, hist in sorted(histograms.items()):
+                for le, count in hist.samples():
+                    lines.append(f'{name}_bucket{format_labels([pid, ("endpoint", endpoint), ("le", le)])} {count}')
+                lines.append(f'{name}_sum{format_labels([pid, ("endpoint", endpoint)])} {format_value(hist.sum)}')
+                lines.append(f'{name}_count{format_labels([pid, ("endpoint", endpoint)])} {hist.count}')
+
+        def per_endpoint(name, values):
+            for endpoint, value in sorted(values.items()):
+                lines.append(f'{name}{format_labels([pid, ("endpoint", endpoint)])} {format_value(value)}')
+
+        with self._lock:
+            family('http_requests_total', 'counter', "Requests by endpoint, method and status.")
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                labels = format_labels([pid, ('endpoint', endpoint), ('method', method), ('status', status)])
+                lines.append(f'http_requests_total{labels} {count}')
+
+            family('http_request_duration_seconds', 'histogram', "Request latency.")
+            histogram('http_request_duration_seconds', self.latency)
+
+            family('http_response_size_bytes', 'histogram', "Response body size.")
+            histogram('http_response_size_bytes', self.response_size)
+
+            family('db_statements_total', 'counter', "SQL statements run by requests.")
+            per_endpoint('db_statements_total', self.sql_statements)
+
+            family('db_statement_seconds_total', 'counter', "Time spent in SQL statements by requests.")
+            per_endpoint('db_statement_seconds_total', self.sql_seconds)
+
+            family('template_render_seconds_total', 'counter', "Time spent rendering templates.")
+            per_endpoint('template_render_seconds_total', self.template_seconds)
+
+        for collect in self.collectors:
+            for name, kind, help_text, value in collect():
+                family(name, kind, help_text)
+                lines.append(f'{name}{format_labels([pid])} {format_value(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+    def serve(self):
+        """View function of /metrics."""
+
+        if self.token and not hmac.compare_digest(request.headers.get('Authorization', '').encode(),
+                                                  f'Bearer {self.token}'.encode()):
+            return Response("Unauthorized\n", 401, {'WWW-Authenticate': 'Bearer'}, mimetype='text/plain')
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
@@ -1,19 +1,44 @@
 """Models for Fear Free Vets."""
+import sqlite3
+import threading
 from datetime import datetime
-from statistics import mean
+from decimal import Decimal
+from itertools import chain
 
+from blinker import signal
 from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
+from sqlalchemy import event, case, delete, func, inspect, literal, literal_column, select, text, true, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn, CreateIndex
+
+from passwords import password_hasher
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
+# Sent after a commit that wrote to any of the WATCHED_TABLES, with the set of
+# changed table names as `tables`. In-memory search structures listen to it.
+data_changed = signal('data-changed')
+
+WATCHED_TABLES = frozenset({'clinics', 'vets', 'reviews'})
+
+# Review ratings are counted in the histogram under their rounded star value.
+STARS = (1, 2, 3, 4, 5)
+
 
 def connect_db(app):
     """Connect this database to Flask app."""
     db.app = app
     db.init_app(app)
 
+@event.listens_for(Engine, 'connect')
+def _enforce_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """Have SQLite check foreign keys, as Postgres does, i.e. that a favorite's vet exists."""
+
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute('PRAGMA foreign_keys = ON')
+
 
 class Clinic(db.Model):
     """Table for veterinarian clinics."""
@@ -23,12 +48,28 @@ class Clinic(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     street_address = db.Column(db.String)
-    city = db.Column(db.String, nullable=False)
+    city = db.Column(db.String, nullable=False, index=True)
     state = db.Column(db.String, nullable=False)
-    zip_code = db.Column(db.String)
+    zip_code = db.Column(db.String, index=True)
     phone = db.Column(db.String)
     website = db.Column(db.String)
 
+    # Rollups of the rating aggregates of the clinic's vets, see Vet.
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Numeric(precision=12, scale=1), nullable=False, default=0)
+
+    # Geocoded from the zip code (or city) when the clinic is loaded, see geo.py.
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+
+    # Normalized name, city and zip code matching the clinic to the scraped data, see loader.py.
+    source_key = db.Column(db.String, unique=True)
+
+    # Clinics that dropped out of the scraped directory are retired, like
+    # vets. Their vets have been moved to the clinics they're listed at now,
+    # and searches only reach clinics through active vets.
+    active = db.Column(db.Boolean, nullable=False, default=True, server_default=true())
+
     vets = db.relationship('Vet', backref='clinic')
 
     def __repr__(self):
@@ -40,19 +81,51 @@ class Clinic(db.Model):
         location = f"{self.street_address}, {self.city}, {self.state} {self.zip_code}"
         return location.strip("None, ")
 
+    @property
+    def average_rating(self):
+        """Get the average rating of all reviews of the vets of this clinic."""
+
+        return round(self.rating_sum / self.review_count, 1) if self.review_count else 0
+
+    def serialize(self):
+        """Returns a dict representation of the clinic object."""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'location': self.location,
+            'phone': self.phone,
+            'website': self.website
+        }
+
 
 class Vet(db.Model):
     """Table for veterinarians."""
 
     __tablename__ = "vets"
+    # Pages of vets sorted by name are a range scan of this index; see also ix_vets_rating_id.
+    __table_args__ = (db.Index('ix_vets_name_id', 'name', 'id'),)
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
-    clinic_id = db.Column(db.Integer, db.ForeignKey('clinics.id', ondelete='CASCADE'))
+    clinic_id = db.Column(db.Integer, db.ForeignKey('clinics.id', ondelete='CASCADE'), index=True)
 
     # id on ff website, used to ensure I don't add the same vet more than once
     fear_free_id = db.Column(db.Integer, nullable=False, unique=True)
 
+    # Vets that dropped out of the scraped directory are retired instead of
+    # deleted, keeping their reviews and favorites. Searches skip them.
+    active = db.Column(db.Boolean, nullable=False, default=True, server_default=true())
+
+    # Rating aggregates, kept up to date as reviews are written so showing a
+    # vet's rating never needs its reviews. See recompute_rating_aggregates.
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Numeric(precision=10, scale=1), nullable=False, default=0)
+    rating_1_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_2_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_3_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_4_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_5_count = db.Column(db.Integer, nullable=False, default=0)
+
     reviews = db.relationship('Review', back_populates='vet')
 
     def __repr__(self):
@@ -63,8 +136,29 @@ class Vet(db.Model):
     def average_rating(self):
         """Get the average rating of this vet."""
 
-        ratings = [r.rating for r in self.reviews]
-        return round(mean(ratings), 1) if len(ratings) > 0 else 0
+        return round(self.rating_sum / self.review_count, 1) if self.review_count else 0
+
+    @property
+    def rating_histogram(self):
+        """Number of reviews of this vet per star, i.e. {1: 0, 2: 1, 3: 0, 4: 2, 5: 7}."""
+
+        return {stars: getattr(self, f'rating_{stars}_count') for stars in STARS}
+
+    def serialize(self):
+        """Returns a dict representation of the vet object."""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'clinic_id': self.clinic_id,
+            'fear_free_id': self.fear_free_id
+        }
+
+# Vet.average_rating in SQL, from the stored aggregates. The constants are inlined so that queries
+# use the same expression as the index, and pages of vets sorted by rating are a range scan of it.
+vet_rating = func.coalesce(func.round(Vet.rating_sum / func.nullif(Vet.review_count, literal_column('0')),
+                                      literal_column('1')),
+                           literal_column('0'))
+db.Index('ix_vets_rating_id', vet_rating.desc(), Vet.id)
 
 
 class User(db.Model):
@@ -79,6 +173,9 @@ class User(db.Model):
     email = db.Column(db.String, nullable=False, unique=True)
     password = db.Column(db.String, nullable=False)
 
+    # Bumped whenever one of the user's favorites is added or removed, for the favorites API's ETag.
+    favorites_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     favorites = db.relationship('Vet', secondary="favorites")
 
     reviews = db.relationship('Review', back_populates='user')
@@ -99,7 +196,7 @@ class User(db.Model):
         Hashes password and adds user to database.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = password_hasher.hash(password)
 
         user = User(first_name=first_name, last_name=last_name, username=username, email=email, 
                     password=hashed_pwd)
@@ -116,12 +213,18 @@ class User(db.Model):
         if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        A hash made at another cost than the configured one is replaced, to be
+        saved with the session's next commit. Raises PasswordHasherBusy when
+        too many passwords are being checked already.
         """
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = password_hasher.check(user.password, password)
             if is_auth:
+                if password_hasher.needs_rehash(user.password):
+                    user.password = password_hasher.hash(password)
                 return user
         
         return False
@@ -131,6 +234,9 @@ class Favorite(db.Model):
     """Table for users' favorite vets."""
 
     __tablename__ = "favorites"
+    # A user's favorite vet ids, or whether some vets are among them, straight from the index;
+    # unique so that adding a favorite twice, i.e. on a double click, is a no-op.
+    __table_args__ = (db.Index('ix_favorites_user_id_vet_id', 'user_id', 'vet_id', unique=True),)
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='cascade'))
@@ -148,6 +254,40 @@ class Favorite(db.Model):
             "vet_id": self.vet_id
         }
 
+    @classmethod
+    def vet_ids_of(cls, user_id, vet_ids=None):
+        """The user's favorite vet ids, in the order they were added; only the ones among vet_ids if given."""
+
+        if vet_ids is not None and not vet_ids:
+            return []
+        query = db.session.query(cls.vet_id).filter(cls.user_id == user_id)
+        if vet_ids is not None:
+            query = query.filter(cls.vet_id.in_(vet_ids))
+        return [vet_id for vet_id, in query.order_by(cls.id)]
+
+    @classmethod
+    def change(cls, user_id, add=(), remove=()):
+        """Make the vets in add favorites of the user, and the ones in remove not; return (added, removed) vet ids.
+
+        Adding and removing are a single statement each, which leaves alone the
+        vets already in that state, so it's safe to repeat and to run
+        concurrently; the favorites_version triggers bump the user's version in
+        the same statement, only if something changed. Adding a vet that
+        doesn't exist raises IntegrityError. Saved with the session's next
+        commit.
+        """
+
+        added = removed = []
+        if add:
+            dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+            statement = (dialect.insert(cls).values([{'user_id': user_id, 'vet_id': vet_id} for vet_id in set(add)])
+                         .on_conflict_do_nothing(index_elements=['user_id', 'vet_id']))
+            added = db.session.execute(statement.returning(cls.vet_id)).scalars().all()
+        if remove:
+            statement = delete(cls).where(cls.user_id == user_id, cls.vet_id.in_(remove))
+            removed = db.session.execute(statement.returning(cls.vet_id)).scalars().all()
+        return added, removed
+
 
 class Review(db.Model):
     """Table for users' reviews."""
@@ -156,9 +296,11 @@ class Review(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='cascade'))
-    vet_id = db.Column(db.Integer, db.ForeignKey('vets.id', ondelete='cascade'))
+    # active_history keeps the old values around on change, for the rating aggregates of the vet.
+    vet_id = db.column_property(db.Column(db.Integer, db.ForeignKey('vets.id', ondelete='cascade')),
+                                active_history=True)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.now())
-    rating = db.Column(db.Numeric(precision=2, scale=1), nullable=False)
+    rating = db.column_property(db.Column(db.Numeric(precision=2, scale=1), nullable=False), active_history=True)
     comment = db.Column(db.Text)
 
     user = db.relationship('User', back_populates='reviews')
@@ -178,3 +320,285 @@ class Review(db.Model):
             'rating': self.rating,
             'comment': self.comment
         }
+
+
+class DataVersion(db.Model):
+    """Single row counting the commits that changed any of the WATCHED_TABLES, so every process can tell when
+    what it cached from them is stale."""
+
+    __tablename__ = "data_versions"
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+@event.listens_for(DataVersion.__table__, 'after_create')
+def _insert_data_version(target, connection, **kw):
+    connection.execute(target.insert().values(id=1, version=0))
+
+
+##########################################################################
+# Rating aggregates
+
+def star_bucket(rating):
+    """Star of the histogram a rating is counted under: the nearest one, halves rounded up."""
+
+    for stars in STARS[:-1]:
+        if rating < stars + Decimal('0.5'):
+            return stars
+    return STARS[-1]
+
+def star_bucket_sql(rating):
+    """star_bucket as a SQL expression."""
+
+    return case(*[(rating < stars + 0.5, stars) for stars in STARS[:-1]], else_=STARS[-1])
+
+def _rating_deltas(rating, sign):
+    """Column increments for adding (sign=1) or removing (sign=-1) a review's rating."""
+
+    deltas = {'review_count': Vet.review_count + sign, 'rating_sum': Vet.rating_sum + sign * rating}
+    column = f'rating_{star_bucket(rating)}_count'
+    deltas[column] = getattr(Vet, column) + sign
+    return deltas
+
+def _apply_rating(connection, vet_id, rating, sign):
+    """Add or remove one rating to the aggregates of a vet and of its clinic."""
+
+    if vet_id is None or rating is None:
+        return
+    rating = Decimal(str(rating))
+    connection.execute(update(Vet).where(Vet.id == vet_id).values(_rating_deltas(rating, sign)))
+    clinic_id = select(Vet.clinic_id).where(Vet.id == vet_id).scalar_subquery()
+    connection.execute(update(Clinic).where(Clinic.id == clinic_id)
+                       .values(review_count=Clinic.review_count + sign,
+                               rating_sum=Clinic.rating_sum + sign * rating))
+
+@event.listens_for(Review, 'after_insert')
+def _review_inserted(mapper, connection, review):
+    _apply_rating(connection, review.vet_id, review.rating, 1)
+
+@event.listens_for(Review, 'after_delete')
+def _review_deleted(mapper, connection, review):
+    _apply_rating(connection, review.vet_id, review.rating, -1)
+
+@event.listens_for(Review, 'after_update')
+def _review_updated(mapper, connection, review):
+    attrs = inspect(review).attrs
+    if not (attrs.rating.history.has_changes() or attrs.vet_id.history.has_changes()):
+        return
+    old_rating = (attrs.rating.history.deleted or [review.rating])[0]
+    old_vet_id = (attrs.vet_id.history.deleted or [review.vet_id])[0]
+    _apply_rating(connection, old_vet_id, old_rating, -1)
+    _apply_rating(connection, review.vet_id, review.rating, 1)
+
+def recompute_rating_aggregates():
+    """Recompute the rating aggregates of every vet and clinic from the reviews.
+
+    The aggregates are maintained as reviews are written through the ORM;
+    run this after bulk loads that bypass it, or to repair drift.
+    """
+
+    bucket = star_bucket_sql(Review.rating)
+    per_vet = (select(Review.vet_id.label('vet_id'),
+                      func.count(Review.id).label('review_count'),
+                      func.sum(Review.rating).label('rating_sum'),
+                      *[func.sum(case((bucket == stars, 1), else_=0)).label(f'rating_{stars}_count')
+                        for stars in STARS])
+               .group_by(Review.vet_id)
+               .subquery())
+    per_clinic = (select(Vet.clinic_id.label('clinic_id'),
+                         func.sum(Vet.review_count).label('review_count'),
+                         func.sum(Vet.rating_sum).label('rating_sum'))
+                  .group_by(Vet.clinic_id)
+                  .subquery())
+
+    zeros = {'review_count': 0, 'rating_sum': 0}
+    db.session.execute(update(Vet).values(**zeros, **{f'rating_{stars}_count': 0 for stars in STARS}))
+    db.session.execute(update(Vet).where(Vet.id == per_vet.c.vet_id)
+                       .values({column: per_vet.c[column] for column in per_vet.c.keys() if column != 'vet_id'}))
+    db.session.execute(update(Clinic).values(**zeros))
+    db.session.execute(update(Clinic).where(Clinic.id == per_clinic.c.clinic_id)
+                       .values(review_count=per_clinic.c.review_count, rating_sum=per_clinic.c.rating_sum))
+    db.session.commit()
+
+
+##########################################################################
+# Favorites versions
+#
+# Triggers bump users' favorites_version in the statement that adds or
+# removes their favorites, however it's written: through the ORM,
+# Favorite.change, a cascade or a bulk load. Postgres runs them once per
+# statement, with the changed rows as a transition table.
+
+POSTGRES_FAVORITES_VERSION_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION bump_favorites_version() RETURNS trigger AS $$
+    BEGIN
+        UPDATE users SET favorites_version = favorites_version + 1
+        WHERE id IN (SELECT DISTINCT user_id FROM changed);
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS favorites_version_insert ON favorites",
+    """
+    CREATE TRIGGER favorites_version_insert AFTER INSERT ON favorites
+    REFERENCING NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION bump_favorites_version()
+    """,
+    "DROP TRIGGER IF EXISTS favorites_version_delete ON favorites",
+    """
+    CREATE TRIGGER favorites_version_delete AFTER DELETE ON favorites
+    REFERENCING OLD TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION bump_favorites_version()
+    """,
+]
+
+SQLITE_FAVORITES_VERSION_DDL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS favorites_version_insert AFTER INSERT ON favorites BEGIN
+        UPDATE users SET favorites_version = favorites_version + 1 WHERE id = new.user_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS favorites_version_delete AFTER DELETE ON favorites BEGIN
+        UPDATE users SET favorites_version = favorites_version + 1 WHERE id = old.user_id;
+    END
+    """,
+]
+
+@event.listens_for(Favorite.__table__, 'after_create')
+def _create_favorites_version_triggers(target, connection, **kw):
+    """Dropped with the table."""
+
+    if connection.dialect.name == 'postgresql':
+        statements = POSTGRES_FAVORITES_VERSION_DDL
+    elif connection.dialect.name == 'sqlite':
+        statements = SQLITE_FAVORITES_VERSION_DDL
+    else:
+        return
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+##########################################################################
+# Change tracking for data_changed
+#
+# A process sends data_changed for the commits it makes. Those commits also
+# bump DataVersion, which data_version_watch.check() compares, so that other
+# processes send it too.
+
+class DataVersionWatch:
+    """The DataVersion this process last saw."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+
+    def check(self):
+        """Send data_changed for every watched table if another process changed them since the last check."""
+
+        version = db.session.execute(select(DataVersion.version)).scalar()
+        with self._lock:
+            seen, self.version = self.version, version
+        if seen is not None and version != seen:
+            data_changed.send(self, tables=WATCHED_TABLES)
+
+    def committed(self, version):
+        """Note the version a commit of this process bumped to, which it sent data_changed for itself."""
+
+        with self._lock:
+            if self.version == version - 1:
+                self.version = version
+
+data_version_watch = DataVersionWatch()
+
+def mark_changed(session, tables):
+    """Record writes to tables the ORM events don't see, i.e. by COPY, for the session's next commit."""
+
+    session.info.setdefault('changed_tables', set()).update(set(tables) & WATCHED_TABLES)
+
+@event.listens_for(Session, 'after_flush')
+def _collect_flushed_tables(session, flush_context):
+    """Remember which watched tables the ORM wrote to in this transaction."""
+
+    tables = {getattr(obj, '__tablename__', None)
+              for obj in chain(session.new, session.dirty, session.deleted)}
+    session.info.setdefault('changed_tables', set()).update(tables & WATCHED_TABLES)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_tables(orm_execute_state):
+    """Catch bulk insert/update/delete statements, e.g. the ones in seed.py."""
+
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None and table.name in WATCHED_TABLES:
+            orm_execute_state.session.info.setdefault('changed_tables', set()).add(table.name)
+
+@event.listens_for(Session, 'before_commit')
+def _bump_data_version(session):
+    """Bump DataVersion in the transaction that changes the watched tables."""
+
+    session.flush()
+    if session.info.get('changed_tables'):
+        session.info['data_version'] = session.execute(
+            update(DataVersion).values(version=DataVersion.version + 1).returning(DataVersion.version)).scalar()
+
+@event.listens_for(Session, 'after_commit')
+def _send_data_changed(session):
+    tables = session.info.pop('changed_tables', None)
+    version = session.info.pop('data_version', None)
+    if version is not None:
+        data_version_watch.committed(version)
+    if tables:
+        data_changed.send(session, tables=frozenset(tables))
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_tables(session):
+    session.info.pop('changed_tables', None)
+    session.info.pop('data_version', None)
+
+
+##########################################################################
+# Schema upgrades
+
+def _added_column_ddl(column, dialect):
+    """Column definition for ALTER TABLE ... ADD COLUMN, with the Python side default as the server default so
+    that NOT NULL columns can be added to tables with rows."""
+
+    ddl = str(CreateColumn(column).compile(dialect=dialect))
+    if column.server_default is None and column.default is not None and column.default.is_scalar:
+        default = literal(column.default.arg, column.type).compile(dialect=dialect,
+                                                                   compile_kwargs={'literal_binds': True})
+        ddl += f" DEFAULT {default}"
+    return ddl
+
+def upgrade_schema():
+    """Add the tables, columns, indexes and triggers of the models that a database made by an earlier version of
+    them lacks; return the names of the columns added.
+
+    Nothing is dropped or changed. Added columns hold their defaults, so the
+    rating aggregates, clinic keys and locations and the search table need to
+    be filled in afterwards; `flask upgrade-db` does all of it.
+    """
+
+    inspector = inspect(db.engine)
+    added = []
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN "
+                                        f"{_added_column_ddl(column, connection.dialect)}"))
+                if column.unique:
+                    connection.execute(text(f"CREATE UNIQUE INDEX uq_{table.name}_{column.name} "
+                                            f"ON {table.name} ({column.name})"))
+                added.append(f"{table.name}.{column.name}")
+            # Not checked by reflecting them first, which skips expression indexes.
+            for index in table.indexes:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+        if inspector.has_table(Favorite.__tablename__):
+            # Created along with the table, which predates them.
+            _create_favorites_version_triggers(Favorite.__table__, connection)
+    db.create_all()
+    return added
@@ -0,0 +1,116 @@
+"""Content-addressed on-disk cache of crawled pages.
+
+Bodies are stored once per SHA-256 digest under bodies/, and index.json maps
+each URL to the digest of its last fetched body and the ETag/Last-Modified
+validators it came with, for conditional re-fetches. Whatever a scraper
+parsed out of a body can be kept under parsed/, by the kind of records it
+parsed, so a page whose body didn't change isn't parsed again.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from email.utils import formatdate
+
+
+def digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class PageCache:
+    """Pages crawled from each URL, kept in directory across runs.
+
+    The index is read when the cache is opened and written by save(); bodies
+    and parsed records are written as they come in. Safe to use from the
+    crawler's threads.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.bodies_dir = os.path.join(directory, 'bodies')
+        self.parsed_dir = os.path.join(directory, 'parsed')
+        self.index_path = os.path.join(directory, 'index.json')
+        os.makedirs(self.bodies_dir, exist_ok=True)
+        os.makedirs(self.parsed_dir, exist_ok=True)
+        try:
+            with open(self.index_path) as f:
+                self._index = json.load(f)
+        except FileNotFoundError:
+            self._index = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._index)
+
+    def _write(self, path, data, mode='wb'):
+        """Write a file atomically, so a crashed run can't leave half of one behind."""
+
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, mode) as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def body_path(self, body_digest):
+        return os.path.join(self.bodies_dir, f'{body_digest}.html')
+
+    def lookup(self, url):
+        """The cache entry of url, {'digest', 'etag', 'last_modified', 'fetched_at'}; None when its body is missing."""
+
+        with self._lock:
+            entry = self._index.get(url)
+        if entry is None or not os.path.exists(self.body_path(entry['digest'])):
+            return None
+        return entry
+
+    def read(self, entry):
+        with open(self.body_path(entry['digest']), 'rb') as f:
+            return f.read()
+
+    def validators(self, url):
+        """Headers making a GET of url conditional on its cached copy being stale."""
+
+        entry = self.lookup(url)
+        if entry is None:
+            return {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, content, headers):
+        """Keep a fetched body of url and its validators; return (digest, whether the body changed)."""
+
+        body_digest = digest(content)
+        if not os.path.exists(self.body_path(body_digest)):
+            self._write(self.body_path(body_digest), content)
+        with self._lock:
+            previous = self._index.get(url)
+            self._index[url] = {'digest': body_digest, 'etag': headers.get('ETag'),
+                                'last_modified': headers.get('Last-Modified'),
+                                'fetched_at': formatdate(time.time(), usegmt=True)}
+        return body_digest, previous is None or previous['digest'] != body_digest
+
+    def parsed_path(self, body_digest, kind):
+        return os.path.join(self.parsed_dir, f'{body_digest}.{kind}.json')
+
+    def parsed(self, body_digest, kind):
+        """The records of a kind parsed out of the body with this digest, or None."""
+
+        try:
+            with open(self.parsed_path(body_digest, kind)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def store_parsed(self, body_digest, kind, records):
+        self._write(self.parsed_path(body_digest, kind), json.dumps(records), 'w')
+
+    def save(self):
+        """Write the index, i.e. at the end of a crawl."""
+
+        with self._lock:
+            data = json.dumps(self._index, indent=1, sort_keys=True)
+        self._write(self.index_path, data, 'w')
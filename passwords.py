@@ -0,0 +1,143 @@
+"""bcrypt password hashing, off the request workers.
+
+Hashing a password at the default cost takes a few hundred milliseconds of
+CPU, so a burst of logins could keep every worker busy. PasswordHasher runs
+the hashes in a small pool of processes instead: at most `workers` of them
+are computed at once per web worker, at most `max_pending` wait for the
+pool, and the rest fail right away with PasswordHasherBusy rather than
+queueing up. With workers=0 it hashes inline, i.e. for scripts.
+
+The cost of new hashes (bcrypt's log rounds) is configurable, and
+needs_rehash() tells when a stored hash has another one, so it can be
+replaced at the next login.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import bcrypt
+
+DEFAULT_ROUNDS = 12
+
+
+class PasswordHasherBusy(Exception):
+    """Raised instead of waiting when max_pending passwords are already waiting to be hashed."""
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _check(pw_hash, password):
+    return bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+
+def hash_rounds(pw_hash):
+    """The cost (log rounds) of a bcrypt hash, i.e. 12 for '$2b$12$...'; None when it isn't one."""
+
+    try:
+        return int(pw_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """Hashes and checks passwords with bcrypt in a pool of processes, failing fast when it's saturated.
+
+    The pool is started on first use, so each web worker process gets its
+    own after the server forks it.
+    """
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=2, max_pending=8, timeout=10):
+        self.configure(rounds, workers, max_pending, timeout)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.hashed = 0
+        self.checked = 0
+        self.rejected = 0
+
+    def configure(self, rounds=DEFAULT_ROUNDS, workers=2, max_pending=8, timeout=10):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        # Hashes being computed or waiting for the pool.
+        self._slots = threading.BoundedSemaphore(workers + max_pending) if workers else None
+
+    def init_app(self, app):
+        """Configure from BCRYPT_LOG_ROUNDS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING and
+        PASSWORD_HASH_TIMEOUT."""
+
+        self.shutdown()
+        self.configure(rounds=app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS),
+                       workers=app.config.get('PASSWORD_HASH_WORKERS', 2),
+                       max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING', 8),
+                       timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 10))
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # Not forked: the web worker may have threads, and the pool only needs bcrypt.
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHasherBusy(f"{self.workers + self.max_pending} passwords are already being hashed")
+        try:
+            future = self._pool().submit(function, *args)
+        except BaseException:
+            slots.release()
+            raise
+        # The slot is freed when the hash is done or cancelled, not when a request gives up waiting
+        # for it, so max_pending bounds the work actually queued in the pool.
+        future.add_done_callback(lambda future: slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHasherBusy(f"Hashing a password took over {self.timeout} s")
+
+    def hash(self, password):
+        """bcrypt hash of password, at the configured cost."""
+
+        if not password:
+            raise ValueError('Password must be non-empty.')
+        pw_hash = self._run(_hash, password, self.rounds)
+        with self._lock:
+            self.hashed += 1
+        return pw_hash
+
+    def check(self, pw_hash, password):
+        """Whether password is the one pw_hash was made from."""
+
+        if not password or hash_rounds(pw_hash) is None:
+            return False
+        matches = self._run(_check, pw_hash, password)
+        with self._lock:
+            self.checked += 1
+        return matches
+
+    def needs_rehash(self, pw_hash):
+        """Whether pw_hash was made at another cost than the configured one."""
+
+        return hash_rounds(pw_hash) != self.rounds
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'max_pending': self.max_pending, 'rounds': self.rounds,
+                    'hashed': self.hashed, 'checked': self.checked, 'rejected': self.rejected}
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,107 @@
+"""Per-worker cache of the logged-in users' principals, so most requests don't load their user."""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import event
+
+from models import db, User
+
+# What most pages need to know about the logged-in user.
+Principal = namedtuple('Principal', 'id username full_name')
+
+
+class PrincipalCache:
+    """Size-bounded LRU cache of Principals by user id, with a short TTL.
+
+    Entries are dropped as soon as their user is updated or deleted through
+    the ORM in this worker, and all of them when the users table is dropped;
+    the TTL bounds how long other workers show the old ones.
+    """
+
+    def __init__(self, max_size=10000, ttl=60, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id):
+        """The Principal of the user with user_id, loading the user on a miss; None if there's no such user."""
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > self.clock():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        principal = Principal(user.id, user.username, user.full_name)
+        with self._lock:
+            self._entries[user_id] = (self.clock() + self.ttl, principal)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return principal
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+class CurrentUser:
+    """The logged-in user of a request, as g.user.
+
+    Its id, username and full name come from its Principal; any other
+    attribute loads the User row, once per request.
+    """
+
+    def __init__(self, principal):
+        self.id = principal.id
+        self.username = principal.username
+        self.full_name = principal.full_name
+        self._user = None
+
+    def __repr__(self):
+        return f'<CurrentUser #{self.id}: {self.username}>'
+
+    @property
+    def user(self):
+        if self._user is None:
+            self._user = User.query.get_or_404(self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        return getattr(self.user, name)
+
+
+principal_cache = PrincipalCache()
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _discard_principal(mapper, connection, user):
+    principal_cache.discard(user.id)
+
+@event.listens_for(User.__table__, 'after_drop')
+def _clear_principals(target, connection, **kwargs):
+    """Reloading all the data, as seed.py does, reuses the user ids."""
+
+    principal_cache.clear()
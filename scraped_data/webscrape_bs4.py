@@ -1,133 +1,199 @@
-import requests
-from bs4 import BeautifulSoup
-import re
+"""Scrape the Fear Free vets within 100 miles of 95110 into clinics.csv and vets.csv.
+
+Run from the project root, so crawler.py can be imported:
+    python -m scraped_data.webscrape_bs4 [--replay | --no-cache]
+
+Vet records are written to scraped_data/records.ndjson a page at a time, and
+an interrupted crawl resumes after its last completed page when run again.
+Fetched pages are kept in scraped_data/page_cache. Later runs only download
+the pages that changed, and only parse bodies they haven't parsed before;
+--replay parses the cached pages without going online.
+"""
+import argparse
+import csv
+import json
+import os
+
 import pandas as pd
 
+from addresses import REJECT_FIELDS, clinic_records, normalize_clinics
+from crawler import Crawler
+from directory_parser import BACKENDS, parse_cards
+from entities import ListingResolver
+from page_cache import PageCache
 
-HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'}
+SCRAPED_DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+PAGE_CACHE_DIR = os.path.join(SCRAPED_DATA_DIR, 'page_cache')
+# Every scraped vet record, one JSON object per line, written as pages are crawled.
+RECORDS_FILE = 'records.ndjson'
+# Values the scraped records had that weren't what they should be, i.e. unparseable addresses.
+REJECTS_FILE = 'rejects.csv'
+DIRECTORY_URL = "https://fearfreepets.com/fear-free-directory"
+QUERY = "address=95110&category=0&center=37.354611%2C-121.918866&zoom=12&is_mile=1&directory_radius=100&view=grid&filter=1&field_role=Veterinarian"
 
 
-def get_zip_code(address):
-    zipcode_pattern = r"\b\d{5}\b"
-    match = re.search(zipcode_pattern, address)
-    if match:
-        return match.group().strip()
-    return None
+def page_url(num_page, base_url=DIRECTORY_URL):
+    return f"{base_url}?p={num_page}&{QUERY}"
 
-def get_street_info(address):
-    pattern = r"(\d+\s+[a-zA-z\s]+\s*),\s*\w+\s*\w*\s*,*\s*([A-Z]{2})\s*"
-    match = re.search(pattern, address)
-    if match:
-        return match.group(1).strip()
-    return None
+def normalize_cards(cards):
+    """Normalized records of a page's card records, their addresses split into their parts.
 
-def get_city(address):
-    pattern = r",*\s*(\w+\s*\w*)\s*,*\s*([A-Z]{2})\s*"
-    match = re.search(pattern, address)
-    if match:
-        return match.group(1).strip().lower().title()
-    return None
+    Each record lists the values normalizing had to drop under 'rejects'.
+    """
 
-def get_state(address):
-    pattern = r",*\s*([A-Z]{2})\s*"
-    match = re.search(pattern, address)
-    if match:
-        return match.group(1).strip().upper()
-    return None
+    if not cards:
+        return []
+    frame, rejects = normalize_clinics(pd.DataFrame(cards))
+    records = clinic_records(frame)
+    for record in records:
+        record['rejects'] = []
+    for reject in rejects.to_dict('records'):
+        records[reject['row']]['rejects'].append({'field': reject['field'], 'value': reject['value'],
+                                                  'reason': reject['reason']})
+    return records
+
+def parse_page(page, cache=None, backend=None):
+    """Card records of a crawled page, reusing what was parsed out of the same body before."""
+
+    if cache is not None:
+        cards = cache.parsed(page.digest, 'cards')
+        if cards is not None:
+            return cards
+    cards = parse_cards(page.content, backend)
+    if cache is not None:
+        cache.store_parsed(page.digest, 'cards', cards)
+    return cards
+
+def page_records(pages, cache=None, backend=None):
+    """(page, normalized records) of each crawled page."""
+
+    for page in pages:
+        yield page, normalize_cards(parse_page(page, cache, backend))
+
+
+class Checkpoint:
+    """How far a crawl got: its number of completed pages, and the size of its records file then.
+
+    Kept in a small JSON file, replaced atomically after each page, so an
+    interrupted crawl resumes after its last completed page.
+    """
 
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {'pages': 0, 'records_size': 0}
+        self.pages = state['pages']
+        self.records_size = state['records_size']
+
+    def save(self, pages, records_size):
+        self.pages, self.records_size = pages, records_size
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump({'pages': pages, 'records_size': records_size}, f)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def scrape_records(crawler, tot_pages, records_path, base_url=DIRECTORY_URL, backend=None, save_cache_every=50):
+    """Crawl pages into an NDJSON file of normalized vet records, one page at a time.
+
+    Resumes from the checkpoint next to records_path if there is one: records
+    written after it are dropped, and crawling starts after its last page.
+    The checkpoint is removed once every page is done. Return the number of
+    pages crawled by this run.
+    """
 
-def get_page_data(num_page=1, headers=HEADERS):
+    checkpoint = Checkpoint(f'{records_path}.checkpoint')
+    if checkpoint.pages:
+        print(f'Resuming after page {checkpoint.pages}')
+    urls = (page_url(i+1, base_url) for i in range(checkpoint.pages, tot_pages))
+    with open(records_path, 'a+b') as f:
+        f.truncate(checkpoint.records_size)
+        f.seek(checkpoint.records_size)
+        crawled = 0
+        for num_page, (page, records) in enumerate(page_records(crawler.crawl(urls), crawler.cache, backend),
+                                                   checkpoint.pages + 1):
+            f.writelines(json.dumps(record).encode() + b'\n' for record in records)
+            f.flush()
+            os.fsync(f.fileno())
+            crawled += 1
+            if crawler.cache is not None and not crawler.replay and crawled % save_cache_every == 0:
+                crawler.cache.save()
+            checkpoint.save(num_page, f.tell())
+            print(f'Got page {num_page}{" (unchanged)" if not page.changed else ""}')
+    checkpoint.clear()
+    return crawled
+
+def read_records(records_path):
+    with open(records_path) as f:
+        for line in f:
+            yield json.loads(line)
+
+def write_csvs(records, output_dir=SCRAPED_DATA_DIR):
+    """Write clinics.csv and vets.csv from normalized vet records, as they stream by.
+
+    Listings of the same clinic or vet, even under slightly different names,
+    are merged by an entities.ListingResolver, keeping the first one; clinics
+    are numbered in the order they first show up. Only the names of the
+    clinics and vets are kept in memory. The values normalizing dropped go to
+    rejects.csv. Return the resolver, i.e. for its numbers of clinics and vets.
     """
-    This function 
-    1) accept the page number and header
-    2) scrape the vets' data
-    3) save each vet into a dictionary, which is added to a list of vets
-    4) output the vets list
+
+    resolver = ListingResolver()
+    with open(os.path.join(output_dir, 'clinics.csv'), 'w', newline='') as clinics_file, \
+            open(os.path.join(output_dir, 'vets.csv'), 'w', newline='') as vets_file, \
+            open(os.path.join(output_dir, REJECTS_FILE), 'w', newline='') as rejects_file:
+        clinics = csv.writer(clinics_file)
+        vets = csv.writer(vets_file)
+        rejects = csv.DictWriter(rejects_file, ('fear_free_id', 'name') + REJECT_FIELDS[1:])
+        clinics.writerow(('name', 'street_address', 'city', 'state', 'zip_code', 'phone', 'website'))
+        vets.writerow(('name', 'fear_free_id', 'clinic_id'))
+        rejects.writeheader()
+        for record in records:
+            rejects.writerows({'fear_free_id': record['fear_free_id'], 'name': record['name'], **reject}
+                              for reject in record['rejects'])
+            clinic_id, new_clinic = resolver.clinic(record)
+            if new_clinic:
+                clinics.writerow([record[field] for field in
+                                  ('clinic', 'street_address', 'city', 'state', 'zip_code', 'phone', 'website')])
+            vet_id, new_vet = resolver.vet(record, clinic_id)
+            if new_vet:
+                vets.writerow((record['name'], record['fear_free_id'], clinic_id))
+    return resolver
+
+def get_95110_data(tot_pages=11, base_url=DIRECTORY_URL, crawler=None, output_dir=SCRAPED_DATA_DIR, backend=None):
+    """Crawl the pages concurrently into records.ndjson, resuming an interrupted crawl, then write the CSVs.
+
+    Pages stream through parsing and normalizing into the records file, and
+    the records stream from it into the CSVs, so memory use doesn't depend on
+    the number of pages.
     """
-    url = f"https://fearfreepets.com/fear-free-directory?p={num_page}&address=95110&category=0&center=37.354611%2C-121.918866&zoom=12&is_mile=1&directory_radius=100&view=grid&filter=1&field_role=Veterinarian"
-    
-    r = requests.get(url, headers=headers)
-    soup = BeautifulSoup(r.content, 'html5lib')
-    vets = soup.find_all("div", id=re.compile("sabai-entity-content-"))
-    ids =[int(vet['id'].replace("sabai-entity-content-", '')) for vet in vets]
-    clinics = [
-        vet.find("div", class_="sabai-directory-custom-fields-practice-individual-summary").get_text(strip=True)
-        if vet.find("div", class_="sabai-directory-custom-fields-practice-individual-summary") is not None 
-        else vet.find('a').get_text(strip=True).replace('Dr. ', '').replace('&', 'and') for vet in vets]
-    names = [vet.find('a').get_text(strip=True).replace('Dr. ', '').replace('&', 'and') for vet in vets]
-    locations = [
-        vet.find('span', class_='sabai-googlemaps-address sabai-googlemaps-address-0').get_text(strip=True)
-        for vet in vets]
-    streets = [get_street_info(address) for address in locations]
-    cities = [get_city(address) for address in locations]
-    states = [get_state(address) for address in locations]
-    zipcodes = [get_zip_code(address) for address in locations]
-    phones = [vet.find('span', itemprop='telephone').get_text(strip=True) 
-              if vet.find('span', itemprop='telephone') is not None else '' for vet in vets]
-    websites = [
-        vet.find('div', class_='sabai-directory-contact-website').find('a')['href'] 
-        if vet.find('div', class_='sabai-directory-contact-website') is not None else ''
-        for vet in vets]
-    
-    return clinics, streets, cities, states, zipcodes, phones, websites, names, ids
-
-def get_95110_data(tot_pages=11):
-
-    clinic_list = []
-    street_list = []
-    city_list = []
-    state_list = []
-    zipcode_list = []
-    phone_list = []
-    website_list = []
-    vet_list = []
-    ffid_list = []
-
-    for i in range(tot_pages):
-        clinics, streets, cities, states, zipcodes, phones, websites, vets, ffids = get_page_data(num_page=i+1, headers=HEADERS)
-        print(f'Got page {i+1}')
-        clinic_list.extend(clinics)
-        street_list.extend(streets)
-        city_list.extend(cities)
-        state_list.extend(states)
-        zipcode_list.extend(zipcodes)
-        phone_list.extend(phones)
-        website_list.extend(websites)
-        vet_list.extend(vets)
-        ffid_list.extend(ffids)
-
-    clinics_dict = dict(name=clinic_list, street_address=street_list, city=city_list, state=state_list,
-                        zip_code=zipcode_list, phone=phone_list, website=website_list)
-    clinics_pd = pd.DataFrame(clinics_dict)
-    clinics_pd['name_upper'] = clinics_pd['name'].astype(str).str.upper()
-    clinics_pd['city_upper'] = clinics_pd['city'].astype(str).str.upper()
-    clinics_pd.drop_duplicates(subset=['name_upper', 'city_upper', 'zip_code'], inplace=True, ignore_index=True, 
-                               keep='last')
-    clinics_pd['db_id'] = clinics_pd.index + 1
-
-    vets_dict = dict(name=vet_list, fear_free_id=ffid_list, clinic=clinic_list, street_address=street_list, 
-                     city=city_list, state=state_list, zip_code=zipcode_list)
-    vets_pd_no_id = pd.DataFrame(vets_dict)
-    vets_pd_no_id['clinic_upper'] = vets_pd_no_id['clinic'].astype(str).str.upper()
-    vets_pd_no_id['city_upper'] = vets_pd_no_id['city'].astype(str).str.upper()
-    vets_pd = vets_pd_no_id.merge(clinics_pd[['name_upper', 'street_address', 'city_upper', 'state', 'zip_code', 'db_id']], 
-                                  how='left', 
-                                  left_on=['clinic_upper', 'city_upper', 'zip_code'], 
-                                  right_on=['name_upper', 'city_upper', 'zip_code'])
-
-    
-
-    clinics_pd.drop(['name_upper', 'city_upper'], axis=1, inplace=True)
-    clinics_pd.to_csv("clinics_debug.csv", index=False)
-    clinics_pd.drop('db_id', inplace=True)
-    clinics_pd.to_csv("clinics.csv", index=False)
-
-    vets_pd.drop(['clinic_upper', 'city_upper', 'clinics', ], axis=1, inplace=True)
-    vets_pd.to_csv('vets_debug.csv', index=False)
-    vets_pd.drop(['clinics', 'street_address_x', 'city', 'state_x', 'zip_code', 'name_upper', 
-                  'street_address_y', 'state_y'], axis=1, inplace=True)
-    vets_pd.rename(columns={'db_id': 'clinic_id'}, inplace=True)
-    vets_pd.drop_duplicates(subset=['name', 'clinic_id'], inplace=True, ignore_index=True)
-    vets_pd.to_csv('vets.csv', index=False)
-
-get_95110_data()
+
+    crawler = crawler or Crawler()
+    records_path = os.path.join(output_dir, RECORDS_FILE)
+    scrape_records(crawler, tot_pages, records_path, base_url, backend)
+    resolver = write_csvs(read_records(records_path), output_dir)
+    print(f'Wrote {len(resolver.clinics)} clinics and {len(resolver.vets)} vets, '
+          f'from {resolver.clinics.listings} listings')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=11)
+    parser.add_argument('--cache-dir', default=PAGE_CACHE_DIR)
+    parser.add_argument('--parser', choices=BACKENDS, help="HTML parser backend (default: the fastest installed).")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--replay', action='store_true', help="Parse the cached pages, without fetching any.")
+    mode.add_argument('--no-cache', action='store_true', help="Download and parse every page.")
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else PageCache(args.cache_dir)
+    with Crawler(cache=cache, replay=args.replay) as crawler:
+        get_95110_data(tot_pages=args.pages, crawler=crawler, backend=args.parser)
+    print(f'{crawler.requests} requests, {crawler.not_modified} not modified, '
+          f'{crawler.bytes_downloaded:,} bytes downloaded')
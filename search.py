@@ -0,0 +1,419 @@
+"""Parsing of search terms and the in-memory location index for vet searches."""
+import base64
+import json
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from heapq import nlargest
+
+from sqlalchemy import func, or_
+
+from addresses import US_STATES
+from models import db, data_changed, Vet, Clinic, vet_rating
+
+ZIPCODE_PATTERN = re.compile(r"\b\d{5}\b")
+STATE_SUFFIX_PATTERN = re.compile(r",\s*([A-Za-z]{2})\.?\s*$")
+WORD_PATTERN = re.compile(r"[a-z]+")
+
+# Abbreviations people use for city names, i.e. "S. San Francisco" or "Mt View".
+CITY_ABBREVIATIONS = {
+    's': 'south',
+    'n': 'north',
+    'e': 'east',
+    'w': 'west',
+    'st': 'saint',
+    'ste': 'sainte',
+    'mt': 'mount',
+    'ft': 'fort',
+    'pt': 'point',
+}
+
+# Two letter state codes allowed at the end of a city search without a comma, i.e. "San Jose CA".
+STATE_CODES = frozenset(state.lower() for state in US_STATES)
+
+# Minimum trigram similarity for a fuzzy city match (same default as Postgres pg_trgm).
+FUZZY_THRESHOLD = 0.3
+
+
+def normalize_city(city):
+    """Lowercase a city name, drop punctuation and expand abbreviations."""
+
+    words = WORD_PATTERN.findall((city or '').lower())
+    return ' '.join(CITY_ABBREVIATIONS.get(word, word) for word in words)
+
+def parse_search_area(search_area):
+    """Split what the user typed in the search bar into (zipcode, city).
+
+    city is already normalized with normalize_city. Both are None if the input
+    can't be used for a search.
+    """
+
+    if not search_area:
+        return None, None
+
+    zipcode = ZIPCODE_PATTERN.search(search_area)
+    if zipcode:
+        return zipcode.group(), None
+
+    city = normalize_city(STATE_SUFFIX_PATTERN.sub('', search_area))
+    words = city.split()
+    if len(words) > 1 and words[-1] in STATE_CODES:
+        city = ' '.join(words[:-1])
+
+    return None, (city or None)
+
+def parse_search_state(search_area):
+    """The state code at the end of a city search, i.e. 'CA' for "San Jose, CA"; None if there's none."""
+
+    if not search_area or ZIPCODE_PATTERN.search(search_area):
+        return None
+
+    state = STATE_SUFFIX_PATTERN.search(search_area)
+    if state:
+        return state.group(1).upper()
+
+    words = normalize_city(search_area).split()
+    if len(words) > 1 and words[-1] in STATE_CODES:
+        return words[-1].upper()
+    return None
+
+def normalize_prefix(prefix):
+    """normalize_city for a partly typed search term.
+
+    The last word is only expanded once it is finished, so that "s" can still
+    become "san jose" while "s. san" becomes "south san".
+    """
+
+    prefix = (prefix or '').lower()
+    words = WORD_PATTERN.findall(prefix)
+    if not words:
+        return ''
+    last = words.pop()
+    finished = not prefix[-1].isalpha()
+    words = [CITY_ABBREVIATIONS.get(word, word) for word in words]
+    words.append(CITY_ABBREVIATIONS.get(last, last) if finished else last)
+    return ' '.join(words)
+
+def trigrams(key):
+    """Set of character trigrams of a normalized key, padded on both ends."""
+
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class LazyIndex:
+    """Base class for in-memory indexes built from the database.
+
+    Subclasses implement build(). The index is built lazily the first time a
+    worker needs it, and rebuilt after invalidate() (called when data_changed
+    fires for the tables it depends on) or after max_age seconds, so that
+    workers also pick up a seed.py run from another process.
+    """
+
+    # Tables whose changes make the index stale.
+    tables = frozenset()
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._built_at = None
+        data_changed.connect(self._on_data_changed, weak=False)
+
+    def build(self):
+        raise NotImplementedError
+
+    def invalidate(self):
+        """Force a rebuild on the next lookup."""
+
+        self._built_at = None
+
+    def ensure_built(self):
+        """Build the index if it is missing or too old."""
+
+        built_at = self._built_at
+        if built_at is not None and time.monotonic() - built_at < self.max_age:
+            return
+        with self._lock:
+            if self._built_at is None or time.monotonic() - self._built_at >= self.max_age:
+                self.build()
+                self._built_at = time.monotonic()
+
+    def _on_data_changed(self, sender, tables, **kwargs):
+        if tables & self.tables:
+            self.invalidate()
+
+
+class LocationIndex(LazyIndex):
+    """Zip code and city lookup tables mapping to vet ids. Lookups never touch the database."""
+
+    tables = frozenset({'vets', 'clinics'})
+
+    def __init__(self, max_age=300):
+        super().__init__(max_age)
+        self.zip_to_vets = {}
+        self.city_to_vets = {}
+        self.city_names = {}
+        self.city_keys = []
+        self.city_trigrams = {}
+        self.city_trigram_counts = {}
+
+    def build(self):
+        """Load (vet id, zip code, city) rows and rebuild all lookup tables."""
+
+        rows = (db.session.query(Vet.id, Clinic.zip_code, Clinic.city)
+                .join(Clinic, Clinic.id == Vet.clinic_id)
+                .filter(Vet.active)
+                .order_by(Vet.id)
+                .all())
+
+        zip_to_vets = defaultdict(list)
+        city_to_vets = defaultdict(list)
+        city_names = defaultdict(set)
+        for vet_id, zip_code, city in rows:
+            if zip_code:
+                zip_to_vets[zip_code].append(vet_id)
+            key = normalize_city(city)
+            if key:
+                city_to_vets[key].append(vet_id)
+                city_names[key].add(city)
+
+        city_trigrams = defaultdict(set)
+        for key in city_to_vets:
+            for gram in trigrams(key):
+                city_trigrams[gram].add(key)
+
+        # Swap in the new tables all at once so readers never see a half-built index.
+        self.zip_to_vets = dict(zip_to_vets)
+        self.city_to_vets = dict(city_to_vets)
+        self.city_names = {key: sorted(names) for key, names in city_names.items()}
+        self.city_keys = sorted(city_to_vets)
+        self.city_trigrams = dict(city_trigrams)
+        self.city_trigram_counts = {key: len(trigrams(key)) for key in city_to_vets}
+
+    def vets_for_zip(self, zipcode):
+        """Vet ids at clinics in this zip code."""
+
+        self.ensure_built()
+        return list(self.zip_to_vets.get(zipcode, ()))
+
+    def match_cities(self, city):
+        """Normalized city keys matching a normalized search term.
+
+        Tries an exact match first, then every city starting with the term
+        ("san jos"), then the most similar cities by trigrams ("san jsoe").
+        """
+
+        self.ensure_built()
+        if city in self.city_to_vets:
+            return [city]
+
+        keys = self.city_keys
+        matches = []
+        i = bisect_left(keys, city)
+        while i < len(keys) and keys[i].startswith(city):
+            matches.append(keys[i])
+            i += 1
+        if matches:
+            return matches
+
+        grams = trigrams(city)
+        shared = defaultdict(int)
+        for gram in grams:
+            for key in self.city_trigrams.get(gram, ()):
+                shared[key] += 1
+
+        best_score = 0
+        for key, count in shared.items():
+            score = count / (len(grams) + self.city_trigram_counts[key] - count)
+            if score > best_score:
+                best_score, matches = score, [key]
+            elif score == best_score:
+                matches.append(key)
+
+        return sorted(matches) if best_score >= FUZZY_THRESHOLD else []
+
+    def city_names_for(self, city):
+        """Clinic.city values (as stored) of the cities matching the search term."""
+
+        return [name for key in self.match_cities(city) for name in self.city_names[key]]
+
+    def vets_for_city(self, city):
+        """Vet ids at clinics in the city (or cities) matching the search term."""
+
+        vet_ids = []
+        for key in self.match_cities(city):
+            vet_ids.extend(self.city_to_vets[key])
+        return sorted(vet_ids)
+
+    def lookup(self, zipcode=None, city=None):
+        """Vet ids for the output of parse_search_area."""
+
+        if zipcode:
+            return self.vets_for_zip(zipcode)
+        if city:
+            return self.vets_for_city(city)
+        return []
+
+
+location_index = LocationIndex()
+
+
+class AutocompleteIndex(LazyIndex):
+    """Sorted array of the distinct cities and zip codes of clinics, with vet counts.
+
+    Keys (normalized city names and zip codes) are kept in one sorted list so
+    a prefix maps to a contiguous slice found with bisect. Suggestions for
+    one and two character prefixes, the ones with the most matches, are
+    precomputed.
+    """
+
+    tables = frozenset({'vets', 'clinics'})
+
+    def __init__(self, max_age=300, limit=10):
+        super().__init__(max_age)
+        self.limit = limit
+        self.keys = []
+        self.suggestions = []
+        self.short_prefixes = {}
+
+    def build(self):
+        """Count vets per city and zip code and rebuild the sorted arrays."""
+
+        rows = (db.session.query(Clinic.city, Clinic.zip_code, func.count(Vet.id))
+                .join(Vet, Vet.clinic_id == Clinic.id)
+                .filter(Vet.active)
+                .group_by(Clinic.city, Clinic.zip_code)
+                .all())
+
+        city_counts = Counter()
+        city_labels = defaultdict(Counter)
+        zip_counts = Counter()
+        zip_cities = {}
+        for city, zip_code, num_vets in rows:
+            key = normalize_city(city)
+            if key:
+                city_counts[key] += num_vets
+                city_labels[key][city] += num_vets
+            if zip_code:
+                zip_counts[zip_code] += num_vets
+                zip_cities.setdefault(zip_code, city)
+
+        entries = []
+        for key, num_vets in city_counts.items():
+            # Show the most common spelling of the city, i.e. "San Jose" over "san jose".
+            label = city_labels[key].most_common(1)[0][0].strip()
+            entries.append((key, {'value': label, 'kind': 'city', 'vets': num_vets}))
+        for zip_code, num_vets in zip_counts.items():
+            entries.append((zip_code, {'value': zip_code, 'kind': 'zip', 'city': zip_cities[zip_code],
+                                       'vets': num_vets}))
+        entries.sort(key=lambda entry: entry[0])
+
+        keys = [key for key, _ in entries]
+        suggestions = [suggestion for _, suggestion in entries]
+        short_prefixes = {}
+        for key in keys:
+            for length in (1, 2):
+                prefix = key[:length]
+                if prefix not in short_prefixes:
+                    short_prefixes[prefix] = self._top(keys, suggestions, prefix)
+
+        self.keys, self.suggestions, self.short_prefixes = keys, suggestions, short_prefixes
+
+    def _top(self, keys, suggestions, prefix):
+        """The suggestions starting with prefix with the most vets."""
+
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + '\uffff', start)
+        return nlargest(self.limit, suggestions[start:end], key=lambda suggestion: suggestion['vets'])
+
+    def complete(self, prefix):
+        """Up to limit suggestions for what the user typed so far, most vets first."""
+
+        self.ensure_built()
+        prefix = prefix.strip()
+        prefix = prefix if prefix.isdigit() else normalize_prefix(prefix)
+        if not prefix:
+            return []
+        if prefix in self.short_prefixes:
+            return self.short_prefixes[prefix]
+        return self._top(self.keys, self.suggestions, prefix)
+
+
+autocomplete_index = AutocompleteIndex()
+
+
+##########################################################################
+# Paginated vet search (used by /api/vets/search)
+
+SORT_OPTIONS = ('name', 'rating')
+
+def encode_cursor(sort_value, vet_id):
+    """Opaque cursor pointing just after (sort_value, vet_id)."""
+
+    raw = json.dumps([sort_value, vet_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor, sort_type):
+    """(sort_value, vet_id) of a cursor from encode_cursor; raises ValueError if it is invalid."""
+
+    try:
+        sort_value, vet_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(vet_id, int) or not isinstance(sort_value, sort_type):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return sort_value, vet_id
+
+def search_vets_page(zipcode=None, city=None, sort='name', limit=20, cursor=None,
+                     min_rating=None, has_website=False, has_phone=False):
+    """One page of vets matching the output of parse_search_area.
+
+    Keyset pagination on (sort key, vet id): every page is a single query
+    with a LIMIT that starts reading ix_vets_name_id or ix_vets_rating_id
+    where the previous page stopped, so its cost doesn't depend on how deep
+    the page is or how many vets the city has. Results are sorted by name
+    ascending or by rating descending, ties broken by vet id.
+
+    Returns ([(vet, clinic, rating)], next cursor or None).
+    """
+
+    rating = vet_rating
+
+    query = db.session.query(Vet, Clinic, rating).join(Clinic, Clinic.id == Vet.clinic_id).filter(Vet.active)
+
+    if zipcode:
+        query = query.filter(Clinic.zip_code == zipcode)
+    else:
+        query = query.filter(Clinic.city.in_(location_index.city_names_for(city)))
+
+    if min_rating is not None:
+        query = query.filter(rating >= min_rating)
+    if has_website:
+        query = query.filter(Clinic.website.isnot(None), Clinic.website != '')
+    if has_phone:
+        query = query.filter(Clinic.phone.isnot(None), Clinic.phone != '')
+
+    if sort == 'rating':
+        if cursor:
+            after_rating, after_id = decode_cursor(cursor, (int, float))
+            # The first condition bounds the index range, the second skips the ties already seen.
+            query = query.filter(rating <= after_rating, or_(rating < after_rating, Vet.id > after_id))
+        query = query.order_by(rating.desc(), Vet.id)
+    else:
+        if cursor:
+            after_name, after_id = decode_cursor(cursor, str)
+            query = query.filter(Vet.name >= after_name, or_(Vet.name > after_name, Vet.id > after_id))
+        query = query.order_by(Vet.name, Vet.id)
+
+    # Fetch one extra row to know whether there is a next page.
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        vet, clinic, last_rating = rows[-1]
+        sort_value = float(last_rating) if sort == 'rating' else vet.name
+        next_cursor = encode_cursor(sort_value, vet.id)
+
+    return rows, next_cursor
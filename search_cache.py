@@ -0,0 +1,132 @@
+"""Per-worker cache of rendered search results.
+
+Each worker drops it when data_changed fires, for its own writes, and for
+other workers' once a lookup's models.data_version_watch.check() sees them.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from models import data_changed
+
+
+class _Flight:
+    """A computation of a missing key that other requests can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SearchCache:
+    """Size-bounded LRU cache with a TTL and single-flight misses.
+
+    When several requests miss on the same key at once, only the first one
+    computes the value; the others wait for it instead of also hitting the
+    database. invalidate() drops everything, including values still being
+    computed from data that has since changed.
+    """
+
+    def __init__(self, max_size=256, ttl=300, wait_timeout=10, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value of key, calling compute() to fill it in on a miss."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = _Flight()
+                generation = self._generation
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if flight.done.wait(self.wait_timeout):
+                if flight.error is not None:
+                    raise flight.error
+                return flight.value
+            # The first request is taking too long; don't hold this one up any longer.
+            return compute()
+
+        try:
+            flight.value = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            with self._lock:
+                if generation == self._generation:
+                    self._store(key, flight.value)
+        finally:
+            with self._lock:
+                if self._in_flight.get(key) is flight:
+                    del self._in_flight[key]
+            flight.done.set()
+
+        return flight.value
+
+    def _store(self, key, value):
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self):
+        """Drop every cached value."""
+
+        with self._lock:
+            self._entries.clear()
+            self._in_flight.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        """Counters of the cache, i.e. for monitoring hit rates."""
+
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+search_cache = SearchCache()
+
+@data_changed.connect
+def _invalidate_search_cache(sender, tables, **kwargs):
+    search_cache.invalidate()
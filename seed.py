@@ -1,16 +1,6 @@
 from app import db, app
-from models import Clinic, User, Review, Favorite, Vet
-import pandas as pd
-from sqlalchemy import insert
-import json
-
-df_vets = pd.read_csv("scraped_data/vets.csv")
-
-df_clinics = pd.read_csv("scraped_data/clinics.csv")
-df_clinics['zip_code'] = df_clinics['zip_code'].apply(lambda z: f'{z:.0f}' if not pd.isna(z) else z)
-
-clinics = json.loads(df_clinics.to_json(orient='records'))
-vets = json.loads(df_vets.to_json(orient="records"))
+from loader import ingest_scraped
+from models import User, Review, Favorite
 
 
 with app.app_context():
@@ -19,8 +9,7 @@ with app.app_context():
     db.create_all()
 
     # Add vets and clinics from web-scraped data.
-    db.session.execute(insert(Clinic), clinics)
-    db.session.execute(insert(Vet), vets)
+    ingest_scraped()
 
     # Add one test user
     orion = User(first_name='Orion', last_name='PanDeka', username='OrionPD', email='orionpd@gmail.com', password='$2b$12$hDBiRnR6ZyKXEt8Hg6u5ZeK.eJshorlWC.hFSPo8wRkHNdDvOCKFy')
@@ -0,0 +1,28 @@
+const $searchInput = $("#zipcode_or_city");
+const $suggestions = $("#search-suggestions");
+let latestPrefix = '';
+
+async function handleTyping(evt) {
+    const prefix = $(this).val();
+    latestPrefix = prefix;
+
+    if (prefix.trim().length === 0) {
+        $suggestions.empty();
+        return;
+    }
+
+    const resp = await axios.get(`${BASE_URL}/api/autocomplete`, { params: { prefix } });
+
+    // Ignore responses for prefixes the user has already typed past.
+    if (prefix !== latestPrefix) {
+        return;
+    }
+
+    $suggestions.empty();
+    for (let suggestion of resp.data.suggestions) {
+        const label = suggestion.kind === 'zip' ? `${suggestion.city} (${suggestion.vets} vets)` : `${suggestion.vets} vets`;
+        $suggestions.append($('<option>').attr('value', suggestion.value).attr('label', label));
+    }
+}
+
+$searchInput.on("input", handleTyping);
@@ -16,15 +16,16 @@ async function handleFavorite(evt) {
         }
     } else {
         const vet_id = $(this).attr('id').substring(9);
-        const resp = await axios.post(`${BASE_URL}/api/users/favorite/${vet_id}`);
+        const $btn = $(this).find(".btn");
+        // Ask for the opposite of what's shown rather than a toggle, so a double click can't undo itself.
+        const method = $btn.hasClass('btn-primary') ? 'delete' : 'put';
+        const resp = await axios({method, url: `${BASE_URL}/api/users/favorite/${vet_id}`});
         
         // change mark up with css
-        if (resp.status === 200) {
-            $(this).find(".btn").removeClass('btn-primary').addClass('btn-secondary');
-        }
-
-        if (resp.status === 201) {
-            $(this).find(".btn").removeClass('btn-secondary').addClass('btn-primary');
+        if (resp.data.favorite.favorite) {
+            $btn.removeClass('btn-secondary').addClass('btn-primary');
+        } else {
+            $btn.removeClass('btn-primary').addClass('btn-secondary');
         }
     }
 }
@@ -32,17 +33,32 @@ async function handleFavorite(evt) {
 $favorite.on("submit", handleFavorite);
 
 async function markFavoriteVets() {
-    const resp = await axios.get(`${BASE_URL}/api/users/favorites`);
-    const favoriteVetIds = resp.data.favorite_vets.ids;
+    // Only ask about the vets on the page. The browser revalidates its copy with the ETag,
+    // so an unchanged answer comes back as a 304.
+    const vetIds = $favorite.map((i, form) => form.id.substring(9)).get();
+    if (vetIds.length === 0) {
+        return;
+    }
+    const resp = await axios.get(`${BASE_URL}/api/users/favorites`, {params: {vet_ids: vetIds.join(',')}});
+    const favoriteVetIds = new Set(resp.data.favorite_vets.ids.map(String));
     
-    // Change mark up of favorite vets
-    for (let id of favoriteVetIds) {
-        $(`#favorite-${id}`).find('.btn').removeClass('btn-secondary').addClass('btn-primary');
+    // Change mark up of favorite vets, and of the ones that no longer are
+    for (let id of vetIds) {
+        const $btn = $(`#favorite-${id}`).find('.btn');
+        if (favoriteVetIds.has(id)) {
+            $btn.removeClass('btn-secondary').addClass('btn-primary');
+        } else {
+            $btn.removeClass('btn-primary').addClass('btn-secondary');
+        }
     }
 }
 
-// 1) Mark favorite vets 2) handle changing favorite status
-// if the page contains vet info and if the user is logged in.
-if ($vets.length !== 0 && $userName.length !== 0) {
-    markFavoriteVets();
-}
+// The server marks favorite vets in the page itself. Only a page the browser shows again from
+// its cache, i.e. going back to it, may be out of date, so check those if the user is logged in.
+window.addEventListener('pageshow', (evt) => {
+    const navigation = performance.getEntriesByType('navigation')[0];
+    const fromCache = evt.persisted || (navigation && navigation.type === 'back_forward');
+    if (fromCache && $vets.length !== 0 && $userName.length !== 0) {
+        markFavoriteVets();
+    }
+});
@@ -0,0 +1,182 @@
+"""Synthetic clinics, vets, users, favorites and reviews at any scale.
+
+Used by the route benchmarks to see how pages behave with far more data than
+was scraped. Clinics are placed in real zip codes within ~100 miles of North
+San Jose, like the scraped ones, so location and radius searches find them.
+Popularity is skewed: a few clinics employ many vets, and a few vets get most
+of the reviews and favorites, as on a real review site.
+
+Rows are generated lazily with explicit ids, and streamed into the database
+in chunks, with COPY on Postgres, so memory stays flat however many rows are
+loaded.
+"""
+import csv
+import gzip
+import random
+import time
+from datetime import datetime, timedelta
+
+from models import db, recompute_rating_aggregates
+from passwords import password_hasher
+from fulltext import rebuild_search_table, search_triggers_disabled
+from geo import ZIP_CENTROIDS_PATH, haversine_miles
+from loader import stream_rows, reset_sequences
+
+# Center and radius of the area clinics are placed in, matching the scraped data.
+CENTER = (37.3861, -121.9289)
+RADIUS_MILES = 100
+
+RATINGS = (1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5)
+RATING_WEIGHTS = (4, 1, 4, 2, 8, 6, 20, 15, 40)
+
+WORDS = ("we", "our", "dog", "cat", "pup", "kitty", "vet", "doctor", "was", "very", "so", "really",
+         "patient", "gentle", "kind", "calm", "anxious", "scared", "nervous", "treats", "exam", "visit",
+         "staff", "clinic", "front", "desk", "wait", "appointment", "vaccines", "dental", "surgery",
+         "recommend", "would", "again", "and", "the", "with", "a", "to", "of", "fear", "free", "low",
+         "stress", "handling", "explained", "everything", "took", "time", "great", "okay", "expensive")
+
+FIRST_NAMES = ("Alex", "Sam", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn",
+               "Maria", "Wei", "Priya", "Luis", "Aiko", "Omar", "Elena", "Kofi", "Hana", "Noah")
+LAST_NAMES = ("Nguyen", "Garcia", "Smith", "Chen", "Patel", "Kim", "Lopez", "Johnson", "Singh", "Brown",
+              "Tran", "Martinez", "Lee", "Wong", "Davis", "Huang", "Rivera", "Park", "Shah", "Miller")
+
+# Tables in load order, so rows exist before other rows reference them.
+TABLES = ('clinics', 'vets', 'users', 'favorites', 'reviews')
+
+START_TIME = datetime(2020, 1, 1)
+TIME_SPAN_SECONDS = 4 * 365 * 24 * 3600
+
+
+def area_zip_codes(path=ZIP_CENTROIDS_PATH):
+    """[(zip code, city, lat, lon)] of the zip codes within RADIUS_MILES of CENTER."""
+
+    area = []
+    with gzip.open(path, 'rt', newline='') as f:
+        for row in csv.DictReader(f):
+            lat, lon = float(row['latitude']), float(row['longitude'])
+            if row['state'] == 'CA' and haversine_miles(*CENTER, lat, lon) <= RADIUS_MILES:
+                area.append((row['zip_code'], row['city'], lat, lon))
+    return area
+
+def skewed_index(rng, n, skew):
+    """Random index in range(n), with low indexes more likely the higher skew is."""
+
+    return min(int(n * rng.random() ** skew), n - 1)
+
+def sentence(rng, mean_words):
+    """Random words with a long-tailed length, from a few words to a few paragraphs."""
+
+    length = max(2, min(int(rng.lognormvariate(0, 0.8) * mean_words), 40 * mean_words))
+    return ' '.join(rng.choices(WORDS, k=length)).capitalize() + '.'
+
+
+class SyntheticData:
+    """Row generators for a synthetic data set of the given size.
+
+    Every generator is deterministic for a given seed and yields row dicts with
+    explicit ids from 1, ready for insert() or COPY.
+    """
+
+    def __init__(self, vets=1000, clinics=None, users=None, reviews=None, favorites=None,
+                 password='password', seed=0):
+        self.vets = vets
+        self.clinics = clinics or max(1, vets // 4)
+        self.users = users or max(1, vets // 2)
+        self.reviews = reviews if reviews is not None else vets * 10
+        self.favorites = favorites if favorites is not None else self.users * 5
+        self.password = password
+        self.seed = seed
+
+    def counts(self):
+        return {table: getattr(self, table) for table in TABLES}
+
+    def rng(self, table):
+        return random.Random(f'{self.seed}-{table}')
+
+    def password_hash(self):
+        """One bcrypt hash shared by every user, so generating users isn't CPU-bound."""
+
+        return password_hasher.hash(self.password)
+
+    def rows(self, table):
+        return getattr(self, f'{table}_rows')()
+
+    def clinics_rows(self):
+        rng = self.rng('clinics')
+        area = area_zip_codes()
+        for i in range(1, self.clinics + 1):
+            zip_code, city, lat, lon = area[skewed_index(rng, len(area), 1.5)]
+            yield {'id': i, 'name': f'{rng.choice(LAST_NAMES)} Animal Hospital {i}',
+                   'street_address': f'{rng.randint(1, 9999)} {rng.choice(LAST_NAMES)} St',
+                   'city': city.title(), 'state': 'CA', 'zip_code': zip_code,
+                   'phone': f'(408) {rng.randint(200, 999)}-{rng.randint(0, 9999):04d}' if rng.random() < 0.9 else None,
+                   'website': f'https://clinic{i}.example.com' if rng.random() < 0.7 else None,
+                   'latitude': lat, 'longitude': lon}
+
+    def vets_rows(self):
+        rng = self.rng('vets')
+        for i in range(1, self.vets + 1):
+            yield {'id': i, 'name': f'Dr. {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                   'clinic_id': skewed_index(rng, self.clinics, 2) + 1, 'fear_free_id': i}
+
+    def users_rows(self):
+        rng = self.rng('users')
+        password = self.password_hash()
+        for i in range(1, self.users + 1):
+            yield {'id': i, 'first_name': rng.choice(FIRST_NAMES), 'last_name': rng.choice(LAST_NAMES),
+                   'username': f'user{i}', 'email': f'user{i}@example.com', 'password': password}
+
+    def favorites_rows(self):
+        """Favorites spread over users, most of them on popular vets, without duplicates."""
+
+        rng = self.rng('favorites')
+        per_user, extra = divmod(self.favorites, self.users)
+        next_id = 1
+        for user_id in range(1, self.users + 1):
+            wanted = min(per_user + (user_id <= extra), self.vets)
+            if wanted > self.vets // 2:
+                # Too close to every vet for skewed picks to find the last ones quickly.
+                vet_ids = set(rng.sample(range(1, self.vets + 1), wanted))
+            else:
+                vet_ids = set()
+                while len(vet_ids) < wanted:
+                    vet_ids.add(skewed_index(rng, self.vets, 3) + 1)
+            for vet_id in sorted(vet_ids):
+                yield {'id': next_id, 'user_id': user_id, 'vet_id': vet_id}
+                next_id += 1
+
+    def reviews_rows(self):
+        rng = self.rng('reviews')
+        for i in range(1, self.reviews + 1):
+            yield {'id': i, 'user_id': skewed_index(rng, self.users, 2) + 1,
+                   'vet_id': skewed_index(rng, self.vets, 3) + 1,
+                   'rating': rng.choices(RATINGS, RATING_WEIGHTS)[0],
+                   'timestamp': START_TIME + timedelta(seconds=rng.randrange(TIME_SPAN_SECONDS)),
+                   'comment': sentence(rng, 25)}
+
+
+def load_synthetic(data, chunk_size=10000, report=None):
+    """Replace all data with the rows of data (a SyntheticData), streamed in chunks.
+
+    Rating aggregates and the full-text table are computed in one pass at the
+    end instead of row by row. report(table, rows, seconds) is called as each
+    table finishes loading.
+    """
+
+    db.drop_all()
+    db.create_all()
+
+    with search_triggers_disabled():
+        for table in TABLES:
+            start = time.perf_counter()
+            count = stream_rows(table, data.rows(table), chunk_size)
+            db.session.commit()
+            if report:
+                report(table, count, time.perf_counter() - start)
+
+    reset_sequences(TABLES)
+    for step, run in [('rating aggregates', recompute_rating_aggregates), ('search table', rebuild_search_table)]:
+        start = time.perf_counter()
+        run()
+        if report:
+            report(step, None, time.perf_counter() - start)
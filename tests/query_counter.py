@@ -0,0 +1,40 @@
+"""Helper for counting the SQL statements a block of code runs."""
+
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from models import db
+
+
+class QueryCounter:
+    """SQL statements recorded while counting."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(app):
+    """Record every statement sent to the app's database inside the with block.
+
+    with count_queries(app) as queries:
+        c.get('/results')
+    self.assertEqual(len(queries), 2, queries.statements)
+    """
+
+    with app.app_context():
+        engine = db.engine
+
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter.record)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter.record)
@@ -0,0 +1,71 @@
+"""Address, phone and website normalization tests."""
+
+from unittest import TestCase
+
+import pandas as pd
+
+from addresses import (parse_addresses, normalize_zip_codes, normalize_phones, normalize_websites,
+                       normalize_clinics, clinic_records, normalize_clinic)
+
+
+class AddressesTestCase(TestCase):
+
+    def parse(self, *addresses):
+        return clinic_records(parse_addresses(pd.Series(addresses)))
+
+    def test_parse_addresses(self):
+        """Are addresses split into their parts, whatever the number of words in their city?"""
+
+        self.assertEqual(self.parse('1 Main St, San Jose, CA 95110', '2 Oak Ave, South San Francisco, CA 94080'), [
+            {'street_address': '1 Main St', 'city': 'San Jose', 'state': 'CA', 'zip_code': '95110'},
+            {'street_address': '2 Oak Ave', 'city': 'South San Francisco', 'state': 'CA', 'zip_code': '94080'}])
+        self.assertEqual(self.parse('1 Main St,  Suite 5, st. helena, ca 94574-1234, USA'), [
+            {'street_address': '1 Main St, Suite 5', 'city': 'St. Helena', 'state': 'CA', 'zip_code': '94574'}])
+        self.assertEqual(self.parse('4 El Camino Real, El Dorado Hills CA 95762')[0]['city'], 'El Dorado Hills')
+        self.assertEqual(self.parse('Los Gatos, CA'), [
+            {'street_address': None, 'city': 'Los Gatos', 'state': 'CA', 'zip_code': None}])
+        # The street and city run together: keep what can be told apart.
+        self.assertEqual(self.parse('123 Foo Ave Livermore, CA 94551'), [
+            {'street_address': None, 'city': None, 'state': 'CA', 'zip_code': '94551'}])
+        self.assertEqual(self.parse('Somewhere else', '', None),
+                         [dict.fromkeys(('street_address', 'city', 'state', 'zip_code'))] * 3)
+
+    def test_normalize_columns(self):
+        self.assertEqual(normalize_zip_codes(pd.Series([95110.0, None, 2134.0])).tolist(), ['95110', pd.NA, '02134'])
+        self.assertEqual(normalize_zip_codes(pd.Series(['95110.0', ' 95110-1234', 'n/a', ''])).tolist(),
+                         ['95110', '95110', pd.NA, pd.NA])
+        self.assertEqual(normalize_phones(pd.Series(['530-752-1393', '8665058755', '+1 408.555.0100 ext 12',
+                                                     '555-0100'])).tolist(),
+                         ['(530) 752-1393', '(866) 505-8755', '(408) 555-0100 x12', pd.NA])
+        self.assertEqual(normalize_websites(pd.Series(['http://www.theFondFarewell.com', 'drlah.com/a?b=C',
+                                                       'HTTPS://Example.org', 'not a url'])).tolist(),
+                         ['http://www.thefondfarewell.com', 'http://drlah.com/a?b=C', 'https://example.org', pd.NA])
+
+    def test_rejects(self):
+        """Are values that can't be normalized dropped and reported?"""
+
+        clinics, rejects = normalize_clinics(pd.DataFrame({
+            'address': ['1 Main St, Davis, DA 95618', 'Nowhere', '1 Main St, San Jose, CA 95110'],
+            'phone': ['555-0100', '', '(408) 555-0100'],
+            'website': [None, 'sj.example.com', 'http://'],
+        }))
+        self.assertEqual([clinic['state'] for clinic in clinic_records(clinics)], [None, None, 'CA'])
+        self.assertEqual(clinic_records(clinics)[1]['website'], 'http://sj.example.com')
+        self.assertEqual(sorted(map(tuple, rejects[['row', 'field', 'value']].to_numpy().tolist())), [
+            (0, 'phone', '555-0100'), (0, 'state', 'DA'), (1, 'address', 'Nowhere'), (2, 'website', 'http://')])
+
+    def test_normalize_clinic(self):
+        """Does a clinic normalized on its own come out as it does in a batch, with the same rejects?"""
+
+        rows = [{'name': 'Davis', 'address': '1 Main St, Davis, DA 95618', 'phone': '555-0100', 'website': None},
+                {'name': 'Nowhere', 'address': 'Nowhere', 'phone': '', 'website': 'sj.example.com'},
+                {'name': 'San Jose', 'address': '1 Main St,  Suite 5, san jose, ca 95110-1234, USA',
+                 'phone': '+1 408.555.0100 ext 12', 'website': 'http://'},
+                {'name': 'Livermore', 'address': '123 Foo Ave Livermore, CA 94551', 'phone': None,
+                 'website': 'HTTPS://Example.org'},
+                {'name': 'Blank', 'address': None, 'phone': None, 'website': None}]
+        clinics, rejects = normalize_clinics(pd.DataFrame(rows))
+        for i, (row, clinic) in enumerate(zip(rows, clinic_records(clinics))):
+            self.assertEqual(normalize_clinic(row), (
+                clinic, [{'field': reject['field'], 'value': reject['value'], 'reason': reject['reason']}
+                         for reject in rejects.to_dict('records') if reject['row'] == i]))
@@ -0,0 +1,87 @@
+"""Autocomplete tests."""
+
+from app import app
+import os
+from unittest import TestCase
+
+from models import db, Clinic, Vet
+from search import normalize_prefix, autocomplete_index
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+os.environ['DATABASE_URL'] = "postgresql:///baffv-test"
+
+
+class AutocompleteTestCase(TestCase):
+    """Test city and zip code suggestions."""
+
+    def setUp(self):
+        """Add sample data."""
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            sj1 = Clinic(name='SJ Clinic 1', city='San Jose', state='CA', zip_code='95110')
+            sj2 = Clinic(name='SJ Clinic 2', city='san jose', state='CA', zip_code='95112')
+            sm = Clinic(name='SM Clinic', city='San Mateo', state='CA', zip_code='94401')
+            ssf = Clinic(name='SSF Clinic', city='South San Francisco', state='CA', zip_code='94080')
+            db.session.add_all([sj1, sj2, sm, ssf])
+            db.session.commit()
+
+            db.session.add_all([Vet(name='Vet 1', clinic_id=sj1.id, fear_free_id=1),
+                                Vet(name='Vet 2', clinic_id=sj1.id, fear_free_id=2),
+                                Vet(name='Vet 3', clinic_id=sj2.id, fear_free_id=3),
+                                Vet(name='Vet 4', clinic_id=sm.id, fear_free_id=4),
+                                Vet(name='Vet 5', clinic_id=ssf.id, fear_free_id=5)])
+            db.session.commit()
+
+    def tearDown(self):
+        """Clean up after each test."""
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+
+    def test_normalize_prefix(self):
+        """Is the word being typed left unexpanded?"""
+
+        self.assertEqual(normalize_prefix('S'), 's')
+        self.assertEqual(normalize_prefix('S. San'), 'south san')
+        self.assertEqual(normalize_prefix('s '), 'south')
+        self.assertEqual(normalize_prefix(''), '')
+
+    def test_complete(self):
+        """Are cities and zip codes suggested by prefix, most vets first?"""
+
+        with app.app_context():
+            suggestions = autocomplete_index.complete('san')
+            self.assertEqual([(s['value'], s['vets']) for s in suggestions], [('San Jose', 3), ('San Mateo', 1)])
+
+            self.assertEqual([s['value'] for s in autocomplete_index.complete('S')],
+                             ['San Jose', 'San Mateo', 'South San Francisco'])
+            self.assertEqual([s['value'] for s in autocomplete_index.complete('S. San')], ['South San Francisco'])
+            self.assertEqual([s['value'] for s in autocomplete_index.complete('951')], ['95110', '95112'])
+            self.assertEqual(autocomplete_index.complete('951')[0]['city'], 'San Jose')
+            self.assertEqual(autocomplete_index.complete('oak'), [])
+            self.assertEqual(autocomplete_index.complete('  '), [])
+
+    def test_refresh(self):
+        """Are new clinics suggested after they are added?"""
+
+        with app.app_context():
+            self.assertEqual(autocomplete_index.complete('oak'), [])
+            cln = Clinic(name='Oak Clinic', city='Oakland', state='CA', zip_code='94601')
+            db.session.add(cln)
+            db.session.commit()
+            db.session.add(Vet(name='Vet 6', clinic_id=cln.id, fear_free_id=6))
+            db.session.commit()
+            self.assertEqual([s['value'] for s in autocomplete_index.complete('oak')], ['Oakland'])
+
+    def test_autocomplete_api(self):
+        """Does the API return suggestions?"""
+
+        with app.test_client() as c:
+            resp = c.get('/api/autocomplete', query_string={'prefix': 'san j'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['suggestions'], [{'value': 'San Jose', 'kind': 'city', 'vets': 3}])
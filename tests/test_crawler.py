@@ -0,0 +1,116 @@
+"""Crawler tests, against the local fixture server."""
+
+import time
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from crawler import Crawler, CrawlError, HostRateLimiter
+from fixture_server import FixtureServer, save_directory_pages
+from directory_parser import parse_cards
+from scraped_data.webscrape_bs4 import page_url, normalize_cards
+
+LISTINGS = [{'fear_free_id': 100 + i, 'name': f'Vet {i}', 'clinic': f'Clinic {i // 2}',
+             'address': f'{i} Main St, San Jose, CA 95110', 'phone': '(408) 555-0100' if i % 2 else '',
+             'website': f'https://clinic{i // 2}.example.com'}
+            for i in range(12)]
+
+
+class FakeClock:
+    """Clock that sleeping moves forward."""
+
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class CrawlerTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.pages = save_directory_pages(self.directory.name, LISTINGS, per_page=2)
+        self.sleeps = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def crawler(self, **kwargs):
+        return Crawler(rate=None, sleep=self.sleeps.append, **kwargs)
+
+    def test_crawl(self):
+        """Are pages fetched concurrently, in order, over reused connections?"""
+
+        with FixtureServer(self.directory.name, latency=0.05) as server, self.crawler(concurrency=3) as crawler:
+            urls = [page_url(page, server.url) for page in range(1, self.pages + 1)]
+            ids = [[card['fear_free_id'] for card in parse_cards(page.content)] for page in crawler.crawl(urls)]
+
+        self.assertEqual(ids, [[100 + i, 101 + i] for i in range(0, 12, 2)])
+        self.assertEqual(server.requests, 6)
+        self.assertLessEqual(server.connections, 3)
+        self.assertGreater(server.peak_concurrency, 1)
+        self.assertLessEqual(server.peak_concurrency, 3)
+
+    def test_bounded_window(self):
+        """Are only a few pages fetched ahead of the one being consumed?"""
+
+        with FixtureServer(self.directory.name) as server, self.crawler(concurrency=2) as crawler:
+            pages = crawler.crawl(page_url(page, server.url) for page in range(1, self.pages + 1))
+            next(pages)
+            time.sleep(0.2)
+            self.assertEqual(server.requests, 5)
+            self.assertEqual(len(list(pages)), self.pages - 1)
+
+    def test_parse_page(self):
+        """Does the scraper parse the fixture pages like the directory's?"""
+
+        with FixtureServer(self.directory.name) as server, self.crawler() as crawler:
+            content = crawler.fetch(page_url(2, server.url)).content
+
+        records = normalize_cards(parse_cards(content))
+        self.assertEqual([record['fear_free_id'] for record in records], [102, 103])
+        self.assertEqual([record['name'] for record in records], ['Vet 2', 'Vet 3'])
+        self.assertEqual([record['clinic'] for record in records], ['Clinic 1', 'Clinic 1'])
+        self.assertEqual([(record['city'], record['state'], record['zip_code']) for record in records],
+                         [('San Jose', 'CA', '95110')] * 2)
+        self.assertEqual([record['phone'] for record in records], [None, '(408) 555-0100'])
+        self.assertEqual([record['website'] for record in records], ['https://clinic1.example.com'] * 2)
+
+    def test_retries(self):
+        """Are failed requests retried with exponential backoff?"""
+
+        with FixtureServer(self.directory.name, flaky=2) as server, self.crawler(backoff=0.5) as crawler:
+            page = crawler.fetch(page_url(1, server.url))
+
+        self.assertEqual([card['fear_free_id'] for card in parse_cards(page.content)], [100, 101])
+        self.assertEqual((server.requests, crawler.retried), (3, 2))
+        self.assertEqual(self.sleeps, [0.5, 1])
+
+    def test_give_up(self):
+        """Is a CrawlError raised when retries run out, or for pages that don't exist?"""
+
+        with FixtureServer(self.directory.name, flaky=5) as server, self.crawler(retries=2) as crawler:
+            with self.assertRaisesRegex(CrawlError, "HTTP 503"):
+                crawler.fetch(page_url(1, server.url))
+            self.assertEqual(server.requests, 3)
+
+            server.flaky = 0
+            with self.assertRaisesRegex(CrawlError, "HTTP 404"):
+                crawler.fetch(page_url(self.pages + 1, server.url))
+            self.assertEqual(server.requests, 4)
+
+    def test_rate_limit(self):
+        """Are requests to a host spaced out, and other hosts not held up?"""
+
+        clock = FakeClock()
+        limiter = HostRateLimiter(rate=4, clock=clock, sleep=clock.sleep)
+        for host in ['a', 'a', 'b', 'a']:
+            limiter.wait(host)
+
+        self.assertEqual(clock.sleeps, [0.25, 0.25])
+        self.assertEqual(clock.now, 0.5)
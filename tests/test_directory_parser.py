@@ -0,0 +1,93 @@
+"""Directory page parser tests, for every installed backend."""
+
+from unittest import TestCase
+
+from directory_parser import BACKENDS, available_backends, backend_available, parse_cards
+from fixture_server import render_listing, render_page
+from scraped_data.webscrape_bs4 import normalize_cards
+
+# Cards the way the directory writes them, with the variations seen in the wild.
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Fear Free Directory</title></head><body>
+<div class="sabai-directory-listings">
+<div id="sabai-entity-content-158695" class="sabai-entity sabai-entity-type-content">
+  <div class="sabai-directory-title"><a href="/l/158695">Dr. Carol  <b>Lah</b> </a></div>
+  <div class="sabai-directory-location">
+    <span class="sabai-googlemaps-address sabai-googlemaps-address-0">
+      1 Main St, San Jose, CA 95110
+    </span>
+  </div>
+  <div class="sabai-directory-contact">
+    <span itemprop="telephone">(408) 555-0100</span>
+    <div class="sabai-directory-contact-website"><a href="http://drlahmobilevet.com/">Website</a></div>
+  </div>
+</div>
+<div id="sabai-entity-content-187121" class="sabai-entity">
+  <div class="sabai-directory-title"><a href="/l/187121">Dr. Audrey Marzan</a></div>
+  <div class="sabai-directory-custom-fields-practice-individual-summary extra">MedVet &amp; Silicon Valley</div>
+  <span class="sabai-googlemaps-address sabai-googlemaps-address-0">Los Gatos, CA</span>
+</div>
+<div id="sabai-entity-content-200001" class="sabai-entity">
+  <a href="/l/200001">Dr. José Núñez &amp; Partners</a>
+  <span class="sabai-googlemaps-address sabai-googlemaps-address-1">Somewhere else</span>
+  <div class="sabai-directory-contact-website"></div>
+</div>
+</div>
+</body></html>
+""".encode()
+
+EXPECTED = [
+    {'fear_free_id': 158695, 'name': 'CarolLah', 'clinic': 'CarolLah',
+     'address': '1 Main St, San Jose, CA 95110', 'phone': '(408) 555-0100', 'website': 'http://drlahmobilevet.com/'},
+    {'fear_free_id': 187121, 'name': 'Audrey Marzan', 'clinic': 'MedVet & Silicon Valley',
+     'address': 'Los Gatos, CA', 'phone': '', 'website': ''},
+    {'fear_free_id': 200001, 'name': 'José Núñez and Partners', 'clinic': 'José Núñez and Partners',
+     'address': '', 'phone': '', 'website': ''},
+]
+
+
+class DirectoryParserTestCase(TestCase):
+
+    def test_backends(self):
+        """Does every installed backend parse every field of every card alike?"""
+
+        self.assertIn('html5lib', available_backends())
+        for backend in BACKENDS:
+            if not backend_available(backend):
+                continue
+            with self.subTest(backend=backend):
+                self.assertEqual(parse_cards(PAGE, backend), EXPECTED)
+                self.assertEqual(parse_cards(PAGE.decode(), backend), EXPECTED)
+                self.assertEqual(parse_cards(render_page([]), backend), [])
+
+    def test_fixture_pages(self):
+        """Do the backends agree on the fixture server's pages?"""
+
+        listings = [{'fear_free_id': i, 'name': f'Vet {i}', 'clinic': f'Clinic {i}' if i % 3 else '',
+                     'address': f'{i} Main St, San Jose, CA 95110', 'phone': '(408) 555-0100' if i % 2 else '',
+                     'website': f'https://clinic{i}.example.com' if i % 4 else ''} for i in range(1, 9)]
+        page = render_page(listings)
+        expected = parse_cards(page, 'html5lib')
+        self.assertEqual([vet['clinic'] for vet in expected[:3]], ['Clinic 1', 'Clinic 2', 'Vet 3'])
+        for backend in available_backends():
+            with self.subTest(backend=backend):
+                self.assertEqual(parse_cards(page, backend), expected)
+        self.assertIn('sabai-entity-content-1"', render_listing(listings[0]))
+
+    def test_normalize_cards(self):
+        """Does the scraper split the cards' addresses into their parts?"""
+
+        records = normalize_cards(parse_cards(PAGE))
+
+        def field(name):
+            return [record[name] for record in records]
+
+        self.assertEqual(field('fear_free_id'), [158695, 187121, 200001])
+        self.assertEqual(field('clinic'), ['CarolLah', 'MedVet & Silicon Valley', 'José Núñez and Partners'])
+        self.assertEqual(field('street_address'), ['1 Main St', None, None])
+        self.assertEqual(field('city'), ['San Jose', 'Los Gatos', None])
+        self.assertEqual((field('state'), field('zip_code')), (['CA', 'CA', None], ['95110', None, None]))
+        self.assertEqual(normalize_cards([]), [])
+
+    def test_unknown_backend(self):
+        self.assertRaisesRegex(ValueError, "Unknown parser backend", parse_cards, PAGE, 'regex')
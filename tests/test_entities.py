@@ -0,0 +1,73 @@
+"""Entity resolution tests."""
+
+from unittest import TestCase
+
+from entities import ListingResolver, Resolver, clinic_weights, similarity, street_number, vet_weights
+
+
+def record(fear_free_id, name, clinic, street_address='1 Main St', city='San Jose', zip_code='95110'):
+    return {'fear_free_id': fear_free_id, 'name': name, 'clinic': clinic, 'street_address': street_address,
+            'city': city, 'zip_code': zip_code}
+
+
+class EntitiesTestCase(TestCase):
+
+    def resolve_clinics(self, *records):
+        resolver = ListingResolver()
+        return [resolver.clinic(record)[0] for record in records]
+
+    def test_similarity(self):
+        """Do generic words count for little, and punctuation, titles and initials not at all?"""
+
+        self.assertEqual(similarity(clinic_weights('VCA San Jose'), clinic_weights('VCA Animal Hospital San Jose')),
+                         3 / 3.5)
+        self.assertEqual(similarity(clinic_weights("Dr. Lee's Pet Clinic"), clinic_weights('DR LEES PET CLINIC')),
+                         1.0)
+        self.assertLess(similarity(clinic_weights('Pet Hospital'), clinic_weights('Pet Hospital of Almaden')), 0.5)
+        self.assertEqual(vet_weights('Dr. Jane A. Smith, DVM'), vet_weights('jane smith'))
+        self.assertEqual(similarity({}, {}), 0.0)
+        self.assertEqual((street_number(' 1200 Main St'), street_number('Suite 5')), ('1200', None))
+
+    def test_clinics(self):
+        """Are listings of a clinic under different names merged, and different clinics kept apart?"""
+
+        self.assertEqual(self.resolve_clinics(
+            record(1, 'A', 'VCA San Jose'),
+            record(2, 'B', 'Blossom Hill Animal Hospital', '20 Oak Ave'),
+            record(3, 'C', 'VCA Animal Hospital San Jose'),
+            record(4, 'D', 'Blossom Valley Animal Hospital', '20 Oak Ave'),
+            record(5, 'E', 'VCA San Jose', zip_code='95112'),
+            record(6, 'F', 'VCA San Jose', '2 Main St'),
+            record(7, 'G', 'vca  san jose', zip_code=None),
+            record(8, 'H', 'VCA - San Jose', zip_code=None, city='S. San Jose'),
+        ), [1, 2, 1, 3, 4, 5, 6, 7])
+
+        # With neither a zip code nor a city, only the same names are the same clinic.
+        self.assertEqual(self.resolve_clinics(
+            record(1, 'A', 'VCA San Jose', city=None, zip_code=None),
+            record(2, 'B', 'VCA Animal Hospital San Jose', city=None, zip_code=None),
+            record(3, 'C', 'VCA San Jose, Inc.', city=None, zip_code=None),
+        ), [1, 2, 1])
+
+    def test_vets(self):
+        """Are vets listed twice, by their id or under their clinic, merged?"""
+
+        resolver = ListingResolver()
+        vets = [(1, 'Jane Smith'), (2, 'John Smith'), (3, 'Dr. Jane A. Smith, DVM'), (1, 'Jane Smith-Lee'),
+                (4, 'Jane Smith')]
+        self.assertEqual([resolver.vet(record(fear_free_id, name, 'VCA'), clinic_id)
+                          for clinic_id, (fear_free_id, name) in zip((1, 1, 1, 2, 2), vets)],
+                         [(1, True), (2, True), (1, False), (1, False), (3, True)])
+        self.assertEqual((len(resolver.vets), resolver.vets.listings), (3, 5))
+
+    def test_blocking(self):
+        """Is each listing scored against the entities in its block sharing a distinctive word only?"""
+
+        resolver = Resolver(0.75)
+        for i in range(100):
+            resolver.resolve('95110', clinic_weights(f'Clinic {i} Animal Hospital'))
+        self.assertEqual(resolver.candidates('95110', clinic_weights('Clinic 7 Animal Hospital')), [8])
+        self.assertEqual(resolver.candidates('95111', clinic_weights('Clinic 7 Animal Hospital')), [])
+        # Names of generic words only are blocked on those.
+        resolver.resolve('95110', clinic_weights('Animal Hospital'))
+        self.assertEqual(resolver.resolve('95110', clinic_weights('The Animal Hospital')), (101, False))
@@ -99,4 +99,17 @@ class FavoriteModelTestCase(TestCase):
 
             # Now there should be no favorite vet again.
             self.assertEqual(len(user.favorites), 0)
-            
\ No newline at end of file
+            
+    def test_favorites_version(self):
+        """Is the user's favorites version bumped by every favorite added or removed?"""
+
+        with app.app_context():
+            f1 = Favorite(user_id=self.uid, vet_id=self.vid)
+            db.session.add(f1)
+            db.session.commit()
+            self.assertEqual(db.session.get(User, self.uid).favorites_version, 1)
+
+            db.session.delete(f1)
+            db.session.commit()
+            db.session.expire_all()
+            self.assertEqual(db.session.get(User, self.uid).favorites_version, 2)
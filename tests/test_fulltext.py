@@ -0,0 +1,129 @@
+"""Full-text search tests."""
+
+from app import app
+import os
+from unittest import TestCase
+
+from sqlalchemy import text
+
+from models import db, User, Clinic, Vet, Review
+from fulltext import fts5_query, highlight, search_vets_fulltext, rebuild_search_table, COMMENTS_MAX_LENGTH
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+os.environ['DATABASE_URL'] = "postgresql:///baffv-test"
+
+
+class FullTextSearchTestCase(TestCase):
+    """Test full-text search over vets, clinics and reviews."""
+
+    def setUp(self):
+        """Add sample data."""
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            user = User.signup(first_name='test', last_name='user1', username="testuser1",
+                               email="test1@test.com", password="testuser1")
+            cats = Clinic(name='Cat Hospital', city='Test City', state='TS', zip_code='12345')
+            dogs = Clinic(name='Dog Clinic', city='Test City', state='TS', zip_code='12345')
+            db.session.add_all([cats, dogs])
+            db.session.commit()
+
+            felix = Vet(name='Felix Whisker', clinic_id=cats.id, fear_free_id=1)
+            rex = Vet(name='Rex Barker', clinic_id=dogs.id, fear_free_id=2)
+            db.session.add_all([felix, rex])
+            db.session.commit()
+            self.felix_id, self.rex_id, self.uid = felix.id, rex.id, user.id
+
+            db.session.add(Review(user_id=user.id, vet_id=rex.id, rating=5,
+                                  comment="Wonderful with our anxious dog, very patient."))
+            db.session.commit()
+
+    def tearDown(self):
+        """Clean up after each test."""
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+
+    def test_fts5_query(self):
+        """Is user input turned into a safe FTS5 query?"""
+
+        self.assertEqual(fts5_query('cat-only'), '"cat" "only"')
+        self.assertEqual(fts5_query('"anxious" OR dog*'), '"anxious" "OR" "dog"')
+        self.assertEqual(fts5_query('!!!'), '')
+
+    def test_highlight(self):
+        """Are snippets escaped and matches wrapped in <mark>?"""
+
+        self.assertEqual(highlight('<b>\x02dog\x03</b>'), '&lt;b&gt;<mark>dog</mark>&lt;/b&gt;')
+
+    def test_search_names_and_reviews(self):
+        """Can we find vets by their name, their clinic and their reviews?"""
+
+        with app.app_context():
+            results = search_vets_fulltext('anxious dog')
+            self.assertEqual([vet.id for vet, clinic, rank, snippet in results], [self.rex_id])
+            self.assertIn('<mark>anxious</mark>', results[0][3])
+            self.assertEqual(results[0][1].name, 'Dog Clinic')
+
+            self.assertEqual([r[0].id for r in search_vets_fulltext('whisker')], [self.felix_id])
+            self.assertEqual([r[0].id for r in search_vets_fulltext('hospital')], [self.felix_id])
+            self.assertEqual(search_vets_fulltext('parrot'), [])
+
+    def test_index_stays_current(self):
+        """Is the index updated when reviews and clinics change, and can it be rebuilt?"""
+
+        with app.app_context():
+            review = Review(user_id=self.uid, vet_id=self.felix_id, rating=4, comment="Great for cat-only homes")
+            db.session.add(review)
+            db.session.commit()
+            self.assertEqual([r[0].id for r in search_vets_fulltext('cat-only')], [self.felix_id])
+
+            db.session.delete(review)
+            db.session.commit()
+            self.assertEqual(search_vets_fulltext('homes'), [])
+
+            clinic = Clinic.query.filter_by(name='Dog Clinic').one()
+            clinic.name = 'Canine Center'
+            db.session.commit()
+            self.assertEqual([r[0].id for r in search_vets_fulltext('canine')], [self.rex_id])
+
+            rebuild_search_table()
+            self.assertEqual([r[0].id for r in search_vets_fulltext('patient')], [self.rex_id])
+
+    def test_comments_capped(self):
+        """Are only a vet's newest comments indexed, up to COMMENTS_MAX_LENGTH characters?"""
+
+        def indexed_comments():
+            vet_id = 'vet_id' if db.engine.dialect.name == 'postgresql' else 'rowid'
+            return db.session.execute(text(f"SELECT comments FROM vet_search WHERE {vet_id} = :id"),
+                                      {'id': self.rex_id}).scalar()
+
+        filler = 'lorem ' * (COMMENTS_MAX_LENGTH // 6)
+        with app.app_context():
+            db.session.add(Review(user_id=self.uid, vet_id=self.rex_id, rating=4, comment=filler))
+            db.session.add(Review(user_id=self.uid, vet_id=self.rex_id, rating=4, comment="Gentle with ferrets"))
+            db.session.commit()
+            self.assertEqual(len(indexed_comments()), COMMENTS_MAX_LENGTH)
+            self.assertEqual([r[0].id for r in search_vets_fulltext('ferrets')], [self.rex_id])
+            self.assertEqual(search_vets_fulltext('patient'), [])
+
+            rebuild_search_table()
+            self.assertEqual(len(indexed_comments()), COMMENTS_MAX_LENGTH)
+            self.assertEqual([r[0].id for r in search_vets_fulltext('ferrets')], [self.rex_id])
+            self.assertEqual(search_vets_fulltext('patient'), [])
+
+    def test_fulltext_api(self):
+        """Does the API return ranked vets with snippets?"""
+
+        with app.test_client() as c:
+            resp = c.get('/api/vets/fulltext', query_string={'q': 'patient'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json['vets'][0]['name'], 'Rex Barker')
+            self.assertIn('<mark>patient</mark>', resp.json['vets'][0]['snippet'])
+
+            resp = c.get('/api/vets/fulltext', query_string={'q': ''})
+            self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,122 @@
+"""Geocoding and radius search tests."""
+
+from app import app
+import os
+from unittest import TestCase
+
+from models import db, Clinic, Vet
+from geo import geocode, haversine_miles, SpatialGrid, spatial_index
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+os.environ['DATABASE_URL'] = "postgresql:///baffv-test"
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class GeoTestCase(TestCase):
+    """Test geocoding and the spatial grid."""
+
+    def test_geocode(self):
+        """Do we get coordinates from the zip code, or else from the city?"""
+
+        lat, lon = geocode('95110')
+        self.assertAlmostEqual(lat, 37.34, places=1)
+        self.assertAlmostEqual(lon, -121.91, places=1)
+
+        lat, lon = geocode(None, 'San Jose', 'CA')
+        self.assertAlmostEqual(lat, 37.3, places=0)
+
+        self.assertEqual(geocode('00000'), (None, None))
+        self.assertEqual(geocode(None, 'Nowhere', 'CA'), (None, None))
+
+        # Without a state, the largest city of the name.
+        self.assertAlmostEqual(geocode(None, 'Portland')[1], -122.7, places=0)
+        self.assertAlmostEqual(geocode(None, 'Portland', 'me')[1], -70.3, places=0)
+
+    def test_spatial_grid(self):
+        """Does the grid return points within the radius, closest first?"""
+
+        grid = SpatialGrid()
+        grid.insert('sj', 37.3422, -121.9068)
+        grid.insert('sj2', 37.3483, -121.8813)
+        grid.insert('sf', 37.7599, -122.4148)
+        self.assertEqual(len(grid), 3)
+
+        found = grid.within(37.3422, -121.9068, 5)
+        self.assertEqual([key for _, key in found], ['sj', 'sj2'])
+        self.assertAlmostEqual(found[1][0], haversine_miles(37.3422, -121.9068, 37.3483, -121.8813))
+
+        self.assertEqual([key for _, key in grid.within(37.3422, -121.9068, 50)], ['sj', 'sj2', 'sf'])
+
+
+class RadiusSearchTestCase(TestCase):
+    """Test radius searches."""
+
+    def setUp(self):
+        """Add sample data."""
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            near = Clinic(name='Near Clinic', city='San Jose', state='CA', zip_code='95112')
+            far = Clinic(name='Far Clinic', city='San Francisco', state='CA', zip_code='94110')
+            db.session.add_all([near, far])
+            db.session.commit()
+
+            db.session.add_all([Vet(name='Near Vet', clinic_id=near.id, fear_free_id=1),
+                                Vet(name='Far Vet', clinic_id=far.id, fear_free_id=2)])
+            db.session.commit()
+            self.near_lat = near.latitude
+
+    def tearDown(self):
+        """Clean up after each test."""
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+
+    def test_clinics_geocoded(self):
+        """Are clinics geocoded when they are added?"""
+
+        self.assertIsNotNone(self.near_lat)
+
+    def test_radius_search(self):
+        """Does a radius search find vets in nearby zip codes?"""
+
+        with app.app_context():
+            found = spatial_index.vets_near(5, zipcode='95110')
+            self.assertEqual(len(found), 1)
+
+        with app.test_client() as c:
+            resp = c.post('/results', data={'zipcode_or_city': '95110', 'radius': 5}, follow_redirects=True)
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Near Vet', html)
+            self.assertNotIn('Far Vet', html)
+            self.assertIn(' mi)', html)
+
+            resp = c.post('/results', data={'zipcode_or_city': 'San Jose', 'radius': 50}, follow_redirects=True)
+            html = resp.get_data(as_text=True)
+            self.assertIn('Near Vet', html)
+            self.assertIn('Far Vet', html)
+            self.assertLess(html.index('Near Vet'), html.index('Far Vet'))
+
+            # A city is placed in the state typed, or else the one its clinics are in.
+            with app.app_context():
+                maine = Clinic(name='Maine Clinic', city='Portland', state='ME', zip_code='04101')
+                db.session.add(maine)
+                db.session.commit()
+                db.session.add(Vet(name='Maine Vet', clinic_id=maine.id, fear_free_id=3))
+                db.session.commit()
+            for search_area in ['Portland', 'Portland, ME']:
+                resp = c.post('/results', data={'zipcode_or_city': search_area, 'radius': 5}, follow_redirects=True)
+                self.assertIn('Maine Vet', resp.get_data(as_text=True))
+            resp = c.post('/results', data={'zipcode_or_city': 'Portland, OR', 'radius': 5}, follow_redirects=True)
+            self.assertIn('Did NOT find any matches', resp.get_data(as_text=True))
+
+            # Without a radius only exact matches are shown.
+            resp = c.post('/results', data={'zipcode_or_city': '95110', 'radius': 0}, follow_redirects=True)
+            self.assertIn('Did NOT find any matches', resp.get_data(as_text=True))
@@ -0,0 +1,220 @@
+"""Incremental scraped data loader tests."""
+
+from app import app
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from sqlalchemy import inspect
+
+from models import db, User, Clinic, Vet, Review, Favorite
+from addresses import normalize_zip_code
+from loader import clinic_key, read_scraped, sync_scraped_data, ingest_scraped
+from fulltext import search_vets_fulltext
+from search import location_index
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+os.environ['DATABASE_URL'] = "postgresql:///baffv-test"
+
+CLINICS_CSV = """name,street_address,city,state,zip_code,phone,website
+SJ Clinic,1 Main St,San Jose,CA,95110.0,,http://sj.example.com
+SF Clinic,,San Francisco,CA,94110,(415) 555-0100,
+"""
+
+# The same clinic as the first one, written differently.
+DUPLICATE_CLINIC = "SJ  clinic,1 Main St,San Jose,CA,95110,,\n"
+
+VETS_CSV = """name,fear_free_id,clinic_id
+Vet One,101,1
+Vet Two,102,1
+Vet Three,103,2
+"""
+
+
+class NormalizeTestCase(TestCase):
+    """Test zip code and clinic key normalization."""
+
+    def test_normalize_zip_code(self):
+        self.assertEqual(normalize_zip_code('95110'), '95110')
+        self.assertEqual(normalize_zip_code('95110.0'), '95110')
+        self.assertEqual(normalize_zip_code(' 95110-1234 '), '95110')
+        self.assertEqual(normalize_zip_code('2134'), '02134')
+        self.assertIsNone(normalize_zip_code(''))
+        self.assertIsNone(normalize_zip_code(None))
+        self.assertIsNone(normalize_zip_code('n/a'))
+
+    def test_clinic_key(self):
+        """Do differently written names of the same clinic get the same key?"""
+
+        self.assertEqual(clinic_key('Paws & Claws Vet', 'S. San Francisco', '94080.0'),
+                         clinic_key('PAWS AND CLAWS VET', 'South San Francisco', '94080'))
+        self.assertNotEqual(clinic_key('Banfield', 'San Jose', '95110'), clinic_key('Banfield', 'San Jose', '95112'))
+
+
+class LoaderTestCase(TestCase):
+    """Test diffing scraped clinics and vets against the database."""
+
+    def setUp(self):
+        """Write sample CSVs and create empty tables."""
+
+        self.tmp = TemporaryDirectory()
+        self.clinics_path = os.path.join(self.tmp.name, 'clinics.csv')
+        self.vets_path = os.path.join(self.tmp.name, 'vets.csv')
+        self.write(CLINICS_CSV, VETS_CSV)
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+    def tearDown(self):
+        """Clean up after each test."""
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+        self.tmp.cleanup()
+
+    def write(self, clinics, vets):
+        with open(self.clinics_path, 'w') as f:
+            f.write(clinics)
+        with open(self.vets_path, 'w') as f:
+            f.write(vets)
+
+    def sync(self):
+        return dict(sync_scraped_data(*read_scraped(self.clinics_path, self.vets_path), batch_size=2))
+
+    def test_read_rejects(self):
+        """Are phone numbers and websites normalized, and values that aren't dropped and reported?"""
+
+        self.write(CLINICS_CSV + "Bad Clinic,,Davis,DA,95618,555-0100,WWW.Bad.example.com\n", VETS_CSV)
+        rejects = []
+        clinics, vets = read_scraped(self.clinics_path, self.vets_path, rejects)
+        self.assertEqual((clinics[1]['phone'], clinics[2]['website']), ('(415) 555-0100', 'http://www.bad.example.com'))
+        self.assertEqual((clinics[2]['state'], clinics[2]['phone']), (None, None))
+        self.assertEqual(sorted((reject['row'], reject['name'], reject['field']) for reject in rejects),
+                         [(3, 'Bad Clinic', 'phone'), (3, 'Bad Clinic', 'state')])
+
+    def test_initial_load(self):
+        """Are all clinics and vets inserted on an empty database, and nothing on a second run?"""
+
+        with app.app_context():
+            stats = self.sync()
+            self.assertEqual(stats['clinics_inserted'], 2)
+            self.assertEqual(stats['vets_inserted'], 3)
+
+            sj = Clinic.query.filter_by(name='SJ Clinic').one()
+            self.assertEqual(sj.zip_code, '95110')
+            self.assertIsNone(sj.phone)
+            self.assertIsNotNone(sj.latitude)
+            self.assertEqual(sorted(vet.fear_free_id for vet in sj.vets), [101, 102])
+
+            self.assertFalse(any(self.sync().values()))
+
+    def test_refresh(self):
+        """Are changed vets updated, missing ones retired and returning ones reactivated, keeping reviews?"""
+
+        with app.app_context():
+            self.sync()
+            user = User.signup(first_name='test', last_name='user', username='testuser',
+                               email='test@test.com', password='testuser')
+            db.session.commit()
+            vet_two = Vet.query.filter_by(fear_free_id=102).one()
+            db.session.add_all([Review(user_id=user.id, vet_id=vet_two.id, rating=4, comment='Good'),
+                                Favorite(user_id=user.id, vet_id=vet_two.id)])
+            db.session.commit()
+            vet_two_id = vet_two.id
+
+            # Vet One is renamed, Vet Two moves to SF Clinic, Vet Three leaves.
+            self.write(CLINICS_CSV, "name,fear_free_id,clinic_id\nVet One DVM,101,1\nVet Two,102,2\n")
+            self.assertEqual(self.sync(), {'vets_updated': 2, 'vets_retired': 1, 'clinics_retired': 0})
+
+            db.session.expire_all()
+            vet_two = db.session.get(Vet, vet_two_id)
+            self.assertEqual(vet_two.clinic.name, 'SF Clinic')
+            self.assertEqual(len(vet_two.reviews), 1)
+            self.assertEqual(Favorite.query.count(), 1)
+            self.assertEqual(Clinic.query.filter_by(name='SF Clinic').one().review_count, 1)
+            self.assertEqual(Clinic.query.filter_by(name='SJ Clinic').one().review_count, 0)
+
+            vet_three = Vet.query.filter_by(fear_free_id=103).one()
+            self.assertFalse(vet_three.active)
+            self.assertNotIn(vet_three.id, location_index.lookup(city='san francisco'))
+            self.assertIn(vet_two_id, location_index.lookup(city='san francisco'))
+
+            self.write(CLINICS_CSV, VETS_CSV)
+            self.assertEqual(self.sync(), {'vets_updated': 2, 'vets_reactivated': 1, 'vets_retired': 0,
+                                           'clinics_retired': 0})
+            self.assertTrue(db.session.get(Vet, vet_three.id).active)
+
+    def test_clinic_changes(self):
+        """Are changed clinic details updated in place, matching clinics added through the ORM?"""
+
+        with app.app_context():
+            db.session.add(Clinic(name='SJ Clinic', city='San Jose', state='CA', zip_code='95110'))
+            db.session.commit()
+
+            stats = self.sync()
+            self.assertEqual((stats['clinics_inserted'], stats['clinics_updated']), (1, 1))
+            self.assertEqual(Clinic.query.count(), 2)
+            self.assertEqual(Clinic.query.filter_by(name='SJ Clinic').one().website, 'http://sj.example.com')
+
+    def test_clinic_renamed(self):
+        """Is a clinic listed under a new name inserted, with its vets, and the row under its old name retired?"""
+
+        with app.app_context():
+            self.sync()
+            renamed = CLINICS_CSV.replace('SJ Clinic', 'SJ Animal Clinic')
+            self.write(renamed, VETS_CSV)
+            stats = self.sync()
+            self.assertEqual((stats['clinics_inserted'], stats['clinics_retired'], stats['vets_updated']), (1, 1, 2))
+
+            old = Clinic.query.filter_by(name='SJ Clinic').one()
+            new = Clinic.query.filter_by(name='SJ Animal Clinic').one()
+            self.assertFalse(old.active)
+            self.assertEqual(old.vets, [])
+            self.assertTrue(new.active)
+            self.assertEqual(sorted(vet.fear_free_id for vet in new.vets), [101, 102])
+            self.assertEqual(self.sync()['clinics_retired'], 0)
+
+            self.write(CLINICS_CSV, VETS_CSV)
+            stats = self.sync()
+            self.assertEqual((stats['clinics_reactivated'], stats['clinics_retired']), (1, 1))
+            self.assertTrue(db.session.get(Clinic, old.id).active)
+
+    def test_ingest(self):
+        """Are the CSVs streamed into empty tables with normalized zip codes, keys and locations?"""
+
+        self.write(CLINICS_CSV + DUPLICATE_CLINIC, VETS_CSV + "Vet Four,104,3\n")
+        reported = {}
+        with app.app_context():
+            ingest_scraped(self.clinics_path, self.vets_path, chunk_size=2,
+                           report=lambda table, rows, seconds: reported.update({table: rows}))
+            self.assertEqual(reported, {'clinics': 3, 'vets': 4, 'search table': None})
+
+            sj = db.session.get(Clinic, 1)
+            self.assertEqual((sj.name, sj.zip_code, sj.phone), ('SJ Clinic', '95110', None))
+            self.assertEqual(sj.source_key, clinic_key('SJ Clinic', 'San Jose', '95110'))
+            self.assertIsNotNone(sj.latitude)
+            self.assertEqual(sj.review_count, 0)
+            self.assertIsNone(db.session.get(Clinic, 3).source_key)
+            self.assertEqual(Vet.query.filter_by(fear_free_id=103).one().clinic.name, 'SF Clinic')
+            self.assertEqual(location_index.lookup(zipcode='95110'), [1, 2, 4])
+            self.assertEqual([vet.fear_free_id for vet, *rest in search_vets_fulltext('SF Clinic')], [103])
+
+            # The indexes dropped for the load are back.
+            indexes = {index['name'] for index in inspect(db.engine).get_indexes('vets')}
+            self.assertTrue({'ix_vets_clinic_id', 'ix_vets_name_id'} <= indexes)
+
+            # New rows get ids after the loaded ones, and the search triggers are back on.
+            vt = Vet(name='New Vet', clinic_id=2, fear_free_id=105)
+            db.session.add(vt)
+            db.session.commit()
+            self.assertEqual(vt.id, 5)
+            self.assertEqual([vet.id for vet, *rest in search_vets_fulltext('New Vet')], [5])
+
+            self.assertRaises(ValueError, ingest_scraped, self.clinics_path, self.vets_path)
+
+            # A refresh moves the vet of the duplicate clinic to the first one.
+            self.assertEqual(self.sync(), {'vets_updated': 1, 'vets_retired': 1, 'clinics_retired': 0})
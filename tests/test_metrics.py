@@ -0,0 +1,148 @@
+"""Request metrics tests."""
+
+from app import app
+import os
+import re
+from unittest import TestCase
+
+from flask import g
+from sqlalchemy.exc import DBAPIError
+
+from models import db, Clinic, Vet
+from metrics import Histogram, format_labels, metrics
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+os.environ['DATABASE_URL'] = "postgresql:///baffv-test"
+
+
+def sample(text, name, **labels):
+    """Value of the sample with the given name and labels (0 if missing) in a /metrics page."""
+
+    for line in text.splitlines():
+        match = re.match(r'([a-z_]+)(\{.*\})? (\S+)$', line)
+        if match and match.group(1) == name and all(f'{key}="{value}"' in (match.group(2) or '')
+                                                    for key, value in labels.items()):
+            return float(match.group(3))
+    return 0
+
+
+class HistogramTestCase(TestCase):
+    """Test the Prometheus histogram and label formatting."""
+
+    def test_cumulative_buckets(self):
+        """Are bucket counts cumulative, with everything in +Inf?"""
+
+        hist = Histogram((0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3):
+            hist.observe(value)
+
+        self.assertEqual(list(hist.samples()), [('0.1', 1), ('1.0', 3), ('+Inf', 4)])
+        self.assertEqual(hist.count, 4)
+        self.assertAlmostEqual(hist.sum, 4.25)
+
+    def test_label_escaping(self):
+        """Are quotes, backslashes and newlines escaped in label values?"""
+
+        self.assertEqual(format_labels([('a', 'x"y\\z\n')]), r'{a="x\"y\\z\n"}')
+
+
+class MetricsViewTestCase(TestCase):
+    """Test the /metrics endpoint."""
+
+    def setUp(self):
+        """Add sample data."""
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            cln = Clinic(name='Test Clinic', city='Test City', state='TS', zip_code='12345')
+            db.session.add(cln)
+            db.session.commit()
+            vt = Vet(name='Test Vet', clinic_id=cln.id, fear_free_id=1)
+            db.session.add(vt)
+            db.session.commit()
+            self.vid = vt.id
+
+    def tearDown(self):
+        """Clean up after each test."""
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+
+    def test_request_metrics(self):
+        """Are requests counted with their latency, SQL statements, render time and size?"""
+
+        with app.test_client() as client:
+            before = client.get('/metrics').get_data(as_text=True)
+            resp = client.get(f'/vets/{self.vid}')
+            self.assertEqual(resp.status_code, 200)
+            after = client.get('/metrics').get_data(as_text=True)
+
+        def delta(name, **labels):
+            return sample(after, name, **labels) - sample(before, name, **labels)
+
+        self.assertEqual(delta('http_requests_total', endpoint='vet_profile', method='GET', status='200'), 1)
+        self.assertEqual(delta('http_request_duration_seconds_count', endpoint='vet_profile'), 1)
+        self.assertEqual(delta('http_request_duration_seconds_bucket', endpoint='vet_profile', le='+Inf'), 1)
+        self.assertGreater(delta('http_request_duration_seconds_sum', endpoint='vet_profile'), 0)
+        self.assertEqual(delta('db_statements_total', endpoint='vet_profile'), 2)
+        self.assertGreater(delta('db_statement_seconds_total', endpoint='vet_profile'), 0)
+        self.assertGreater(delta('template_render_seconds_total', endpoint='vet_profile'), 0)
+        self.assertEqual(delta('http_response_size_bytes_sum', endpoint='vet_profile'), len(resp.data))
+
+    def test_failed_statement(self):
+        """Is a statement that fails counted too, without leaving its start time behind?"""
+
+        with app.test_request_context('/'):
+            app.preprocess_request()
+            with db.engine.connect() as conn:
+                with self.assertRaises(DBAPIError):
+                    conn.exec_driver_sql('SELECT * FROM no_such_table')
+                self.assertEqual(conn.info['metrics_statement_starts'], [])
+            self.assertEqual(g.metrics['sql_statements'], 1)
+
+    def test_unmatched_and_status(self):
+        """Are 404s of unknown urls grouped under one label?"""
+
+        with app.test_client() as client:
+            before = client.get('/metrics').get_data(as_text=True)
+            client.get('/no/such/page')
+            client.get('/no/other/page')
+            after = client.get('/metrics').get_data(as_text=True)
+
+        labels = dict(endpoint='unmatched', method='GET', status='404')
+        self.assertEqual(sample(after, 'http_requests_total', **labels)
+                         - sample(before, 'http_requests_total', **labels), 2)
+
+    def test_format(self):
+        """Is the page valid Prometheus text with cache and pool metrics?"""
+
+        with app.test_client() as client:
+            client.get('/metrics')
+            resp = client.get('/metrics')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+        text = resp.get_data(as_text=True)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('# TYPE search_cache_hits_total counter', text)
+        self.assertIn('search_cache_entries{pid=', text)
+        self.assertIn(f'http_requests_total{{pid="{os.getpid()}",endpoint="metrics"', text)
+        for line in text.splitlines():
+            if not line.startswith('#'):
+                self.assertRegex(line, r'^[a-z_]+(\{.*\})? -?[0-9.e+-]+$|^[a-z_]+(\{.*\})? \+Inf$')
+
+    def test_token(self):
+        """Does /metrics take only the METRICS_TOKEN bearer token, when one is set?"""
+
+        metrics.token = 'secret'
+        try:
+            with app.test_client() as client:
+                self.assertEqual(client.get('/metrics').status_code, 401)
+                self.assertEqual(client.get('/metrics', headers={'Authorization': 'Bearer guess'}).status_code, 401)
+                self.assertEqual(client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code, 200)
+        finally:
+            metrics.token = app.config['METRICS_TOKEN']
@@ -0,0 +1,82 @@
+"""Page cache tests, crawling the local fixture server."""
+
+from tempfile import TemporaryDirectory
+from unittest import TestCase, mock
+
+from crawler import Crawler, CrawlError
+from fixture_server import FixtureServer, save_directory_pages
+from page_cache import PageCache
+from scraped_data import webscrape_bs4
+from scraped_data.webscrape_bs4 import page_url, parse_page
+
+LISTINGS = [{'fear_free_id': 100 + i, 'name': f'Vet {i}', 'clinic': f'Clinic {i}',
+             'address': f'{i} Main St, San Jose, CA 95110', 'phone': '', 'website': ''}
+            for i in range(6)]
+
+
+class PageCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.pages_dir = TemporaryDirectory()
+        self.cache_dir = TemporaryDirectory()
+        self.pages = save_directory_pages(self.pages_dir.name, LISTINGS, per_page=2)
+
+    def tearDown(self):
+        self.pages_dir.cleanup()
+        self.cache_dir.cleanup()
+
+    def crawl(self, server, **kwargs):
+        """[(ids, changed)] of every page, crawled with a freshly opened cache."""
+
+        with Crawler(rate=None, cache=PageCache(self.cache_dir.name), **kwargs) as crawler:
+            urls = [page_url(page, server.url) for page in range(1, self.pages + 1)]
+            results = [([card['fear_free_id'] for card in parse_page(page, crawler.cache)], page.changed)
+                       for page in crawler.crawl(urls)]
+        return crawler, results
+
+    def test_conditional_refetch(self):
+        """Are unchanged pages re-fetched with 304s, and changed ones downloaded again?"""
+
+        with FixtureServer(self.pages_dir.name) as server:
+            crawler, results = self.crawl(server)
+            self.assertEqual(results, [([100, 101], True), ([102, 103], True), ([104, 105], True)])
+            self.assertEqual(server.not_modified, 0)
+            full_size = server.bytes_sent
+
+            crawler, results = self.crawl(server)
+            self.assertEqual(results, [([100, 101], False), ([102, 103], False), ([104, 105], False)])
+            self.assertEqual((server.not_modified, crawler.not_modified, crawler.bytes_downloaded), (3, 3, 0))
+            self.assertEqual(server.bytes_sent, full_size)
+
+            save_directory_pages(self.pages_dir.name, LISTINGS[:2] + LISTINGS[:1] + LISTINGS[3:], per_page=2)
+            crawler, results = self.crawl(server)
+            self.assertEqual(results, [([100, 101], False), ([100, 103], True), ([104, 105], False)])
+            self.assertEqual(crawler.not_modified, 2)
+
+    def test_skip_parsing(self):
+        """Is a body parsed only once, however many times it's fetched?"""
+
+        with FixtureServer(self.pages_dir.name) as server:
+            with mock.patch.object(webscrape_bs4, 'parse_cards', wraps=webscrape_bs4.parse_cards) as parse:
+                self.crawl(server)
+                self.crawl(server)
+                # Without validators, bodies are downloaded again but not parsed.
+                with mock.patch.object(PageCache, 'validators', return_value={}):
+                    crawler, results = self.crawl(server)
+        self.assertEqual(parse.call_count, 3)
+        self.assertEqual(crawler.bytes_downloaded, server.bytes_sent // 2)
+        self.assertEqual([changed for ids, changed in results], [False] * 3)
+
+    def test_replay(self):
+        """Does a replay read every page from the cache without the server?"""
+
+        with FixtureServer(self.pages_dir.name) as server:
+            self.crawl(server)
+        crawler, results = self.crawl(server, replay=True)
+        self.assertEqual([ids for ids, changed in results], [[100, 101], [102, 103], [104, 105]])
+        self.assertEqual(crawler.requests, 0)
+
+        with Crawler(cache=PageCache(self.cache_dir.name), replay=True) as crawler:
+            with self.assertRaisesRegex(CrawlError, "not in the cache"):
+                crawler.fetch(page_url(self.pages + 1, server.url))
+        self.assertRaises(ValueError, Crawler, replay=True)
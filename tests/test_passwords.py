@@ -0,0 +1,139 @@
+"""Password hashing tests."""
+
+from app import app, CURR_USER_KEY
+import os
+import threading
+from unittest import TestCase
+
+from models import db, User
+from passwords import PasswordHasher, PasswordHasherBusy, hash_rounds, password_hasher
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+os.environ['DATABASE_URL'] = "postgresql:///baffv-test"
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PasswordHasherTestCase(TestCase):
+
+    def test_hash_and_check(self):
+        """Do hashes made in the pool check out, inline or in the pool?"""
+
+        pool = PasswordHasher(rounds=4, workers=1)
+        inline = PasswordHasher(rounds=5, workers=0)
+        try:
+            pw_hash = pool.hash('secret')
+            self.assertEqual(hash_rounds(pw_hash), 4)
+            self.assertTrue(inline.check(pw_hash, 'secret'))
+            self.assertFalse(pool.check(pw_hash, 'Secret'))
+            self.assertFalse(pool.check('not a hash', 'secret'))
+            self.assertTrue(inline.needs_rehash(pw_hash))
+            self.assertFalse(pool.needs_rehash(pw_hash))
+            with self.assertRaises(ValueError):
+                pool.hash('')
+        finally:
+            pool.shutdown()
+
+    def test_busy(self):
+        """When hashes are already waiting for the pool, does the next one fail right away?"""
+
+        hasher = PasswordHasher(rounds=4, workers=1, max_pending=1)
+        for _ in range(2):
+            hasher._slots.acquire()
+        with self.assertRaises(PasswordHasherBusy):
+            hasher.hash('password')
+        hasher._slots.release()
+        try:
+            self.assertEqual(hash_rounds(hasher.hash('password')), 4)
+        finally:
+            hasher.shutdown()
+        self.assertEqual(hasher.stats()['rejected'], 1)
+
+    def test_timeout(self):
+        """Does a hash that timed out keep its slot until it's done, rather than letting more work queue up?"""
+
+        hasher = PasswordHasher(rounds=4, workers=1, max_pending=0, timeout=0.001)
+        try:
+            # Starting the pool alone takes longer than that.
+            with self.assertRaises(PasswordHasherBusy):
+                hasher.hash('password')
+            with self.assertRaisesRegex(PasswordHasherBusy, 'already being hashed'):
+                hasher.hash('password')
+            hasher.shutdown()
+            hasher.timeout = 10
+            self.assertEqual(hash_rounds(hasher.hash('password')), 4)
+        finally:
+            hasher.shutdown()
+        self.assertEqual(hasher.stats()['rejected'], 2)
+
+    def test_stats_from_threads(self):
+        """Are the checks of concurrent requests all counted?"""
+
+        hasher = PasswordHasher(rounds=4, workers=0)
+        pw_hash = hasher.hash('password')
+
+        def check():
+            for _ in range(50):
+                hasher.check(pw_hash, 'password')
+
+        threads = [threading.Thread(target=check) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(hasher.stats()['checked'], 400)
+
+
+class LoginTestCase(TestCase):
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            password_hasher.rounds = 4
+            User.signup('Test', 'User', 'testuser', 'test@test.com', 'password')
+            db.session.commit()
+
+    def tearDown(self):
+        password_hasher.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+
+    def test_rehash_on_login(self):
+        """Is a password hashed at another cost rehashed at the current one when its user logs in?"""
+
+        password_hasher.rounds = 5
+        with app.test_client() as c:
+            resp = c.post('/login', data={'username': 'testuser', 'password': 'wrong'})
+            with app.app_context():
+                self.assertEqual(hash_rounds(User.query.one().password), 4)
+
+            resp = c.post('/login', data={'username': 'testuser', 'password': 'password'})
+            self.assertEqual(resp.status_code, 302)
+            with c.session_transaction() as sess:
+                self.assertIn(CURR_USER_KEY, sess)
+
+        with app.app_context():
+            pw_hash = User.query.one().password
+            self.assertEqual(hash_rounds(pw_hash), 5)
+            self.assertTrue(password_hasher.check(pw_hash, 'password'))
+
+    def test_busy(self):
+        """Is a login answered with a 503 when too many passwords are being hashed?"""
+
+        slots = password_hasher.workers + password_hasher.max_pending
+        for _ in range(slots):
+            password_hasher._slots.acquire()
+        try:
+            with app.test_client() as c:
+                resp = c.post('/login', data={'username': 'testuser', 'password': 'password'})
+                self.assertEqual((resp.status_code, resp.headers['Retry-After']), (503, '1'))
+                self.assertIn("a lot of logins", resp.get_data(as_text=True))
+        finally:
+            for _ in range(slots):
+                password_hasher._slots.release()
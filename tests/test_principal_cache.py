@@ -0,0 +1,80 @@
+"""Principal cache tests."""
+
+from app import app
+import os
+from unittest import TestCase
+
+from models import db, User
+from principal_cache import PrincipalCache, Principal, CurrentUser, principal_cache
+from tests.query_counter import count_queries
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+os.environ['DATABASE_URL'] = "postgresql:///baffv-test"
+
+
+class FakeClock:
+    """Clock the tests can move forward."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class PrincipalCacheTestCase(TestCase):
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            users = [User.signup(first_name='test', last_name=f'user{i}', username=f"testuser{i}",
+                                 email=f"test{i}@test.com", password=f"testuser{i}") for i in range(3)]
+            db.session.commit()
+            self.uids = [user.id for user in users]
+
+    def tearDown(self):
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+
+    def test_ttl_and_size(self):
+        """Are principals reloaded after the TTL, and the least recently used ones evicted?"""
+
+        clock = FakeClock()
+        cache = PrincipalCache(max_size=2, ttl=10, clock=clock)
+        with app.app_context(), count_queries(app) as queries:
+            self.assertEqual(cache.get(self.uids[0]), Principal(self.uids[0], 'testuser0', 'test user0'))
+            cache.get(self.uids[1])
+            clock.now = 9
+            cache.get(self.uids[0])
+            self.assertEqual(len(queries), 2)
+            cache.get(self.uids[2])
+            self.assertEqual(len(cache), 2)
+            clock.now = 10
+            cache.get(self.uids[0])
+            self.assertIsNone(cache.get(12345))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(len(queries), 5)
+
+    def test_updates(self):
+        """Is a user's principal dropped when it changes, and the rest of it only loaded when used?"""
+
+        cache = PrincipalCache()
+        with app.app_context():
+            current = CurrentUser(cache.get(self.uids[0]))
+            db.session.remove()
+            with count_queries(app) as queries:
+                self.assertEqual((current.id, current.username, current.full_name),
+                                 (self.uids[0], 'testuser0', 'test user0'))
+                self.assertEqual(len(queries), 0)
+                self.assertEqual(current.email, 'test0@test.com')
+                self.assertEqual(len(queries), 1)
+
+            principal_cache.get(self.uids[0])
+            current.user.first_name = 'renamed'
+            db.session.commit()
+            self.assertEqual(principal_cache.get(self.uids[0]).full_name, 'renamed user0')
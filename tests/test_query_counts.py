@@ -0,0 +1,183 @@
+"""Per-route SQL statement count tests.
+
+Each page has to run a fixed number of statements, however many vets,
+reviews or favorites it shows. A lazy load added to a template or view
+shows up here as an extra statement. The logged-in user's principal is
+cached, so pages that only need its id or name don't load the user.
+"""
+
+from app import app, CURR_USER_KEY
+import os
+from unittest import TestCase
+
+from models import db, data_version_watch, User, Clinic, Vet, Review, Favorite
+from search import location_index
+from search_cache import search_cache
+from principal_cache import principal_cache
+from tests.query_counter import count_queries
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+os.environ['DATABASE_URL'] = "postgresql:///baffv-test"
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class QueryCountTestCase(TestCase):
+    """Test how many SQL statements each page runs."""
+
+    def setUp(self):
+        """Add sample data: several clinics, vets, reviews and favorites."""
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            users = [User.signup(first_name='test', last_name=f'user{i}', username=f"testuser{i}",
+                                 email=f"test{i}@test.com", password=f"testuser{i}") for i in range(3)]
+            clinics = [Clinic(name=f'clinic{i}', city='Test City', state='TS', zip_code='12345') for i in range(3)]
+            db.session.add_all(clinics)
+            db.session.commit()
+            self.uid = users[0].id
+            self.cid = clinics[0].id
+
+            vets = [Vet(name=f'Test Vet{i}', clinic_id=clinics[i % 3].id, fear_free_id=i) for i in range(6)]
+            db.session.add_all(vets)
+            db.session.commit()
+            self.vid = vets[0].id
+
+            db.session.add_all([Review(user_id=user.id, vet_id=vet.id, rating=4, comment=f"Review by {user.username}")
+                                for user in users for vet in vets])
+            db.session.add_all([Favorite(user_id=self.uid, vet_id=vet.id) for vet in vets])
+            db.session.commit()
+
+    def tearDown(self):
+        """Clean up after each test."""
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+
+    def assertQueryCount(self, expected, url, logged_in=True, **session_values):
+        """GET url, with the user's principal cached, and check how many SQL statements it ran."""
+
+        with app.app_context():
+            principal_cache.get(self.uid)
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                if logged_in:
+                    sess[CURR_USER_KEY] = self.uid
+                sess.update(session_values)
+
+            with count_queries(app) as queries:
+                resp = c.get(url)
+
+        self.assertEqual(resp.status_code, 200, url)
+        self.assertEqual(len(queries), expected, '\n'.join(queries.statements))
+
+    def test_search_results(self):
+        """Search results: the vets with their clinics; for a user, their favorites among them first.
+
+        Everyone shares the cached cards; only the data version, and the user's favorites among the vets, are looked
+        up per request.
+        """
+
+        with app.app_context():
+            # Recreating the tables reset the version, which would look like another worker's change.
+            data_version_watch.check()
+            location_index.ensure_built()
+        search_cache.invalidate()
+        self.assertQueryCount(3, '/results', search_area='12345')
+        self.assertQueryCount(2, '/results', search_area='12345')
+        self.assertQueryCount(1, '/results', logged_in=False, search_area='12345')
+        self.assertQueryCount(2, '/results', logged_in=False, search_area='Test City')
+
+    def test_user_profile(self):
+        """User profile: the user, the latest reviews with their vets and the favorite vets with their clinics."""
+
+        self.assertQueryCount(3, f'/users/{self.uid}')
+
+    def test_clinic_profile(self):
+        """Clinic profile: the clinic, its vets and the user's favorites among them."""
+
+        self.assertQueryCount(3, f'/clinics/{self.cid}')
+        self.assertQueryCount(2, f'/clinics/{self.cid}', logged_in=False)
+
+    def test_vet_profile(self):
+        """Vet profile: the vet with its clinic, the reviews with their users and whether it's a favorite."""
+
+        self.assertQueryCount(3, f'/vets/{self.vid}')
+
+    def test_reviews(self):
+        """All reviews: the reviews with their vets. Adding one: the vet."""
+
+        self.assertQueryCount(1, '/reviews')
+        self.assertQueryCount(1, f'/reviews/{self.vid}/add')
+
+    def test_favorites_api(self):
+        """Favorite ids: the version of the user's favorites and their vet ids; only the version if unchanged."""
+
+        self.assertQueryCount(2, '/api/users/favorites')
+        self.assertQueryCount(2, f'/api/users/favorites?vet_ids={self.vid},{self.vid + 1}')
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid
+            etag = c.get('/api/users/favorites').headers['ETag']
+            with count_queries(app) as queries:
+                resp = c.get('/api/users/favorites', headers={'If-None-Match': etag})
+        self.assertEqual((resp.status_code, len(queries)), (304, 1))
+
+    def test_favorite_writes(self):
+        """Setting a favorite: one statement, which also bumps the version if it changed anything."""
+
+        with app.app_context():
+            principal_cache.get(self.uid)
+        url = f'/api/users/favorite/{self.vid}'
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid
+
+            counts = []
+            for method in (c.delete, c.delete, c.put, c.put):
+                with count_queries(app) as queries:
+                    method(url)
+                counts.append(len(queries))
+            self.assertEqual(counts, [1, 1, 1, 1])
+
+            with count_queries(app) as queries:
+                resp = c.patch('/api/users/favorites', json={'add': [self.vid], 'remove': [self.vid + 1, self.vid + 2]})
+            self.assertEqual(resp.json, {'added': [], 'removed': [self.vid + 1, self.vid + 2]})
+            self.assertEqual(len(queries), 2, '\n'.join(queries.statements))
+
+    def test_principal_cache(self):
+        """Is the user loaded once per worker rather than on every request, and never for static files?"""
+
+        with app.app_context():
+            user = User.signup(first_name='new', last_name='user', username='newuser', email='new@test.com',
+                               password='newuser')
+            db.session.commit()
+            uid = user.id
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = uid
+
+            with count_queries(app) as queries:
+                self.assertEqual(c.get('/static/stylesheets/style.css').status_code, 200)
+            self.assertEqual(len(queries), 0)
+
+            with count_queries(app) as queries:
+                c.get(f'/reviews/{self.vid}/add')
+                c.get(f'/reviews/{self.vid}/add')
+            self.assertEqual(len(queries), 3, '\n'.join(queries.statements))
+            self.assertEqual(len(principal_cache), 1)
+
+            # The user is logged out if it's gone.
+            with app.app_context():
+                db.session.delete(db.session.get(User, uid))
+                db.session.commit()
+            self.assertEqual(len(principal_cache), 0)
+            self.assertIn('Log in', c.get('/').get_data(as_text=True))
@@ -0,0 +1,120 @@
+"""Rating aggregate tests."""
+
+from app import app
+import os
+from decimal import Decimal
+from unittest import TestCase
+
+from sqlalchemy import inspect, update
+
+from models import db, Clinic, Vet, User, Review, recompute_rating_aggregates, star_bucket
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+os.environ['DATABASE_URL'] = "postgresql:///baffv-test"
+
+
+class RatingAggregatesTestCase(TestCase):
+    """Test the rating aggregates stored on vets and clinics."""
+
+    def setUp(self):
+        """Add sample data."""
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            cln = Clinic(name='test_clinic', city='Test City', state='TS', zip_code='12345')
+            db.session.add(cln)
+            db.session.commit()
+            self.cid = cln.id
+
+            vt1 = Vet(name='Test Vet1', clinic_id=self.cid, fear_free_id=1)
+            vt2 = Vet(name='Test Vet2', clinic_id=self.cid, fear_free_id=2)
+            u = User.signup('Test', 'User1', 'TestUser1', 'testuser1@test.com', 'password1')
+            db.session.add_all([vt1, vt2])
+            db.session.commit()
+            self.vid1, self.vid2, self.uid = vt1.id, vt2.id, u.id
+
+            db.session.add_all([Review(user_id=self.uid, vet_id=self.vid1, rating=5, comment='Great'),
+                                Review(user_id=self.uid, vet_id=self.vid1, rating=4, comment='Good'),
+                                Review(user_id=self.uid, vet_id=self.vid2, rating=1, comment='Bad')])
+            db.session.commit()
+
+    def tearDown(self):
+        """Clean up after each test."""
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+
+    def test_star_bucket(self):
+        """Are ratings counted under the nearest star?"""
+
+        self.assertEqual([star_bucket(Decimal(r)) for r in ('0.5', '1.4', '1.5', '3.0', '4.5', '5.0')],
+                         [1, 1, 2, 3, 5, 5])
+
+    def test_aggregates_on_insert(self):
+        """Are vet and clinic aggregates updated as reviews are added?"""
+
+        with app.app_context():
+            vt1 = db.session.get(Vet, self.vid1)
+            self.assertEqual((vt1.review_count, vt1.rating_sum), (2, 9))
+            self.assertEqual(vt1.rating_histogram, {1: 0, 2: 0, 3: 0, 4: 1, 5: 1})
+            self.assertEqual(vt1.average_rating, Decimal('4.5'))
+
+            cln = db.session.get(Clinic, self.cid)
+            self.assertEqual((cln.review_count, cln.rating_sum), (3, 10))
+            self.assertEqual(cln.average_rating, Decimal('3.3'))
+
+    def test_aggregates_on_update_and_delete(self):
+        """Are aggregates updated when a review is changed or removed?"""
+
+        with app.app_context():
+            review = Review.query.filter_by(vet_id=self.vid2).one()
+            review.rating = 3
+            db.session.commit()
+            vt2 = db.session.get(Vet, self.vid2)
+            self.assertEqual(vt2.rating_histogram, {1: 0, 2: 0, 3: 1, 4: 0, 5: 0})
+            self.assertEqual(vt2.average_rating, 3)
+
+            review.vet_id = self.vid1
+            db.session.commit()
+            self.assertEqual((vt2.review_count, vt2.average_rating), (0, 0))
+            self.assertEqual(db.session.get(Vet, self.vid1).review_count, 3)
+
+            db.session.delete(review)
+            db.session.commit()
+            self.assertEqual(db.session.get(Vet, self.vid1).review_count, 2)
+            self.assertEqual(db.session.get(Clinic, self.cid).review_count, 2)
+
+    def test_average_rating_without_reviews(self):
+        """Does showing a rating leave the reviews unloaded?"""
+
+        with app.app_context():
+            vt1 = db.session.get(Vet, self.vid1)
+            self.assertEqual(vt1.average_rating, Decimal('4.5'))
+            self.assertIn('reviews', inspect(vt1).unloaded)
+
+    def test_recompute(self):
+        """Does recompute_rating_aggregates repair drifted aggregates?"""
+
+        with app.app_context():
+            db.session.execute(update(Vet).values(review_count=7, rating_sum=1, rating_5_count=7))
+            db.session.execute(update(Clinic).values(review_count=0, rating_sum=0))
+            db.session.commit()
+
+            recompute_rating_aggregates()
+
+            vt1 = db.session.get(Vet, self.vid1)
+            self.assertEqual((vt1.review_count, vt1.rating_sum), (2, 9))
+            self.assertEqual(vt1.rating_histogram, {1: 0, 2: 0, 3: 0, 4: 1, 5: 1})
+            self.assertEqual(db.session.get(Vet, self.vid2).rating_histogram, {1: 1, 2: 0, 3: 0, 4: 0, 5: 0})
+            cln = db.session.get(Clinic, self.cid)
+            self.assertEqual((cln.review_count, cln.rating_sum), (3, 10))
+
+    def test_recompute_command(self):
+        """Can the aggregates be recomputed from the command line?"""
+
+        result = app.test_cli_runner().invoke(args=['recompute-ratings'])
+        self.assertIn('Recomputed rating aggregates of 2 vets and 1 clinics', result.output)
@@ -0,0 +1,107 @@
+"""Scrape pipeline tests, crawling the local fixture server."""
+
+import csv
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from crawler import Crawler, CrawlError
+from fixture_server import FixtureServer, page_file, save_directory_pages, render_page
+from loader import read_scraped
+from scraped_data.webscrape_bs4 import RECORDS_FILE, get_95110_data, read_records
+
+# Two vets per clinic, the last one listed twice.
+LISTINGS = [{'fear_free_id': 100 + i, 'name': f'Vet {i}', 'clinic': f'Clinic {i // 2}',
+             'address': f'{i // 2} Main St, San Jose, CA 9511{i // 2}', 'phone': '', 'website': ''}
+            for i in range(10)]
+LISTINGS.append(LISTINGS[-1])
+
+
+class ScraperTestCase(TestCase):
+
+    def setUp(self):
+        self.pages_dir = TemporaryDirectory()
+        self.output_dir = TemporaryDirectory()
+        self.pages = save_directory_pages(self.pages_dir.name, LISTINGS, per_page=2)
+        self.records_path = os.path.join(self.output_dir.name, RECORDS_FILE)
+
+    def tearDown(self):
+        self.pages_dir.cleanup()
+        self.output_dir.cleanup()
+
+    def scrape(self, server):
+        with Crawler(rate=None, retries=0, concurrency=2) as crawler:
+            get_95110_data(self.pages, server.url, crawler, self.output_dir.name)
+
+    def read_csv(self, name):
+        with open(os.path.join(self.output_dir.name, name), newline='') as f:
+            return list(csv.DictReader(f))
+
+    def test_scrape(self):
+        """Are the pages streamed into records and deduplicated CSVs?"""
+
+        with FixtureServer(self.pages_dir.name) as server:
+            self.scrape(server)
+
+        self.assertEqual(len(list(read_records(self.records_path))), 11)
+        self.assertFalse(os.path.exists(f'{self.records_path}.checkpoint'))
+        clinics = self.read_csv('clinics.csv')
+        self.assertEqual([clinic['name'] for clinic in clinics], [f'Clinic {i}' for i in range(5)])
+        self.assertEqual(clinics[1], {'name': 'Clinic 1', 'street_address': '1 Main St', 'city': 'San Jose',
+                                      'state': 'CA', 'zip_code': '95111', 'phone': '', 'website': ''})
+        vets = self.read_csv('vets.csv')
+        self.assertEqual([(vet['fear_free_id'], vet['clinic_id']) for vet in vets],
+                         [(str(100 + i), str(i // 2 + 1)) for i in range(10)])
+
+        with open(os.path.join(self.output_dir.name, 'rejects.csv'), newline='') as f:
+            self.assertEqual(list(csv.DictReader(f)), [])
+
+        clinics, vets = read_scraped(os.path.join(self.output_dir.name, 'clinics.csv'),
+                                     os.path.join(self.output_dir.name, 'vets.csv'))
+        self.assertEqual((len(clinics), len(vets)), (5, 10))
+
+    def test_rejects(self):
+        """Are the values normalizing drops written to rejects.csv?"""
+
+        listings = [dict(LISTINGS[0], address='Nowhere'), dict(LISTINGS[1], phone='555-0100')]
+        save_directory_pages(self.pages_dir.name, listings, per_page=2)
+        self.pages = 1
+        with FixtureServer(self.pages_dir.name) as server:
+            self.scrape(server)
+
+        self.assertEqual(self.read_csv('rejects.csv'), [
+            {'fear_free_id': '100', 'name': 'Vet 0', 'field': 'address', 'value': 'Nowhere',
+             'reason': "not a street, city, state and zip code"},
+            {'fear_free_id': '101', 'name': 'Vet 1', 'field': 'phone', 'value': '555-0100',
+             'reason': "not a US phone number"}])
+
+    def test_resume(self):
+        """Does an interrupted crawl resume after its last completed page?"""
+
+        os.rename(page_file(self.pages_dir.name, 4), page_file(self.pages_dir.name, 'missing'))
+        with FixtureServer(self.pages_dir.name) as server:
+            with self.assertRaises(CrawlError):
+                self.scrape(server)
+            self.assertEqual(len(list(read_records(self.records_path))), 6)
+            requests = server.requests
+
+            # Records of a page that was being written when the crawl died are dropped.
+            with open(self.records_path, 'a') as f:
+                f.write('{"fear_free_id": 1')
+            os.rename(page_file(self.pages_dir.name, 'missing'), page_file(self.pages_dir.name, 4))
+            self.scrape(server)
+            self.assertEqual(server.requests - requests, 3)
+
+        records = list(read_records(self.records_path))
+        self.assertEqual([record['fear_free_id'] for record in records],
+                         [100 + i for i in range(10)] + [109])
+        self.assertEqual(len(self.read_csv('vets.csv')), 10)
+
+        # A finished crawl starts over.
+        with FixtureServer(self.pages_dir.name) as server:
+            save_directory_pages(self.pages_dir.name, LISTINGS[:2], per_page=2)
+            with open(page_file(self.pages_dir.name, 2), 'w') as f:
+                f.write(render_page([]))
+            self.pages = 2
+            self.scrape(server)
+        self.assertEqual(len(list(read_records(self.records_path))), 2)
@@ -0,0 +1,105 @@
+"""Vet search API tests."""
+
+from app import app
+import os
+from unittest import TestCase
+
+from models import db, User, Clinic, Vet, Review
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+os.environ['DATABASE_URL'] = "postgresql:///baffv-test"
+
+
+class SearchAPITestCase(TestCase):
+    """Test the paginated vet search API."""
+
+    def setUp(self):
+        """Add sample data."""
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            user = User.signup(first_name='test', last_name='user1', username="testuser1",
+                               email="test1@test.com", password="testuser1")
+            with_web = Clinic(name='Web Clinic', city='Test City', state='TS', zip_code='12345',
+                              website='http://example.com')
+            with_phone = Clinic(name='Phone Clinic', city='Test City', state='TS', zip_code='12346',
+                                phone='(408) 555-0100')
+            other = Clinic(name='Other Clinic', city='Other City', state='TS', zip_code='54321')
+            db.session.add_all([with_web, with_phone, other])
+            db.session.commit()
+
+            vets = [Vet(name=f'Vet {letter}', clinic_id=with_web.id if i % 2 else with_phone.id, fear_free_id=i)
+                    for i, letter in enumerate('EDCBA')]
+            vets.append(Vet(name='Other Vet', clinic_id=other.id, fear_free_id=99))
+            db.session.add_all(vets)
+            db.session.commit()
+
+            # Vet E: 5 stars, Vet D: 4 stars, Vet C: 4 stars, others unrated.
+            db.session.add_all([Review(user_id=user.id, vet_id=vets[0].id, rating=5, comment='Great'),
+                                Review(user_id=user.id, vet_id=vets[1].id, rating=4, comment='Good'),
+                                Review(user_id=user.id, vet_id=vets[2].id, rating=4, comment='Good')])
+            db.session.commit()
+
+    def tearDown(self):
+        """Clean up after each test."""
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+
+    def get_all_pages(self, c, **params):
+        """Follow next_cursor until the last page; return the list of pages of vet names."""
+
+        pages = []
+        cursor = None
+        while True:
+            if cursor:
+                params['cursor'] = cursor
+            resp = c.get('/api/vets/search', query_string=params)
+            self.assertEqual(resp.status_code, 200)
+            pages.append([vet['name'] for vet in resp.json['vets']])
+            cursor = resp.json['next_cursor']
+            if not cursor:
+                return pages
+
+    def test_search_by_name(self):
+        """Are vets paginated in name order?"""
+
+        with app.test_client() as c:
+            pages = self.get_all_pages(c, q='Test City', limit=2)
+            self.assertEqual(pages, [['Vet A', 'Vet B'], ['Vet C', 'Vet D'], ['Vet E']])
+
+            resp = c.get('/api/vets/search', query_string={'q': '12345'})
+            self.assertEqual([v['name'] for v in resp.json['vets']], ['Vet B', 'Vet D'])
+            self.assertEqual(resp.json['vets'][0]['clinic']['name'], 'Web Clinic')
+
+    def test_search_by_rating(self):
+        """Are vets paginated by rating, ties broken by id?"""
+
+        with app.test_client() as c:
+            pages = self.get_all_pages(c, q='test city', sort='rating', limit=2)
+            self.assertEqual(pages, [['Vet E', 'Vet D'], ['Vet C', 'Vet B'], ['Vet A']])
+
+            resp = c.get('/api/vets/search', query_string={'q': 'Test City', 'sort': 'rating'})
+            self.assertEqual(resp.json['vets'][0]['average_rating'], 5.0)
+
+    def test_search_filters(self):
+        """Do the rating, website and phone filters work?"""
+
+        with app.test_client() as c:
+            self.assertEqual(self.get_all_pages(c, q='Test City', min_rating=4), [['Vet C', 'Vet D', 'Vet E']])
+            self.assertEqual(self.get_all_pages(c, q='Test City', has_website='1'), [['Vet B', 'Vet D']])
+            self.assertEqual(self.get_all_pages(c, q='Test City', has_phone='true'), [['Vet A', 'Vet C', 'Vet E']])
+
+    def test_search_bad_input(self):
+        """Are bad parameters rejected?"""
+
+        with app.test_client() as c:
+            for params in [{'q': ''}, {'q': 'Test City', 'limit': 0}, {'q': 'Test City', 'limit': 1000},
+                           {'q': 'Test City', 'sort': 'price'}, {'q': 'Test City', 'cursor': 'garbage'}]:
+                resp = c.get('/api/vets/search', query_string=params)
+                self.assertEqual(resp.status_code, 400)
+                self.assertIn('error', resp.json)
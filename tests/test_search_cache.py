@@ -0,0 +1,162 @@
+"""Search result cache tests."""
+
+from app import app
+import os
+import threading
+import time
+from unittest import TestCase
+
+from models import db, User, Clinic, Vet, Review
+from search_cache import SearchCache, search_cache
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+os.environ['DATABASE_URL'] = "postgresql:///baffv-test"
+
+
+class FakeClock:
+    """Clock the tests can move forward."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class SearchCacheTestCase(TestCase):
+    """Test the LRU/TTL cache itself."""
+
+    def test_lru_eviction(self):
+        """Are the least recently used keys evicted first?"""
+
+        cache = SearchCache(max_size=2)
+        cache.get_or_compute('a', lambda: 1)
+        cache.get_or_compute('b', lambda: 2)
+        cache.get_or_compute('a', lambda: 'recomputed')
+        cache.get_or_compute('c', lambda: 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get_or_compute('a', lambda: 'recomputed'), 1)
+        self.assertEqual(cache.get_or_compute('b', lambda: 'recomputed'), 'recomputed')
+        self.assertEqual(cache.stats()['evictions'], 2)
+
+    def test_ttl(self):
+        """Do entries expire after the TTL?"""
+
+        clock = FakeClock()
+        cache = SearchCache(ttl=10, clock=clock)
+        cache.get_or_compute('a', lambda: 1)
+        clock.now = 9
+        self.assertEqual(cache.get_or_compute('a', lambda: 2), 1)
+        clock.now = 10
+        self.assertEqual(cache.get_or_compute('a', lambda: 2), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_invalidate(self):
+        """Does invalidate drop all entries, including one being computed?"""
+
+        cache = SearchCache()
+        cache.get_or_compute('a', lambda: 1)
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+        def compute_then_invalidate():
+            cache.invalidate()
+            return 'stale'
+
+        self.assertEqual(cache.get_or_compute('b', compute_then_invalidate), 'stale')
+        self.assertEqual(len(cache), 0)
+
+    def test_errors_not_cached(self):
+        """Are failed computations retried on the next call?"""
+
+        cache = SearchCache()
+
+        def fail():
+            raise RuntimeError("DB is down")
+
+        with self.assertRaises(RuntimeError):
+            cache.get_or_compute('a', fail)
+        self.assertEqual(cache.get_or_compute('a', lambda: 1), 1)
+
+    def test_single_flight(self):
+        """Do concurrent misses on the same key compute the value only once?"""
+
+        cache = SearchCache()
+        calls = []
+        release = threading.Event()
+
+        def slow_compute():
+            calls.append(1)
+            release.wait(5)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('a', slow_compute)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while cache.coalesced < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+
+class SearchCacheViewTestCase(TestCase):
+    """Test caching of the search results page."""
+
+    def setUp(self):
+        """Add sample data."""
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            user = User.signup(first_name='test', last_name='user1', username="testuser1",
+                               email="test1@test.com", password="testuser1")
+            cln = Clinic(name='test_clinic', city='Test City', state='TS', zip_code='12345')
+            db.session.add(cln)
+            db.session.commit()
+            vt = Vet(name='Test Vet', clinic_id=cln.id, fear_free_id=12345)
+            db.session.add(vt)
+            db.session.commit()
+            self.uid, self.vid = user.id, vt.id
+
+    def tearDown(self):
+        """Clean up after each test."""
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+
+    def search(self, c, search_area):
+        with c.session_transaction() as sess:
+            sess['search_area'] = search_area
+        return c.get('/results').get_data(as_text=True)
+
+    def test_cached_results(self):
+        """Are repeated searches served from the cache until a review is added?"""
+
+        with app.test_client() as c:
+            self.search(c, '12345')
+            hits = search_cache.hits
+            html = self.search(c, '12345')
+            self.assertIn('Test Vet', html)
+            self.assertEqual(search_cache.hits, hits + 1)
+
+            with app.app_context():
+                db.session.add(Review(user_id=self.uid, vet_id=self.vid, rating=4, comment='Nice'))
+                db.session.commit()
+
+            html = self.search(c, '12345')
+            self.assertEqual(search_cache.hits, hits + 1)
+            self.assertIn('4', html)
+
+            resp = c.get('/api/search-cache/stats')
+            self.assertEqual(resp.json['search_cache']['hits'], search_cache.hits)
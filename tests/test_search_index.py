@@ -0,0 +1,105 @@
+"""Location index tests."""
+
+from app import app
+import os
+from unittest import TestCase
+
+from models import db, Clinic, Vet
+from search import normalize_city, parse_search_area, parse_search_state, location_index
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+os.environ['DATABASE_URL'] = "postgresql:///baffv-test"
+
+
+class SearchParsingTestCase(TestCase):
+    """Test parsing of the search bar input."""
+
+    def test_normalize_city(self):
+        """Are city names lowercased and abbreviations expanded?"""
+
+        self.assertEqual(normalize_city('San Jose'), 'san jose')
+        self.assertEqual(normalize_city('S. San Francisco'), 'south san francisco')
+        self.assertEqual(normalize_city('Mt. View'), 'mount view')
+        self.assertEqual(normalize_city(None), '')
+
+    def test_parse_search_area(self):
+        """Do we get a zip code or a normalized city out of the search bar?"""
+
+        self.assertEqual(parse_search_area('95110'), ('95110', None))
+        self.assertEqual(parse_search_area('San Jose, CA 95110'), ('95110', None))
+        self.assertEqual(parse_search_area('Test City, TS'), (None, 'test city'))
+        self.assertEqual(parse_search_area('san jose ca'), (None, 'san jose'))
+        self.assertEqual(parse_search_area('Portland ME'), (None, 'portland'))
+        self.assertEqual(parse_search_area('South San Francisco'), (None, 'south san francisco'))
+        self.assertEqual(parse_search_area('!!!'), (None, None))
+        self.assertEqual(parse_search_area(None), (None, None))
+
+        self.assertEqual(parse_search_state('Test City, ts.'), 'TS')
+        self.assertEqual(parse_search_state('san jose ca'), 'CA')
+        self.assertEqual(parse_search_state('Austin TX'), 'TX')
+        self.assertEqual(parse_search_state('Saipan MP'), 'MP')
+        self.assertEqual(parse_search_state('San Jose'), None)
+        self.assertEqual(parse_search_state('San Jose, CA 95110'), None)
+
+
+class LocationIndexTestCase(TestCase):
+    """Test the in-memory location index."""
+
+    def setUp(self):
+        """Add sample data."""
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            sj = Clinic(name='SJ Clinic', city='San Jose', state='CA', zip_code='95110')
+            ssf = Clinic(name='SSF Clinic', city='South San Francisco', state='CA', zip_code='94080')
+            sf = Clinic(name='SF Clinic', city='San Francisco', state='CA', zip_code='94110')
+            db.session.add_all([sj, ssf, sf])
+            db.session.commit()
+
+            v1 = Vet(name='Vet One', clinic_id=sj.id, fear_free_id=1)
+            v2 = Vet(name='Vet Two', clinic_id=ssf.id, fear_free_id=2)
+            v3 = Vet(name='Vet Three', clinic_id=sf.id, fear_free_id=3)
+            db.session.add_all([v1, v2, v3])
+            db.session.commit()
+            self.vids = [v1.id, v2.id, v3.id]
+
+    def tearDown(self):
+        """Clean up after each test."""
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+
+    def test_zip_lookup(self):
+        """Can we find vets by zip code?"""
+        with app.app_context():
+            self.assertEqual(location_index.lookup(zipcode='95110'), [self.vids[0]])
+            self.assertEqual(location_index.lookup(zipcode='00000'), [])
+
+    def test_city_lookup(self):
+        """Can we find vets by exact, abbreviated, partial and misspelled city names?"""
+        with app.app_context():
+            self.assertEqual(location_index.lookup(city=normalize_city('San Jose')), [self.vids[0]])
+            self.assertEqual(location_index.lookup(city=normalize_city('S. San Francisco')), [self.vids[1]])
+            self.assertEqual(location_index.lookup(city='san jos'), [self.vids[0]])
+            self.assertEqual(location_index.lookup(city='san'), [self.vids[0], self.vids[2]])
+            self.assertEqual(location_index.lookup(city='san jsoe'), [self.vids[0]])
+            self.assertEqual(location_index.lookup(city='sacramento'), [])
+
+    def test_rebuild_on_change(self):
+        """Is the index rebuilt after vets or clinics change?"""
+        with app.app_context():
+            self.assertEqual(location_index.lookup(zipcode='95112'), [])
+
+            cln = Clinic(name='New Clinic', city='San Jose', state='CA', zip_code='95112')
+            db.session.add(cln)
+            db.session.commit()
+            vt = Vet(name='New Vet', clinic_id=cln.id, fear_free_id=4)
+            db.session.add(vt)
+            db.session.commit()
+
+            self.assertEqual(location_index.lookup(zipcode='95112'), [vt.id])
+            self.assertIn(vt.id, location_index.lookup(city='san jose'))
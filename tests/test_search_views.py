@@ -2,8 +2,11 @@
 
 from app import app, CURR_USER_KEY
 import os
+import re
 from unittest import TestCase
 
+from sqlalchemy import text
+
 from models import db, connect_db, User, Clinic, Vet, Review, Favorite
 
 # BEFORE we import our app, let's set an environmental variable
@@ -137,3 +140,61 @@ class SearchViewTestCase(TestCase):
             self.assertIn('Test Vet1', html)
             self.assertIn('Test Vet2', html)
             self.assertNotIn('Test Vet3', html)
+
+    def test_partial_city_search(self):
+        """Can I search with a partial or misspelled city name?"""
+
+        with app.test_client() as c:
+            for search_area in ['test cit', 'Tset City']:
+                with c.session_transaction() as sess:
+                    sess['search_area'] = search_area
+
+                resp = c.post('/results', follow_redirects=True)
+                self.assertEqual(resp.status_code, 200)
+                html = resp.get_data(as_text=True)
+                self.assertIn('Test Vet1', html)
+                self.assertIn('Test Vet2', html)
+
+    def test_favorites_marked(self):
+        """Are my favorites among the vets found marked in the page, and nobody else's?"""
+
+        def marked(html):
+            buttons = re.findall(r'id="favorite-(\d+)"[^>]*>\s*<button class="[^"]*btn-primary', html)
+            return {int(vet_id) for vet_id in buttons}
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess['search_area'] = '12345'
+            html = c.get('/results').get_data(as_text=True)
+            self.assertEqual(marked(html), set())
+            self.assertNotIn('<!--favorite-', html)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid1
+            self.assertEqual(marked(c.get('/results').get_data(as_text=True)), {self.vid1, self.vid2})
+
+            c.delete(f'/api/users/favorite/{self.vid2}')
+            self.assertEqual(marked(c.get('/results').get_data(as_text=True)), {self.vid1})
+            self.assertEqual(marked(c.get(f'/clinics/{self.cid}').get_data(as_text=True)), {self.vid1})
+            self.assertEqual(marked(c.get(f'/vets/{self.vid2}').get_data(as_text=True)), set())
+
+    def test_changed_by_another_worker(self):
+        """Do results cached here show what another worker changed, once it bumped the data version?"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess['search_area'] = '12345'
+            self.assertIn('Test Vet1', c.get('/results').get_data(as_text=True))
+
+            # Raw SQL, which this worker's ORM events don't see, as it wouldn't see another worker's writes.
+            with app.app_context():
+                db.session.execute(text("UPDATE vets SET name = 'Renamed Vet' WHERE id = :id"), {'id': self.vid1})
+                db.session.commit()
+            self.assertIn('Test Vet1', c.get('/results').get_data(as_text=True))
+
+            with app.app_context():
+                db.session.execute(text("UPDATE data_versions SET version = version + 1"))
+                db.session.commit()
+            html = c.get('/results').get_data(as_text=True)
+            self.assertIn('Renamed Vet', html)
+            self.assertNotIn('Test Vet1', html)
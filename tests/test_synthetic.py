@@ -0,0 +1,85 @@
+"""Synthetic data and route benchmark comparison tests."""
+
+from app import app
+import os
+from unittest import TestCase
+
+from sqlalchemy import func
+
+from models import db, Clinic, Vet, User, Favorite, Review
+from synthetic import SyntheticData, load_synthetic
+from fulltext import search_vets_fulltext
+from benchmarks.bench_routes import compare
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+os.environ['DATABASE_URL'] = "postgresql:///baffv-test"
+
+
+class SyntheticDataTestCase(TestCase):
+    """Test generating and loading synthetic data."""
+
+    def setUp(self):
+        self.data = SyntheticData(vets=40, reviews=300, favorites=60, seed=1)
+
+    def tearDown(self):
+        """Clean up after each test."""
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+
+    def test_rows(self):
+        """Are rows deterministic, within range and free of duplicate favorites?"""
+
+        self.assertEqual(list(self.data.rows('vets')), list(SyntheticData(vets=40, seed=1).rows('vets')))
+        self.assertEqual(self.data.counts(), {'clinics': 10, 'vets': 40, 'users': 20, 'favorites': 60,
+                                              'reviews': 300})
+
+        favorites = [(f['user_id'], f['vet_id']) for f in self.data.rows('favorites')]
+        self.assertEqual(len(favorites), 60)
+        self.assertEqual(len(set(favorites)), 60)
+
+        reviews = list(self.data.rows('reviews'))
+        self.assertTrue(all(1 <= r['vet_id'] <= 40 and 1 <= r['user_id'] <= 20 for r in reviews))
+        # Popular vets get most of the reviews.
+        self.assertGreater(sum(r['vet_id'] <= 10 for r in reviews), len(reviews) / 2)
+
+    def test_load(self):
+        """Are rows, rating aggregates and the search table loaded, with ids left free for new rows?"""
+
+        reported = {}
+        with app.app_context():
+            load_synthetic(self.data, chunk_size=50, report=lambda step, rows, seconds: reported.update({step: rows}))
+
+            self.assertEqual(Clinic.query.count(), 10)
+            self.assertEqual(Vet.query.count(), 40)
+            self.assertEqual(User.query.count(), 20)
+            self.assertEqual(Favorite.query.count(), 60)
+            self.assertEqual(Review.query.count(), 300)
+            self.assertEqual(db.session.query(func.sum(Vet.review_count)).scalar(), 300)
+            self.assertTrue(search_vets_fulltext('anxious'))
+            self.assertEqual(reported, dict(self.data.counts(), **{'rating aggregates': None, 'search table': None}))
+
+            vt = Vet(name='New Vet', clinic_id=1, fear_free_id=1000)
+            db.session.add(vt)
+            db.session.commit()
+            self.assertEqual(vt.id, 41)
+
+
+class BenchmarkCompareTestCase(TestCase):
+    """Test flagging regressions against a saved benchmark baseline."""
+
+    def test_compare(self):
+        """Are slower routes and extra statements flagged, and noise ignored?"""
+
+        baseline = {'routes': {'vet_profile': {'p95_ms': 10.0, 'max_queries': 2},
+                               'get_review': {'p95_ms': 1.0, 'max_queries': 1}}}
+        current = {'routes': {'vet_profile': {'p95_ms': 15.0, 'max_queries': 3},
+                              'get_review': {'p95_ms': 1.5, 'max_queries': 1},
+                              'new_route': {'p95_ms': 5.0, 'max_queries': 1}}}
+
+        self.assertEqual(compare(baseline, current), [('vet_profile', "p95 10.00 ms -> 15.00 ms"),
+                                                      ('vet_profile', "queries 2 -> 3")])
+        self.assertEqual(compare(baseline, current, threshold=1.0), [('vet_profile', "queries 2 -> 3")])
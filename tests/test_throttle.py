@@ -0,0 +1,134 @@
+"""Login/signup throttle tests."""
+
+from app import app
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from models import db, User
+from passwords import password_hasher
+from throttle import LIMITS, Limit, SharedTokenBuckets, TokenBuckets, throttle
+from tests.query_counter import count_queries
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+os.environ['DATABASE_URL'] = "postgresql:///baffv-test"
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+app.config['WTF_CSRF_ENABLED'] = False
+
+LIMIT = Limit(2, 1 / 10)
+
+
+class FakeClock:
+    """Clock the tests can move forward."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketsTestCase(TestCase):
+
+    def check_buckets(self, buckets, clock):
+        self.assertEqual([buckets.take([('a', LIMIT)]) for _ in range(3)], [0, 0, 10])
+        clock.now = 5
+        self.assertEqual(buckets.take([('a', LIMIT)]), 5)
+        # Tokens are only taken when every bucket has one.
+        self.assertEqual(buckets.take([('b', LIMIT), ('a', LIMIT)]), 5)
+        self.assertEqual(buckets.take([('b', LIMIT)]), 0)
+        self.assertEqual(buckets.take([('b', LIMIT)]), 0)
+        clock.now = 10
+        self.assertEqual(buckets.take([('a', LIMIT)]), 0)
+        clock.now = 100
+        self.assertEqual([buckets.take([('a', LIMIT)]) for _ in range(3)], [0, 0, 10])
+
+    def test_token_buckets(self):
+        """Are tokens taken from every bucket or none, and refilled at their rate?"""
+
+        clock = FakeClock()
+        self.check_buckets(TokenBuckets(clock=clock), clock)
+
+    def test_eviction(self):
+        """Are the least recently used buckets evicted?"""
+
+        buckets = TokenBuckets(max_keys=2, clock=FakeClock())
+        for key in ('a', 'b', 'b', 'a', 'c'):
+            buckets.take([(key, LIMIT)])
+        self.assertEqual((len(buckets), buckets.evictions), (2, 1))
+        self.assertEqual(buckets.take([('a', LIMIT)]), 10)
+        # b starts over.
+        self.assertEqual(buckets.take([('b', LIMIT)]), 0)
+
+    def test_shared_token_buckets(self):
+        """Do stores mapping the same file share their buckets?"""
+
+        clock = FakeClock()
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'throttle')
+            buckets = SharedTokenBuckets(path, slots=64, clock=clock)
+            other = SharedTokenBuckets(path, slots=64, clock=clock)
+            try:
+                self.check_buckets(buckets, clock)
+                self.assertEqual(other.take([('a', LIMIT)]), 10)
+                self.assertEqual(other.take([('b', LIMIT)]), 0)
+            finally:
+                buckets.close()
+                other.close()
+
+
+class ThrottleViewsTestCase(TestCase):
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        self.store = throttle.store
+        throttle.store = TokenBuckets()
+
+    def tearDown(self):
+        throttle.store = self.store
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+
+    def test_login(self):
+        """Are logins past the per-IP and per-username limits turned away, without any DB or bcrypt work?"""
+
+        with app.test_client() as c:
+            for i in range(5):
+                self.assertEqual(c.post('/login', data={'username': 'victim', 'password': f'guess{i}'}).status_code,
+                                 200)
+            checked = password_hasher.checked
+            with count_queries(app) as queries:
+                resp = c.post('/login', data={'username': 'Victim ', 'password': 'guess'})
+            self.assertEqual((resp.status_code, resp.headers['Retry-After']), (429, '60'))
+            self.assertIn("Too many attempts", resp.get_data(as_text=True))
+            self.assertEqual((len(queries), password_hasher.checked), (0, checked))
+
+            # Other usernames, until the IP runs out.
+            statuses = [c.post('/login', data={'username': f'user{i}', 'password': 'guess'}).status_code
+                        for i in range(6)]
+            self.assertEqual(statuses, [200] * 5 + [429])
+            other_ip = c.post('/login', data={'username': 'user9', 'password': 'guess'},
+                              environ_base={'REMOTE_ADDR': '10.0.0.2'})
+            self.assertEqual(other_ip.status_code, 200)
+
+    def test_signup(self):
+        """Are signups throttled too?"""
+
+        throttle.limits = dict(throttle.limits, signup=(Limit(1, 1 / 3600), Limit(3, 1 / 600)))
+        try:
+            with app.test_client() as c:
+                data = {'first_name': 'a', 'last_name': 'b', 'username': 'newuser', 'email': 'new@test.com',
+                        'password': 'password'}
+                self.assertEqual(c.post('/signup', data=data).status_code, 302)
+                self.assertEqual(c.post('/signup', data=dict(data, username='other')).status_code, 429)
+            with app.app_context():
+                self.assertEqual(User.query.count(), 1)
+        finally:
+            throttle.limits = LIMITS
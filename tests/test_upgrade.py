@@ -0,0 +1,82 @@
+"""Schema upgrade tests."""
+
+from app import app
+import os
+from unittest import TestCase
+
+from sqlalchemy import text
+
+from models import db, User, Clinic, Vet, Favorite, DataVersion
+from fulltext import search_vets_fulltext
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+os.environ['DATABASE_URL'] = "postgresql:///baffv-test"
+
+# The tables as the first version of the app created them, with some data.
+OLD_SCHEMA = [
+    """CREATE TABLE clinics (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, street_address VARCHAR,
+                             city VARCHAR NOT NULL, state VARCHAR NOT NULL, zip_code VARCHAR, phone VARCHAR,
+                             website VARCHAR)""",
+    """CREATE TABLE vets (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL,
+                          clinic_id INTEGER REFERENCES clinics (id) ON DELETE CASCADE,
+                          fear_free_id INTEGER NOT NULL UNIQUE)""",
+    """CREATE TABLE users (id INTEGER PRIMARY KEY, first_name VARCHAR(100) NOT NULL,
+                           last_name VARCHAR(100) NOT NULL, username VARCHAR(100) NOT NULL UNIQUE,
+                           email VARCHAR NOT NULL UNIQUE, password VARCHAR NOT NULL)""",
+    """CREATE TABLE favorites (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users (id) ON DELETE cascade,
+                               vet_id INTEGER REFERENCES vets (id) ON DELETE cascade)""",
+    """CREATE TABLE reviews (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users (id) ON DELETE cascade,
+                             vet_id INTEGER REFERENCES vets (id) ON DELETE cascade, timestamp TIMESTAMP NOT NULL,
+                             rating NUMERIC(2, 1) NOT NULL, comment TEXT)""",
+    "INSERT INTO clinics VALUES (1, 'SJ Clinic', '1 Main St', 'San Jose', 'CA', '95110', NULL, NULL)",
+    "INSERT INTO vets VALUES (1, 'Vet One', 1, 101)",
+    "INSERT INTO users VALUES (1, 'Test', 'User', 'testuser', 'test@test.com', 'not a hash')",
+    "INSERT INTO reviews VALUES (1, 1, 1, '2024-01-01 00:00:00', 4.0, 'Patient with nervous cats')",
+]
+
+
+class UpgradeTestCase(TestCase):
+    """Test upgrading a database made by the first version of the app."""
+
+    def setUp(self):
+        with app.app_context():
+            db.drop_all()
+            # Only SQLite numbers the rows of an INTEGER PRIMARY KEY by itself.
+            primary_key = 'SERIAL PRIMARY KEY' if db.engine.dialect.name == 'postgresql' else 'INTEGER PRIMARY KEY'
+            for statement in OLD_SCHEMA:
+                db.session.execute(text(statement.replace('INTEGER PRIMARY KEY', primary_key)))
+            db.session.commit()
+
+    def tearDown(self):
+        with app.app_context():
+            db.drop_all()
+            db.session.remove()
+
+    def test_upgrade(self):
+        """Are the new tables, columns and triggers added and filled in, keeping the data?"""
+
+        result = app.test_cli_runner().invoke(args=['upgrade-db'])
+        self.assertIn('clinics.source_key', result.output)
+        self.assertIn('Keyed and geocoded 1 clinics', result.output)
+
+        with app.app_context():
+            clinic = db.session.get(Clinic, 1)
+            self.assertEqual(clinic.source_key, 'sj clinic|san jose|95110')
+            self.assertIsNotNone(clinic.latitude)
+            self.assertTrue(clinic.active)
+            self.assertEqual((clinic.review_count, clinic.rating_sum), (1, 4))
+            vet = db.session.get(Vet, 1)
+            self.assertTrue(vet.active)
+            self.assertEqual(vet.rating_histogram, {1: 0, 2: 0, 3: 0, 4: 1, 5: 0})
+            self.assertEqual([match[0].id for match in search_vets_fulltext('nervous cats')], [1])
+            self.assertIsNotNone(db.session.get(DataVersion, 1))
+
+            Favorite.change(1, add=[1])
+            db.session.commit()
+            self.assertEqual(db.session.get(User, 1).favorites_version, 1)
+
+        result = app.test_cli_runner().invoke(args=['upgrade-db'])
+        self.assertIn('No columns to add', result.output)
@@ -118,3 +118,55 @@ class UserViewTestCase(TestCase):
                 rvs = Review.query.all()
                 self.assertIn('Test Vet', html)
                 self.assertIn('Do NOT like nor dislike', html)
+
+    def test_favorites_api(self):
+        """Do I get the ids of my favorites among the vets asked about, and a new ETag once they change?"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid
+
+            resp = c.get('/api/users/favorites')
+            self.assertEqual(resp.json, {'favorite_vets': {'ids': [self.vid]}, 'version': 1})
+            etag = resp.headers['ETag']
+            self.assertEqual(c.get(f'/api/users/favorites?vet_ids={self.vid + 1}').json['favorite_vets']['ids'], [])
+            self.assertEqual(c.get('/api/users/favorites', headers={'If-None-Match': etag}).status_code, 304)
+            self.assertEqual(c.get('/api/users/favorites?vet_ids=1,x').status_code, 400)
+
+            c.delete(f'/api/users/favorite/{self.vid}')
+            resp = c.get('/api/users/favorites', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json, {'favorite_vets': {'ids': []}, 'version': 2})
+            self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_set_favorite(self):
+        """Can I set a vet as a favorite or not, any number of times, and many at once?"""
+
+        with app.app_context():
+            vt = Vet(name='Other Vet', clinic_id=self.cid, fear_free_id=54321)
+            db.session.add(vt)
+            db.session.commit()
+            other_vid = vt.id
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.uid
+
+            url = f'/api/users/favorite/{other_vid}'
+            self.assertEqual([c.put(url).status_code, c.put(url).status_code], [201, 200])
+            resp = c.delete(url)
+            self.assertEqual(resp.json, {'favorite': {'vet_id': other_vid, 'favorite': False}})
+            self.assertEqual(c.delete(url).status_code, 200)
+            self.assertEqual(c.put('/api/users/favorite/99999').status_code, 404)
+
+            resp = c.patch('/api/users/favorites', json={'add': [self.vid, other_vid, 99999], 'remove': []})
+            self.assertEqual(resp.status_code, 404)
+            resp = c.patch('/api/users/favorites', json={'add': [self.vid, other_vid], 'remove': []})
+            self.assertEqual(resp.json, {'added': [other_vid], 'removed': []})
+            self.assertEqual(c.patch('/api/users/favorites', json={'add': ['x']}).status_code, 400)
+            self.assertEqual(c.patch('/api/users/favorites', json={'add': [1], 'remove': [1]}).status_code, 400)
+
+            with app.app_context():
+                favorites = Favorite.query.filter_by(user_id=self.uid).all()
+                self.assertEqual(sorted(f.vet_id for f in favorites), sorted([self.vid, other_vid]))
+                self.assertEqual(db.session.get(User, self.uid).favorites_version, 4)
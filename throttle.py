@@ -0,0 +1,172 @@
+"""Token bucket throttling of logins and signups, per IP address and per username.
+
+Each attempt takes a token from its IP's bucket and its username's bucket;
+with either one empty it's turned away before any database or bcrypt work.
+Buckets are kept per worker in TokenBuckets, a dict of a few numbers per key
+that evicts the least recently used keys, or with THROTTLE_SHARED_PATH set,
+in SharedTokenBuckets: a file every worker maps into memory, so the limits
+hold however many workers gunicorn runs.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+# A bucket of `capacity` tokens, refilled at `per_second` tokens a second.
+Limit = namedtuple('Limit', 'capacity per_second')
+
+# (per IP address, per username) limits of each throttled action.
+LIMITS = {
+    'login': (Limit(10, 10 / 60), Limit(5, 1 / 60)),
+    'signup': (Limit(10, 10 / 3600), Limit(3, 1 / 600)),
+}
+
+
+def key_digest(key):
+    """64-bit digest of a bucket's key, the same in every worker; never 0, which marks free slots."""
+
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+def refill(tokens, updated_at, limit, now):
+    """The tokens in a bucket now, that had `tokens` at updated_at; a new bucket is full."""
+
+    if tokens is None:
+        return float(limit.capacity)
+    return min(limit.capacity, tokens + max(now - updated_at, 0) * limit.per_second)
+
+def take_tokens(levels, limits):
+    """(new levels, seconds to wait) of taking a token from each bucket: all of them or none."""
+
+    wait = max(((1 - level) / limit.per_second for level, limit in zip(levels, limits) if level < 1), default=0.0)
+    return (levels if wait else [level - 1 for level in levels]), wait
+
+
+class TokenBuckets:
+    """Token buckets of one worker, keeping at most max_keys of them."""
+
+    def __init__(self, max_keys=100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        # {key digest: (tokens, updated at)}, least recently used first.
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, buckets):
+        """Take a token from each of buckets, [(key, Limit)], if they all have one; return the seconds to wait."""
+
+        now = self.clock()
+        digests = [key_digest(key) for key, limit in buckets]
+        limits = [limit for key, limit in buckets]
+        with self._lock:
+            levels = [refill(*self._buckets.pop(digest, (None, None)), limit, now)
+                      for digest, limit in zip(digests, limits)]
+            levels, wait = take_tokens(levels, limits)
+            for digest, level in zip(digests, levels):
+                self._buckets[digest] = (level, now)
+            while len(self._buckets) > self.max_keys:
+                del self._buckets[next(iter(self._buckets))]
+                self.evictions += 1
+        return wait
+
+
+class SharedTokenBuckets:
+    """Token buckets shared by every process mapping the file at path, i.e. one in /dev/shm.
+
+    Keys hash into a fixed number of slots; a key whose slot another key took
+    over starts again with a full bucket. Processes lock the file around
+    each update.
+    """
+
+    SLOT = struct.Struct('<Qdd')
+
+    def __init__(self, path, slots=65536, clock=time.monotonic):
+        self.path = path
+        self.slots = slots
+        self.clock = clock
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * self.SLOT.size
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def take(self, buckets):
+        """Take a token from each of buckets, [(key, Limit)], if they all have one; return the seconds to wait."""
+
+        now = self.clock()
+        digests = [key_digest(key) for key, limit in buckets]
+        limits = [limit for key, limit in buckets]
+        offsets = [digest % self.slots * self.SLOT.size for digest in digests]
+        # flock() doesn't keep this process's threads apart.
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                levels = []
+                for digest, limit, offset in zip(digests, limits, offsets):
+                    slot_digest, tokens, updated_at = self.SLOT.unpack_from(self._map, offset)
+                    if slot_digest != digest:
+                        self.evictions += slot_digest != 0
+                        tokens = updated_at = None
+                    levels.append(refill(tokens, updated_at, limit, now))
+                levels, wait = take_tokens(levels, limits)
+                for digest, level, offset in zip(digests, levels, offsets):
+                    self.SLOT.pack_into(self._map, offset, digest, level, now)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return wait
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class Throttle:
+    """Limits on the attempts at each action in LIMITS, per IP address and per username."""
+
+    def __init__(self, store=None, limits=LIMITS):
+        self.store = store or TokenBuckets()
+        self.limits = limits
+        self.enabled = True
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def init_app(self, app):
+        """Configure from THROTTLE_ENABLED and THROTTLE_SHARED_PATH."""
+
+        self.enabled = app.config.get('THROTTLE_ENABLED', True)
+        if app.config.get('THROTTLE_SHARED_PATH'):
+            self.store = SharedTokenBuckets(app.config['THROTTLE_SHARED_PATH'])
+
+    def attempt(self, action, ip, username):
+        """Count an attempt at action; return 0 if it may go ahead, else the seconds until it may."""
+
+        if not self.enabled:
+            return 0.0
+        ip_limit, username_limit = self.limits[action]
+        buckets = [(f'{action}:ip:{ip}', ip_limit)]
+        if username:
+            buckets.append((f'{action}:username:{username.strip().lower()}', username_limit))
+        wait = self.store.take(buckets)
+        with self._lock:
+            if wait:
+                self.rejected += 1
+            else:
+                self.allowed += 1
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return {'allowed': self.allowed, 'rejected': self.rejected, 'evictions': self.store.evictions}
+
+
+throttle = Throttle()